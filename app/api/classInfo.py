@@ -1,9 +1,10 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel
 from typing import Optional,List
 from app.db.connection import get_connection
+from app.db.id_generator import new_id
+from app.services.ProfileCache import profile_cache
 import logging
-import uuid
 
 logger = logging.getLogger()
 router = APIRouter()
@@ -18,7 +19,7 @@ class ClassCreate(BaseModel):
 @router.post("/api/addclass", response_model=dict, status_code=200)
 def create_class(req: ClassCreate):
     """
-    新建班级并加入学生（使用 uuid4.hex 前 12 位作为 id）
+    新建班级并加入学生（id 由 app.db.id_generator 生成）
     请求示例:
     {
         "name": "汗建国",
@@ -48,31 +49,16 @@ def create_class(req: ClassCreate):
         if row:
             class_id = row[0]
         else:
-            # 生成 12 位 id 并插入 class 表，冲突重试最多 5 次
-            class_id = None
-            for _ in range(5):
-                candidate = uuid.uuid4().hex[:12]
-                try:
-                    cursor.execute("INSERT INTO class (id, `name`, `owner`) VALUES (%s, %s, %s)", (candidate, req.name, req.owner))
-                    conn.commit()
-                    class_id = candidate
-                    break
-                except Exception as e:
-                    conn.rollback()
-                    msg = str(e).lower()
-                    if "duplicate" in msg or "unique" in msg or "1062" in msg:
-                        continue
-                    raise HTTPException(status_code=500, detail=f"插入班级失败: {e}")
-
-            if class_id is None:
-                raise HTTPException(status_code=500, detail="生成班级ID失败，请重试")
+            class_id = new_id()
+            cursor.execute("INSERT INTO class (id, `name`, `owner`) VALUES (%s, %s, %s)", (class_id, req.name, req.owner))
+            conn.commit()
+            profile_cache.invalidate_classes()
 
         # 插入 student_class 映射表 (student_id, class_id)，先校验 student 存在并避免重复映射
         if req.studentlist:
             for student_id in req.studentlist:
                 # 验证 student_id 在 user_info 表中存在（student_id 对应 user_info.id）
-                cursor.execute("SELECT id FROM user_info WHERE id = %s LIMIT 1", (student_id,))
-                if not cursor.fetchone():
+                if not profile_cache.user_exists(student_id, cursor):
                     logger.warning(f"学生不存在，跳过映射: {student_id}")
                     continue
 
@@ -105,31 +91,26 @@ def create_class(req: ClassCreate):
 
 
 @router.get("/api/searchclass", response_model=dict, status_code=200)
-def get_all_classes():
+def get_all_classes(request: Request, response: Response):
     """
     返回 class 表中所有班级的 id 和 name
-    无需请求体，直接调用
+    无需请求体，直接调用；响应带 ETag，请求头 If-None-Match 与之相同时返回 304（无响应体）
     返回: {"code":200, "data": {"classes": [{"id":"...", "name":"..."}]}}
     """
     try:
-        conn = get_connection()
-        if not conn:
-            raise HTTPException(status_code=500, detail="数据库连接失败")
-
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, `name` FROM class")
-        rows = cursor.fetchall()
-        classes = [{"id": r[0], "name": r[1]} for r in rows] if rows else []
-
-        cursor.close()
-        conn.close()
-
-        return {"code": 200, "data": {"classes": classes}}
-
+        classes, etag = profile_cache.get_classes()
     except Exception as e:
         logger.error(f"查询所有班级失败: {e}")
         raise HTTPException(status_code=500, detail=f"服务器错误: {e}")
 
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return {"code": 200, "data": {"classes": classes}}
+
 
 class DeleteClassReq(BaseModel):
     class_id: str
@@ -166,6 +147,7 @@ def delete_class(req: DeleteClassReq):
         cursor.execute("DELETE FROM class WHERE id = %s", (class_id,))
 
         conn.commit()
+        profile_cache.invalidate_classes()
         logger.info(f"删除班级成功: ID={class_id}")
         return {"code": 200}
 
@@ -1,15 +1,34 @@
-from fastapi import APIRouter, HTTPException, File, UploadFile, Form
+from fastapi import APIRouter, HTTPException, File, UploadFile, Form, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import Response
 from pydantic import BaseModel
 from typing import Optional, List
 from app.db.connection import get_connection
+from app.db.sign_record import mark_signed, pending_students
 import logging
 import uuid
 import os
 from pathlib import Path
 from app.services.FaceRecognitionService import FaceRecognitionService
-from app.utils.FeatureBinaryConver import feature_to_bytes, bytes_to_feature
+from app.services.FaceMatcher import Gallery, greedy_match, distance_to_cosine, cosine_to_distance
+from app.services.FeatureProjection import get_active_projection
+from app.services.AnnIndex import get_ann_index
+from app.services.GallerySnapshot import get_gallery_snapshot, load_student_gallery
+from app.services.ShardedGallery import get_sharded_gallery
+from app.services.FaceTracker import FaceTracker
+from app.services.FaceTemplates import TemplateCache, add_template, refine_with_templates
+from app.services.InferenceCache import InferenceResult, inference_cache
+from app.services.SignEventBus import sign_event_bus
+from app.services.FaceQuality import PROFILES, REASON_TEXT, filter_faces, quality_stats
+from app.services.ProfileCache import profile_cache
+from app.utils.FeatureBinaryConver import parse_header, bytes_to_feature, DEFAULT_MODEL_ID, LEGACY_SHAPE
+from app.utils.CropArchive import get_sign_in_pack, crop_url, get_face_crop_pack, read_face_crop
+from app.utils.FrameStream import FrameDeduplicator, iter_image_uploads, iter_video_frames
 from PIL import Image
 import io
+import time
+import base64
+import binascii
 import numpy as np
 
 logger = logging.getLogger()
@@ -18,14 +37,55 @@ router = APIRouter()
 # 初始化人脸识别服务
 face_service = FaceRecognitionService()
 
+# 注册原图保存策略: keep 保留原图 / downscale 缩小后保存 / drop 不保存原图（face_path 指向对齐人脸图）
+# 三种策略的 face_path 格式相同，均为 faces/<文件名>
+FACE_ORIGINAL_POLICY = os.environ.get("FACE_ORIGINAL_POLICY", "keep").lower()
+# downscale 策略下原图最长边像素
+FACE_ORIGINAL_MAX_SIDE = int(os.environ.get("FACE_ORIGINAL_MAX_SIDE", "640"))
+
+
+def resolve_quality_profile(name: Optional[str], default: str) -> str:
+    """校验接口传入的质量配置名称，未传入时使用该接口的默认配置"""
+    name = name or default
+    if name not in PROFILES:
+        raise HTTPException(status_code=400, detail=f"未知的质量配置: {name}，可选: {', '.join(PROFILES)}")
+    return name
+
+
+def save_sign_in_crop(sign_task_id: str, image, box, **meta):
+    """
+    按人脸框裁剪并追加到签到任务的打包文件（JPEG q90），返回 crop_id，失败返回 None
+
+    参数:
+        box: [x1,y1,x2,y2]，为 None 时保存整张图
+        meta: 写入索引的附加字段（idx / student_id / matched / distance 等）
+    """
+    try:
+        if box is not None:
+            x1, y1, x2, y2 = map(int, map(round, box))
+            crop = image.crop((max(0, x1), max(0, y1), min(image.width, x2), min(image.height, y2)))
+        else:
+            crop = image
+        buf = io.BytesIO()
+        crop.save(buf, format="JPEG", quality=90)
+        return get_sign_in_pack(sign_task_id).append(buf.getvalue(), **meta)["crop_id"]
+    except Exception as e:
+        logger.error(f"保存裁剪图片失败: {e}")
+        return None
+
 
 @router.post("/api/upload_face")
 async def upload_face(
     user_id: str = Form(..., description="用户ID"),
-    face_image: UploadFile = File(..., description="人脸照片文件")
+    face_image: UploadFile = File(..., description="人脸照片文件"),
+    quality_profile: Optional[str] = Form(None, description="人脸质量配置，默认 enroll"),
+    replace_templates: bool = Form(False, description="是否清空已有模板重新注册（默认追加为新模板）")
 ):
     """
     上传用户人脸照片并提取特征向量
+    每次上传追加为该用户的一个注册模板（face_template），user_info.face_feature 更新为全部模板的质心；
+    同时保存 160x160 对齐人脸图到 app/static/faceCrops/enroll.pack，
+    原图按 FACE_ORIGINAL_POLICY 保留(keep)/缩小(downscale)/丢弃(drop)
     """
     logger.info(f"收到上传请求: user_id={user_id}, filename={face_image.filename}, content_type={face_image.content_type}")
     
@@ -40,6 +100,7 @@ async def upload_face(
     file_ext = os.path.splitext(face_image.filename)[1].lower()
     if file_ext not in allowed_extensions:
         raise HTTPException(status_code=400, detail="仅支持 jpg, jpeg, png, bmp 格式")
+    quality_profile = resolve_quality_profile(quality_profile, "enroll")
 
     conn = None
     cursor = None
@@ -52,8 +113,7 @@ async def upload_face(
             raise HTTPException(status_code=500, detail="数据库连接失败")
         
         cursor = conn.cursor()
-        cursor.execute("SELECT id FROM user_info WHERE id = %s LIMIT 1", (user_id,))
-        if not cursor.fetchone():
+        if not profile_cache.user_exists(user_id, cursor):
             raise HTTPException(status_code=404, detail="用户不存在")
 
         # 读取文件内容
@@ -61,53 +121,43 @@ async def upload_face(
         if len(content) == 0:
             raise HTTPException(status_code=400, detail="上传的文件为空")
         
-        # 创建保存目录
-        base_dir = Path("app/static/faces")
-        base_dir.mkdir(parents=True, exist_ok=True)
-
-        # 生成唯一文件名
-        unique_filename = f"{user_id}_{uuid.uuid4().hex[:8]}{file_ext}"
-        file_path = base_dir / unique_filename
-        
-        # 保存文件到磁盘
-        with open(file_path, "wb") as f:
-            f.write(content)
-        
-        logger.info(f"文件已保存: {file_path}")
-        
         # 使用 PIL 打开图片
         try:
             # ✅ 从内存中打开图片（而不是从文件路径）
             pil_image = Image.open(io.BytesIO(content))
             
-            # 如果是 RGBA 模式，转换为 RGB
-            if pil_image.mode == 'RGBA':
+            # 统一转换为 RGB
+            if pil_image.mode != 'RGB':
                 pil_image = pil_image.convert('RGB')
             
             logger.info(f"图片尺寸: {pil_image.size}, 模式: {pil_image.mode}")
             
         except Exception as img_error:
-            # 删除已保存的文件
-            if file_path and file_path.exists():
-                os.remove(file_path)
             logger.error(f"图片格式错误: {img_error}")
             raise HTTPException(status_code=400, detail="图片格式错误，无法解析")
         
-        # 检测人脸并提取特征向量
+        # 检测人脸并提取特征向量，同时保存对齐人脸图
         try:
-            # ✅ 使用 detect_and_extract 方法（一步完成）
-            features_list, boxes = face_service.detect_and_extract(pil_image)
-            
-            if len(features_list) == 0 or len(boxes) == 0:
-                # 未检测到人脸，删除文件
-                if file_path and file_path.exists():
-                    os.remove(file_path)
+            # 检测框按面积从大到小排列，只对第一个（最大的）人脸做质量检查、对齐和特征提取
+            boxes, probs, landmarks = face_service.detect_with_landmarks(pil_image)
+            if boxes is None or len(boxes) == 0:
                 logger.warning(f"未检测到人脸: user_id={user_id}")
                 raise HTTPException(status_code=400, detail="未检测到人脸，请上传清晰的正面照片")
             
-            # 如果检测到多个人脸，选择第一个（也可以选择面积最大的）
-            if len(features_list) > 1:
-                logger.warning(f"检测到 {len(features_list)} 个人脸，使用第一个")
+            if len(boxes) > 1:
+                logger.warning(f"检测到 {len(boxes)} 个人脸，使用第一个")
+            
+            keep, rejected = filter_faces(
+                pil_image, boxes[:1], probs[:1], landmarks[:1] if landmarks is not None else None, quality_profile
+            )
+            if not keep:
+                logger.warning(f"注册人脸质量不合格: user_id={user_id}, {rejected[0]}")
+                raise HTTPException(status_code=400, detail=f"人脸质量不合格: {rejected[0]['message']}，请上传清晰的正面照片")
+            
+            faces = face_service.align_faces(pil_image, boxes[:1])
+            features_list = face_service.extract_features(faces)
+            if len(features_list) == 0:
+                raise HTTPException(status_code=400, detail="未检测到人脸，请上传清晰的正面照片")
             
             # 获取第一个人脸的特征向量（numpy array, shape=(512,)）
             face_features = features_list[0]
@@ -116,47 +166,87 @@ async def upload_face(
             logger.info(f"提取到人脸特征: shape={face_features.shape}, dtype={face_features.dtype}")
             logger.info(f"人脸位置: x1={face_box[0]:.0f}, y1={face_box[1]:.0f}, x2={face_box[2]:.0f}, y2={face_box[3]:.0f}")
             
-            # 将特征向量转换为二进制
-            feature_bytes = feature_to_bytes(face_features)
-            logger.info(f"特征向量转换为二进制: size={len(feature_bytes)} bytes")
+            # 启用降维投影时模板与质心都存储投影后的特征
+            projection = get_active_projection()
+            template_vec = projection.project(face_features) if projection is not None else face_features
+
+            # 保存对齐人脸图，后续更换模型时可跳过检测直接重新提取特征
+            aligned = face_service.face_tensor_to_image(faces[0])
+            buf = io.BytesIO()
+            aligned.save(buf, format="JPEG", quality=95)
+            crop_entry = get_face_crop_pack().append(buf.getvalue(), user_id=user_id)
+            logger.info(f"对齐人脸图已保存: crop_id={crop_entry['crop_id']}, size={crop_entry['length']} bytes")
             
         except HTTPException:
             raise
         except Exception as face_error:
-            # 人脸识别失败，删除文件
-            if file_path and file_path.exists():
-                os.remove(file_path)
             logger.error(f"人脸特征提取失败: {face_error}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"人脸特征提取失败: {str(face_error)}")
-        finally:
-            # 关闭 PIL Image 对象
-            if 'pil_image' in locals():
-                pil_image.close()
-        
-        # 相对路径
+
+        # 按策略保存原图
+        base_dir = Path("app/static/faces")
+        base_dir.mkdir(parents=True, exist_ok=True)
+        if FACE_ORIGINAL_POLICY == "drop":
+            # 不保存原图，保存 160x160 对齐人脸图（与其他策略相同的 faces/ 路径，调用方无需区分）
+            unique_filename = f"{user_id}_{uuid.uuid4().hex[:8]}.jpg"
+            file_path = base_dir / unique_filename
+            with open(file_path, "wb") as f:
+                f.write(buf.getvalue())
+        elif FACE_ORIGINAL_POLICY == "downscale":
+            unique_filename = f"{user_id}_{uuid.uuid4().hex[:8]}.jpg"
+            file_path = base_dir / unique_filename
+            small = pil_image.convert('RGB')
+            small.thumbnail((FACE_ORIGINAL_MAX_SIDE, FACE_ORIGINAL_MAX_SIDE))
+            small.save(file_path, format="JPEG", quality=90)
+        else:
+            unique_filename = f"{user_id}_{uuid.uuid4().hex[:8]}{file_ext}"
+            file_path = base_dir / unique_filename
+            with open(file_path, "wb") as f:
+                f.write(content)
+
+        logger.info(f"文件已保存: {file_path}")
         relative_path = f"faces/{unique_filename}"
         
-        # 更新数据库（同时保存路径和特征向量）
-        cursor.execute(
-            "UPDATE user_info SET face_path = %s, face_feature = %s WHERE id = %s",
-            (relative_path, feature_bytes, user_id)
+        # 更新数据库: 追加模板并重新计算质心（写入 face_feature），同时保存路径
+        vec, spread, template_count = add_template(
+            cursor, user_id, template_vec, projection,
+            crop_id=crop_entry["crop_id"], replace=replace_templates
         )
-        
-        if cursor.rowcount == 0:
+        if vec is None:
             # 删除已保存的文件
+            conn.rollback()
             if file_path and file_path.exists():
                 os.remove(file_path)
             raise HTTPException(status_code=500, detail="更新数据库失败")
+        cursor.execute("UPDATE user_info SET face_path = %s WHERE id = %s", (relative_path, user_id))
         
         conn.commit()
+
+        # 增量更新全校 ANN 索引与底库快照（尚未构建时跳过，首次使用时会全量构建），底库中使用质心
+        try:
+            index = get_ann_index(projection, build_if_missing=False)
+            if index is not None:
+                index.upsert(user_id, vec)
+        except Exception as e:
+            logger.error(f"更新 ANN 索引失败: user_id={user_id}, {e}")
+        try:
+            get_gallery_snapshot().upsert(user_id, vec)
+        except Exception as e:
+            logger.error(f"更新底库快照失败: user_id={user_id}, {e}")
+        try:
+            get_sharded_gallery(projection)
+        except Exception as e:
+            logger.error(f"更新分片底库失败: user_id={user_id}, {e}")
         
-        logger.info(f"上传成功: user_id={user_id}, path={relative_path}, feature_size={len(feature_bytes)}")
+        logger.info(f"上传成功: user_id={user_id}, path={relative_path}, templates={template_count}, spread={spread:.4f}")
         return {
             "code": 200,
             "message": "上传成功，人脸特征已提取",
             "face_path": relative_path,
             "feature_dimension": len(face_features),
-            "face_count": len(features_list)  # 告诉前端检测到几个人脸
+            "template_count": template_count,
+            "template_spread": spread,
+            "face_count": len(boxes)  # 告诉前端检测到几个人脸
         }
 
     except HTTPException:
@@ -172,6 +262,12 @@ async def upload_face(
         logger.error(f"上传人脸照片失败: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"服务器错误: {str(e)}")
     finally:
+        # 关闭 PIL Image 对象
+        if 'pil_image' in locals():
+            try:
+                pil_image.close()
+            except Exception:
+                pass
         try:
             if cursor:
                 cursor.close()
@@ -180,15 +276,28 @@ async def upload_face(
         except Exception:
             pass
 
+
+@router.get("/api/face_crop/{user_id}")
+def get_face_crop(user_id: str):
+    """
+    返回用户最新的注册对齐人脸图（160x160 JPEG）
+    """
+    data, entry = read_face_crop(user_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="对齐人脸图不存在")
+    return Response(content=data, media_type="image/jpeg")
+
 @router.post("/api/sign_task/recognize", response_model=dict, status_code=200)
 async def recognize_and_sign(
     sign_task_id: str = Form(..., description="签到任务ID"),
     photo: UploadFile = File(..., description="多人照片文件"),
-    threshold: float = Form(0.8, description="比对阈值，距离小于等于该值认为匹配（默认0.8）")
+    threshold: float = Form(0.8, description="比对阈值，距离小于等于该值认为匹配（默认0.8）"),
+    cos_threshold: Optional[float] = Form(None, description="余弦相似度阈值，提供时优先于 threshold（0.8 距离等价于 0.68）"),
+    quality_profile: Optional[str] = Form(None, description="人脸质量配置，默认 recognize，off 表示不过滤")
 ):
     """
     上传多人照片，识别照片上的所有人，并对比指定签到任务中未签到的学生，
-    匹配成功则更新对应 sign_record 为已签到，并保存人脸裁剪图到 app/static/signInFaces/<sign_task_id>/
+    匹配成功则更新对应 sign_record 为已签到，并将人脸裁剪图追加到 app/static/signInFaces/<sign_task_id>.pack
     返回匹配结果汇总。
     """
     logger.info(f"收到识别签到请求: sign_task_id={sign_task_id}, filename={photo.filename}, content_type={photo.content_type}")
@@ -197,10 +306,10 @@ async def recognize_and_sign(
         raise HTTPException(status_code=400, detail="需要提供 sign_task_id")
     if not photo or not photo.filename:
         raise HTTPException(status_code=400, detail="需要上传照片文件")
+    quality_profile = resolve_quality_profile(quality_profile, "recognize")
 
     conn = None
     cursor = None
-    saved_paths = []
     results = []
 
     try:
@@ -217,116 +326,110 @@ async def recognize_and_sign(
         class_id = row[0]
 
         # 查询该任务中未签到的学生记录（sign_status != 1）
-        cursor.execute("SELECT student_id FROM sign_record WHERE sign_task_id = %s AND sign_status != 1", (sign_task_id,))
-        pending_rows = cursor.fetchall()
-        pending_student_ids = [r[0] for r in pending_rows] if pending_rows else []
+        pending_student_ids = pending_students(cursor, sign_task_id)
         if not pending_student_ids:
             return {"code": 200, "message": "没有未签到的学生", "matched": 0, "details": []}
 
-        # 读取这些学生的人脸特征
-        cursor.execute(
-            "SELECT id, face_feature FROM user_info WHERE id IN ({})".format(
-                ",".join(["%s"] * len(pending_student_ids))
-            ), tuple(pending_student_ids)
-        )
-        users = cursor.fetchall()  # list of (id, face_feature)
-        user_features = {}
-        for uid, feature_blob in users:
-            try:
-                if feature_blob is None:
-                    continue
-                user_features[uid] = bytes_to_feature(feature_blob)
-            except Exception as e:
-                logger.error(f"解析用户 {uid} 特征失败: {e}")
+        # 读取这些学生的人脸特征：优先使用内存映射的底库快照，快照中没有的再读取数据库 BLOB
+        gallery = load_student_gallery(cursor, pending_student_ids, get_active_projection())
 
         # 读取上传图片
         content = await photo.read()
         if len(content) == 0:
             raise HTTPException(status_code=400, detail="上传的文件为空")
 
-        try:
-            pil_image = Image.open(io.BytesIO(content)).convert('RGB')
-        except Exception as e:
-            logger.error(f"图片解析失败: {e}")
-            raise HTTPException(status_code=400, detail="图片格式错误，无法解析")
+        # 相同内容的重试上传直接复用推理结果（检测框与特征），只重新做比对
+        cache_key = inference_cache.key(content, quality_profile)
+        cached = inference_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"命中推理缓存: sign_task_id={sign_task_id}, faces={len(cached.boxes)}")
+            features_list, boxes, rejected = list(cached.features), cached.boxes, cached.rejected
+        else:
+            try:
+                pil_image = Image.open(io.BytesIO(content)).convert('RGB')
+            except Exception as e:
+                logger.error(f"图片解析失败: {e}")
+                raise HTTPException(status_code=400, detail="图片格式错误，无法解析")
 
-        # 检测并提取所有人脸特征
-        features_list, boxes = face_service.detect_and_extract(pil_image)
+            # 检测人脸，质量不合格的不提取特征、不保存裁剪图
+            features_list, boxes, rejected = face_service.detect_and_extract_quality(pil_image, quality_profile)
+            inference_cache.put(cache_key, InferenceResult(features_list, boxes, rejected))
         if len(features_list) == 0:
+            if rejected:
+                return {"code": 200, "message": "照片中的人脸质量均不合格", "matched_count": 0,
+                        "details": [], "rejected": rejected}
             raise HTTPException(status_code=400, detail="照片中未检测到人脸")
 
-        # 创建保存目录
-        save_base = Path("app/static/signInFaces") / sign_task_id
-        save_base.mkdir(parents=True, exist_ok=True)
+        # 一次矩阵乘法得到所有人脸与所有未签到学生的余弦相似度，再按人脸顺序贪心分配
+        if cos_threshold is None:
+            cos_threshold = distance_to_cosine(threshold)
+        queries = gallery.prepare_queries(np.stack(features_list))
+        sims = queries @ gallery.matrix.T
+        # 质心相似度模糊的人脸再与候选学生的多个注册模板比对
+        refine_with_templates(sims, queries, gallery, TemplateCache(cursor, gallery.projection), cos_threshold)
+        assignments = greedy_match(sims, cos_threshold)
 
         matched_student_set = set()
+        # 同一图片在该任务中已保存过裁剪图（重试上传）时不再重复保存
+        saved_crops = cached.crops.get(sign_task_id) if cached is not None else None
+        if saved_crops is not None and len(saved_crops) != len(assignments):
+            saved_crops = None
+        if saved_crops is None and 'pil_image' not in locals():
+            pil_image = Image.open(io.BytesIO(content)).convert('RGB')
+        crop_ids = []
 
-        # 对每个检测到的人脸进行比对并保存裁剪图（无论匹配与否都保存）
-        for idx, feat in enumerate(features_list):
+        # 对每个检测到的人脸记录比对结果并保存裁剪图（无论匹配与否都保存）
+        for idx, (col, best_cos) in enumerate(assignments):
             box = boxes[idx] if idx < len(boxes) else None
-            best_match = None
-            best_distance = None
-
-            for student_id, stored_feat in user_features.items():
-                if student_id in matched_student_set:
-                    continue  # 已被其它人脸匹配过
-                try:
-                    dist = float(np.linalg.norm(feat - stored_feat))
-                except Exception as e:
-                    logger.error(f"计算距离出错: {e}")
-                    continue
-                if best_distance is None or dist < best_distance:
-                    best_distance = dist
-                    best_match = student_id
+            best_distance = cosine_to_distance(best_cos) if best_cos is not None else None
 
             matched_flag = 0
             matched_student_id = None
-            if best_match is not None and best_distance is not None and best_distance <= threshold:
+            if col is not None:
+                best_match = gallery.ids[col]
                 # 更新 sign_record 为已签到（1），并写入 face_score
-                cursor.execute(
-                    "UPDATE sign_record SET sign_status = %s, face_score = %s WHERE sign_task_id = %s AND student_id = %s",
-                    (1, best_distance, sign_task_id, best_match)
-                )
+                mark_signed(cursor, sign_task_id, best_match, best_distance)
                 conn.commit()
+                sign_event_bus.publish_sign_status(sign_task_id, best_match, 1, best_distance)
                 matched_student_set.add(best_match)
                 matched_flag = 1
                 matched_student_id = best_match
-                logger.info(f"匹配成功: student_id={best_match}, distance={best_distance:.4f}")
+                logger.info(f"匹配成功: student_id={best_match}, distance={best_distance:.4f}, cos={best_cos:.4f}")
             else:
                 logger.debug(f"未匹配的人脸 idx={idx}, best_distance={best_distance}")
 
-            # 保存裁剪人脸图（始终保存），文件名包含是否匹配标记 1/0 和学生 id 或 unknown
-            save_path = None
-            try:
-                if box is not None:
-                    x1, y1, x2, y2 = map(int, map(round, box))
-                    x1 = max(0, x1); y1 = max(0, y1)
-                    x2 = min(pil_image.width, x2); y2 = min(pil_image.height, y2)
-                    crop = pil_image.crop((x1, y1, x2, y2))
-                else:
-                    crop = pil_image
-
-                id_part = matched_student_id if matched_student_id else "unknown"
-                filename = f"{sign_task_id}_{idx}_{id_part}_{matched_flag}_{uuid.uuid4().hex[:8]}.jpg"
-                save_path = save_base / filename
-                crop.save(save_path, format="JPEG", quality=90)
-                saved_paths.append(str(save_path))
-            except Exception as e:
-                logger.error(f"保存裁剪图片失败: {e}")
-                save_path = None
+            # 保存裁剪人脸图（始终保存），追加到 app/static/signInFaces/<sign_task_id>.pack，索引中记录是否匹配和学生 id
+            if saved_crops is not None:
+                crop_id = saved_crops[idx]
+            else:
+                crop_id = save_sign_in_crop(
+                    sign_task_id, pil_image, box,
+                    idx=idx,
+                    student_id=matched_student_id,
+                    matched=matched_flag,
+                    distance=best_distance
+                )
+            crop_ids.append(crop_id)
 
             results.append({
                 "student_id": matched_student_id,
                 "distance": best_distance,
+                "similarity": best_cos,
                 "matched": matched_flag,
-                "saved_path": str(save_path) if save_path else None
+                "crop_id": crop_id,
+                "saved_path": crop_url(sign_task_id, crop_id) if crop_id else None
             })
 
+        if saved_crops is None:
+            inference_cache.add_crops(cache_key, sign_task_id, crop_ids)
+
         return {
             "code": 200,
             "message": "识别并签到完成",
             "matched_count": len(matched_student_set),
-            "details": results
+            "details": results,
+            "rejected": rejected,
+            "cached": cached is not None
         }
 
     except HTTPException:
@@ -348,3 +451,883 @@ async def recognize_and_sign(
         except Exception:
             pass
 
+
+# 多帧识别: 单帧未达阈值、但相似度在阈值以下该范围内的人脸计入该学生的跨帧证据
+BURST_EVIDENCE_MARGIN = 0.1
+# 多帧识别: 至少累计几帧证据才用平均特征判定
+BURST_MIN_EVIDENCE = 2
+
+
+@router.post("/api/sign_task/recognize_burst", response_model=dict, status_code=200)
+def recognize_burst(
+    sign_task_id: str = Form(..., description="签到任务ID"),
+    photos: List[UploadFile] = File(None, description="连拍照片（按拍摄顺序）"),
+    video: UploadFile = File(None, description="短视频（与 photos 二选一）"),
+    threshold: float = Form(0.8, description="比对阈值，距离小于等于该值认为匹配（默认0.8）"),
+    cos_threshold: Optional[float] = Form(None, description="余弦相似度阈值，提供时优先于 threshold"),
+    sample_fps: float = Form(2.0, description="视频每秒采样帧数"),
+    max_frames: int = Form(60, description="最多处理的帧数"),
+    quality_profile: Optional[str] = Form(None, description="人脸质量配置，默认 burst")
+):
+    """
+    多帧签到：上传一组连拍照片或一段短视频，逐帧流式解码识别，跨帧汇总每个学生的人脸特征
+
+    - 与已处理帧近似重复（dHash）的帧直接跳过
+    - 单帧匹配成功立即签到；单帧未达阈值的人脸按最相似的学生累计，
+      多帧平均特征达到阈值同样判定为匹配（侧脸、遮挡等单帧质量差的情况）
+    - 所有未签到学生都已匹配时提前结束，不再解码剩余帧
+    - 只保存匹配成功的人脸裁剪图（每个学生一张）
+
+    普通 def: 解码、逐帧推理和数据库操作都是阻塞的，由 FastAPI 放到线程池执行，不阻塞事件循环
+    （只通过 UploadFile.file 同步读取上传内容）
+    """
+    logger.info(f"收到多帧识别签到请求: sign_task_id={sign_task_id}, photos={len(photos or [])}, video={bool(video)}")
+
+    if not sign_task_id or sign_task_id.strip() == "":
+        raise HTTPException(status_code=400, detail="需要提供 sign_task_id")
+    photos = [p for p in (photos or []) if p and p.filename]
+    has_video = video is not None and bool(video.filename)
+    if not photos and not has_video:
+        raise HTTPException(status_code=400, detail="需要上传连拍照片或视频")
+    if photos and has_video:
+        raise HTTPException(status_code=400, detail="连拍照片与视频只能二选一")
+    quality_profile = resolve_quality_profile(quality_profile, "burst")
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        if not conn:
+            raise HTTPException(status_code=500, detail="数据库连接失败")
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT class_id FROM sign_task WHERE sign_task_id = %s LIMIT 1", (sign_task_id,))
+        if not cursor.fetchone():
+            raise HTTPException(status_code=404, detail="签到任务不存在")
+
+        pending_student_ids = pending_students(cursor, sign_task_id)
+        if not pending_student_ids:
+            return {"code": 200, "message": "没有未签到的学生", "matched_count": 0, "details": []}
+
+        gallery = load_student_gallery(cursor, pending_student_ids, get_active_projection())
+        if len(gallery) == 0:
+            return {"code": 200, "message": "未签到的学生都没有人脸特征", "matched_count": 0, "details": []}
+        if cos_threshold is None:
+            cos_threshold = distance_to_cosine(threshold)
+
+        frames = iter_video_frames(video, sample_fps, max_frames) if has_video else iter_image_uploads(photos[:max_frames])
+        dedup = FrameDeduplicator()
+        templates = TemplateCache(cursor, gallery.projection)
+        available = np.ones(len(gallery), dtype=bool)
+        evidence = np.zeros_like(gallery.matrix)
+        evidence_count = np.zeros(len(gallery), dtype=np.int32)
+        best_face = {}  # 列 -> (相似度, 帧序号, 人脸框)，用于保存裁剪图
+        results = []
+        unpublished = []  # 本帧已签到、提交后再推送的 (student_id, distance)
+        stats = {"frames": 0, "processed": 0, "duplicates": 0, "faces": 0, "rejected": 0, "early_exit": False}
+
+        def sign(col, cos, frame_no, image, box, source):
+            student_id = gallery.ids[col]
+            distance = cosine_to_distance(cos)
+            mark_signed(cursor, sign_task_id, student_id, distance)
+            unpublished.append((student_id, distance))
+            available[col] = False
+            crop_id = save_sign_in_crop(
+                sign_task_id, image, box,
+                idx=frame_no, student_id=student_id, matched=1, distance=distance, mode="burst"
+            ) if image is not None else None
+            results.append({
+                "student_id": student_id,
+                "distance": distance,
+                "similarity": cos,
+                "frame": frame_no,
+                "source": source,
+                "crop_id": crop_id,
+                "saved_path": crop_url(sign_task_id, crop_id) if crop_id else None
+            })
+            logger.info(f"多帧匹配成功: student_id={student_id}, frame={frame_no}, cos={cos:.4f}, source={source}")
+
+        try:
+            for frame_no, image in frames:
+                stats["frames"] += 1
+                if image is None:
+                    continue
+                try:
+                    if dedup.is_duplicate(image):
+                        stats["duplicates"] += 1
+                        continue
+                    stats["processed"] += 1
+
+                    features_list, boxes, rejected = face_service.detect_and_extract_quality(image, quality_profile)
+                    stats["faces"] += len(features_list) + len(rejected)
+                    stats["rejected"] += len(rejected)
+                    if len(features_list) == 0:
+                        continue
+
+                    queries = gallery.prepare_queries(np.stack(features_list))
+                    sims = queries @ gallery.matrix.T
+                    sims[:, ~available] = -np.inf
+                    refine_with_templates(sims, queries, gallery, templates, cos_threshold)
+                    for idx, (col, best_cos) in enumerate(greedy_match(sims, cos_threshold)):
+                        box = boxes[idx] if idx < len(boxes) else None
+                        if col is not None:
+                            sign(col, best_cos, frame_no, image, box, "frame")
+                            continue
+                        if best_cos is None or best_cos < cos_threshold - BURST_EVIDENCE_MARGIN:
+                            continue
+                        # 单帧未达阈值: 计入最相似学生的跨帧证据
+                        j = int(np.argmax(sims[idx]))
+                        evidence[j] += queries[idx]
+                        evidence_count[j] += 1
+                        if box is not None and best_cos > best_face.get(j, (-np.inf,))[0]:
+                            # 只保留该学生证据中最清晰的一张人脸裁剪（不保留整帧）
+                            x1, y1, x2, y2 = map(int, map(round, box))
+                            crop = image.crop((max(0, x1), max(0, y1), min(image.width, x2), min(image.height, y2)))
+                            if j in best_face:
+                                best_face[j][2].close()
+                            best_face[j] = (best_cos, frame_no, crop)
+
+                    # 跨帧平均特征判定
+                    for j in np.nonzero(available & (evidence_count >= BURST_MIN_EVIDENCE))[0]:
+                        mean = evidence[j] / max(float(np.linalg.norm(evidence[j])), 1e-12)
+                        cos = float(mean @ gallery.matrix[j])
+                        if cos >= cos_threshold:
+                            _, best_frame, best_crop = best_face.get(j, (None, frame_no, None))
+                            sign(int(j), cos, best_frame, best_crop, None, "aggregate")
+                    conn.commit()
+                    for student_id, distance in unpublished:
+                        sign_event_bus.publish_sign_status(sign_task_id, student_id, 1, distance)
+                    unpublished.clear()
+                finally:
+                    image.close()
+
+                if not available.any():
+                    stats["early_exit"] = True
+                    logger.info(f"所有未签到学生均已匹配，提前结束（已读取 {stats['frames']} 帧）")
+                    break
+        finally:
+            frames.close()
+            for _, _, crop in best_face.values():
+                crop.close()
+
+        return {
+            "code": 200,
+            "message": "多帧识别并签到完成",
+            "matched_count": len(results),
+            "frames_received": stats["frames"],
+            "frames_processed": stats["processed"],
+            "frames_skipped_duplicate": stats["duplicates"],
+            "faces_detected": stats["faces"],
+            "faces_rejected": stats["rejected"],
+            "early_exit": stats["early_exit"],
+            "details": results
+        }
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"多帧识别签到失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"服务器错误: {str(e)}")
+    finally:
+        try:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        except Exception:
+            pass
+
+
+class LiveSignSession:
+    """
+    单个 WebSocket 连接的实时签到状态: 跟踪器、未签到学生底库与数据库连接
+
+    每帧都做检测（用于跟踪），但只对新出现或尚未匹配（按间隔重试）的轨迹提取特征，
+    已匹配的轨迹不再提取，教室人越齐每帧的计算越少。
+    """
+
+    def __init__(self, sign_task_id: str, cos_threshold: float, quality_profile: str = "live"):
+        self.sign_task_id = sign_task_id
+        self.cos_threshold = cos_threshold
+        self.quality_profile = quality_profile
+        self.tracker = FaceTracker()
+        self.frame_no = 0
+        self.conn = None
+        self.cursor = None
+        self.gallery = None
+        self.available = None
+        self.templates = None
+
+    def open(self):
+        """校验签到任务并加载未签到学生底库，返回错误信息或 None"""
+        self.conn = get_connection()
+        if not self.conn:
+            return "数据库连接失败"
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("SELECT status FROM sign_task WHERE sign_task_id = %s LIMIT 1", (self.sign_task_id,))
+        row = self.cursor.fetchone()
+        if not row:
+            return "签到任务不存在"
+        if row[0] == 2:
+            return "签到任务已结束"
+        pending = pending_students(self.cursor, self.sign_task_id)
+        self.gallery = load_student_gallery(self.cursor, pending, get_active_projection()) if pending else None
+        size = len(self.gallery) if self.gallery is not None else 0
+        self.templates = TemplateCache(self.cursor, self.gallery.projection) if size else None
+        self.available = np.ones(size, dtype=bool)
+        return None
+
+    @property
+    def pending(self) -> int:
+        return int(self.available.sum()) if self.available is not None else 0
+
+    def process(self, content: bytes):
+        """处理一帧（在线程池中执行），返回 (匹配结果列表, 统计)"""
+        t0 = time.perf_counter()
+        self.frame_no += 1
+        frame_no = self.frame_no
+        matches = []
+        image = Image.open(io.BytesIO(content)).convert('RGB')
+        try:
+            boxes, probs, landmarks = face_service.detect_with_landmarks(image)
+            tracks = self.tracker.update(boxes, frame_no)
+            todo = [i for i, t in enumerate(tracks) if t.needs_embedding(frame_no)] if self.pending else []
+            rejected = []
+            if todo:
+                # 质量不合格的轨迹本帧不提取特征，下一帧（人脸更清晰、更正时）再尝试
+                keep, rejected = filter_faces(
+                    image, boxes[todo], probs[todo], landmarks[todo] if landmarks is not None else None,
+                    self.quality_profile
+                )
+                todo = [todo[k] for k in keep]
+
+            if todo:
+                features = face_service.extract_features_for_boxes(image, boxes[todo])
+                for i, feature in zip(todo, features):
+                    track = tracks[i]
+                    query = track.add_embedding(self.gallery.prepare_queries(feature)[0], frame_no)
+                    sims = np.where(self.available, self.gallery.matrix @ query, -np.inf)[None, :]
+                    refine_with_templates(sims, query[None, :], self.gallery, self.templates, self.cos_threshold)
+                    sims = sims[0]
+                    col = int(np.argmax(sims))
+                    best_cos = float(sims[col])
+                    if best_cos < self.cos_threshold:
+                        continue
+                    student_id = self.gallery.ids[col]
+                    distance = cosine_to_distance(best_cos)
+                    mark_signed(self.cursor, self.sign_task_id, student_id, distance)
+                    self.conn.commit()
+                    sign_event_bus.publish_sign_status(self.sign_task_id, student_id, 1, distance)
+                    self.available[col] = False
+                    track.student_id = student_id
+                    crop_id = save_sign_in_crop(
+                        self.sign_task_id, image, boxes[i],
+                        idx=frame_no, student_id=student_id, matched=1, distance=distance,
+                        mode="live", track_id=track.track_id
+                    )
+                    matches.append({
+                        "type": "match",
+                        "frame": frame_no,
+                        "track_id": track.track_id,
+                        "student_id": student_id,
+                        "distance": distance,
+                        "similarity": best_cos,
+                        "crop_id": crop_id,
+                        "saved_path": crop_url(self.sign_task_id, crop_id) if crop_id else None
+                    })
+                    logger.info(f"实时签到匹配: student_id={student_id}, track={track.track_id}, cos={best_cos:.4f}")
+
+            stats = {
+                "type": "frame",
+                "frame": frame_no,
+                "faces": 0 if boxes is None else len(boxes),
+                "tracks": len(self.tracker.tracks),
+                "embedded": len(todo),
+                "rejected": len(rejected),
+                "matched_tracks": sum(1 for t in self.tracker.tracks if t.matched),
+                "pending": self.pending,
+                "ms": round((time.perf_counter() - t0) * 1000, 1)
+            }
+            return matches, stats
+        finally:
+            image.close()
+
+    def close(self):
+        try:
+            if self.cursor:
+                self.cursor.close()
+            if self.conn:
+                self.conn.close()
+        except Exception:
+            pass
+
+
+@router.websocket("/api/sign_task/live")
+async def live_sign(websocket: WebSocket, sign_task_id: str, threshold: float = 0.8, quality_profile: str = "live"):
+    """
+    教室门口摄像头实时签到（WebSocket）
+
+    客户端持续发送二进制 JPEG 帧；服务端每帧返回
+        {"type": "frame", "frame", "faces", "tracks", "embedded", "rejected", "matched_tracks", "pending", "ms"}
+    匹配成功时推送
+        {"type": "match", "frame", "track_id", "student_id", "distance", "similarity", "crop_id", "saved_path"}
+    所有学生都已签到时推送 {"type": "done"}；出错时推送 {"type": "error", "detail"} 并关闭连接
+    """
+    await websocket.accept()
+    if quality_profile not in PROFILES:
+        await websocket.send_json({"type": "error", "detail": f"未知的质量配置: {quality_profile}"})
+        await websocket.close(code=1008)
+        return
+    session = LiveSignSession(sign_task_id, distance_to_cosine(threshold), quality_profile)
+    try:
+        error = await run_in_threadpool(session.open)
+        if error:
+            await websocket.send_json({"type": "error", "detail": error})
+            await websocket.close(code=1008)
+            return
+        logger.info(f"实时签到连接建立: sign_task_id={sign_task_id}, 未签到 {session.pending} 人")
+
+        done_sent = False
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            content = message.get("bytes")
+            if not content:
+                continue  # 文本消息（心跳）忽略
+            try:
+                matches, stats = await run_in_threadpool(session.process, content)
+            except Exception as e:
+                logger.error(f"实时签到帧处理失败: {e}", exc_info=True)
+                await websocket.send_json({"type": "error", "detail": "帧处理失败"})
+                continue
+            for match in matches:
+                await websocket.send_json(match)
+            await websocket.send_json(stats)
+            if session.pending == 0 and not done_sent:
+                await websocket.send_json({"type": "done"})
+                done_sent = True
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"实时签到连接异常: {e}", exc_info=True)
+    finally:
+        logger.info(f"实时签到连接关闭: sign_task_id={sign_task_id}, 共 {session.frame_no} 帧")
+        await run_in_threadpool(session.close)
+
+
+@router.post("/api/sign_task/verify", response_model=dict, status_code=200)
+async def verify_and_sign(
+    sign_task_id: str = Form(..., description="签到任务ID"),
+    student_id: str = Form(..., description="学生ID"),
+    photo: UploadFile = File(..., description="自拍照片"),
+    threshold: float = Form(0.8, description="比对阈值，距离小于等于该值认为是本人（默认0.8）"),
+    quality_profile: Optional[str] = Form(None, description="人脸质量配置，默认 verify")
+):
+    """
+    学生自拍签到（1:1 验证）：只检测照片中最大的人脸，与该学生自己的特征比对，
+    匹配则将其 sign_record 标记为已签到，裁剪图追加到该任务的打包文件
+    返回:
+    {"code": 200, "matched": 0/1, "distance": float, "similarity": float, "crop_id": str, "saved_path": str}
+    """
+    if not sign_task_id or not student_id:
+        raise HTTPException(status_code=400, detail="需要提供 sign_task_id 和 student_id")
+    if not photo or not photo.filename:
+        raise HTTPException(status_code=400, detail="需要上传照片文件")
+    quality_profile = resolve_quality_profile(quality_profile, "verify")
+
+    content = await photo.read()
+    if len(content) == 0:
+        raise HTTPException(status_code=400, detail="上传的文件为空")
+
+    # 人脸检测、特征提取、模板比对和数据库事务都是阻塞操作，放到线程池执行，不阻塞事件循环
+    return await run_in_threadpool(_verify_and_sign, sign_task_id, student_id, content, threshold, quality_profile)
+
+
+def _verify_and_sign(sign_task_id: str, student_id: str, content: bytes, threshold: float, quality_profile: str):
+    """verify_and_sign 的同步部分（在线程池中执行）"""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        if not conn:
+            raise HTTPException(status_code=500, detail="数据库连接失败")
+        cursor = conn.cursor()
+
+        cursor.execute(
+            """
+            SELECT st.status, sr.sign_status
+            FROM sign_record sr
+            JOIN sign_task st ON st.sign_task_id = sr.sign_task_id
+            WHERE sr.sign_task_id = %s AND sr.student_id = %s
+            LIMIT 1
+            """,
+            (sign_task_id, student_id)
+        )
+        row = cursor.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="该学生不在此签到任务中")
+        if row[0] == 2:
+            raise HTTPException(status_code=400, detail="签到任务已结束")
+        if row[1] == 1:
+            return {"code": 200, "message": "已签到，无需重复签到", "matched": 1}
+
+        gallery = load_student_gallery(cursor, [student_id], get_active_projection())
+        if len(gallery.ids) == 0:
+            raise HTTPException(status_code=400, detail="该学生尚未上传人脸")
+
+        try:
+            pil_image = Image.open(io.BytesIO(content)).convert('RGB')
+        except Exception as e:
+            logger.error(f"图片解析失败: {e}")
+            raise HTTPException(status_code=400, detail="图片格式错误，无法解析")
+
+        feature, box, rejected = face_service.detect_and_extract_largest(pil_image, quality_profile)
+        if rejected is not None:
+            raise HTTPException(status_code=400, detail=f"人脸质量不合格: {rejected['message']}，请重新拍摄")
+        if feature is None:
+            raise HTTPException(status_code=400, detail="照片中未检测到人脸")
+
+        query = gallery.prepare_queries(feature)
+        sims = query @ gallery.matrix.T
+        refine_with_templates(sims, query, gallery, TemplateCache(cursor, gallery.projection), distance_to_cosine(threshold))
+        similarity = float(sims[0, 0])
+        distance = cosine_to_distance(similarity)
+        matched = 1 if distance <= threshold else 0
+        if matched:
+            mark_signed(cursor, sign_task_id, student_id, distance)
+            conn.commit()
+            sign_event_bus.publish_sign_status(sign_task_id, student_id, 1, distance)
+            logger.info(f"自拍签到成功: sign_task_id={sign_task_id}, student_id={student_id}, distance={distance:.4f}")
+        else:
+            logger.info(f"自拍签到比对未通过: sign_task_id={sign_task_id}, student_id={student_id}, distance={distance:.4f}")
+
+        crop_id = save_sign_in_crop(
+            sign_task_id, pil_image, box,
+            idx=0,
+            student_id=student_id if matched else None,
+            matched=matched,
+            distance=distance,
+            mode="verify"
+        )
+
+        return {
+            "code": 200,
+            "message": "签到成功" if matched else "人脸与本人不匹配",
+            "matched": matched,
+            "distance": distance,
+            "similarity": similarity,
+            "crop_id": crop_id,
+            "saved_path": crop_url(sign_task_id, crop_id) if crop_id else None
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"自拍签到失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"服务器错误: {str(e)}")
+    finally:
+        if 'pil_image' in locals():
+            try:
+                pil_image.close()
+            except Exception:
+                pass
+        try:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        except Exception:
+            pass
+
+
+# 端侧上传缩略图的最大字节数
+EDGE_THUMBNAIL_MAX_BYTES = 256 * 1024
+# 单次端侧签到请求的最大条目数
+EDGE_MAX_ITEMS = 500
+
+
+class EdgeSignItem(BaseModel):
+    sign_task_id: str
+    embedding: str  # base64 编码的版本化特征（FeatureBinaryConver.feature_to_bytes 的输出）
+    thumbnail: Optional[str] = None  # 可选: base64 编码的人脸 JPEG
+    kiosk_id: Optional[str] = None
+
+
+class EdgeSignReq(BaseModel):
+    items: List[EdgeSignItem]
+    threshold: float = 0.8
+    cos_threshold: Optional[float] = None
+
+
+def decode_edge_embedding(data: str, projection):
+    """
+    解析端侧上传的特征，返回 (特征向量, 错误信息)
+
+    要求带版本头、模型编号与服务端一致；特征可以是原始空间，也可以是当前启用的投影版本
+    """
+    try:
+        blob = base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError):
+        return None, "特征不是合法的 base64"
+    header = parse_header(blob)
+    if header is None:
+        return None, "特征缺少版本头"
+    if header.model_id != DEFAULT_MODEL_ID:
+        return None, f"模型编号不匹配: {header.model_id}"
+    if header.proj_id == 0:
+        expected_dim = projection.in_dim if projection is not None else LEGACY_SHAPE[0]
+    elif projection is not None and header.proj_id == projection.version:
+        expected_dim = projection.out_dim
+    else:
+        return None, f"投影版本不匹配: {header.proj_id}"
+    if header.dim != expected_dim:
+        return None, f"特征维度不匹配: {header.dim}"
+    return bytes_to_feature(blob), None
+
+
+@router.post("/api/sign_task/edge_sign", response_model=dict, status_code=200)
+def edge_sign(req: EdgeSignReq):
+    """
+    端侧签到：教室终端在本地完成检测与特征提取，只上传特征（可附带缩略图），
+    服务端只做比对和 sign_record 更新。一次请求可以包含多个终端、多个签到任务的条目。
+
+    每个签到任务内按条目顺序贪心分配（与 recognize 相同），每个学生最多匹配一次。
+    返回:
+    {
+        "code": 200,
+        "matched_count": int,
+        "details": [{"sign_task_id","student_id","distance","similarity","matched","crop_id","saved_path","error"}, ...]
+    }
+    """
+    if not req.items:
+        raise HTTPException(status_code=400, detail="items 不能为空")
+    if len(req.items) > EDGE_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次最多 {EDGE_MAX_ITEMS} 条")
+
+    projection = get_active_projection()
+    cos_threshold = req.cos_threshold if req.cos_threshold is not None else distance_to_cosine(req.threshold)
+    details = [
+        {"sign_task_id": item.sign_task_id, "student_id": None, "distance": None, "similarity": None,
+         "matched": 0, "crop_id": None, "saved_path": None, "error": None}
+        for item in req.items
+    ]
+
+    features = {}
+    for i, item in enumerate(req.items):
+        feature, error = decode_edge_embedding(item.embedding, projection)
+        if error:
+            details[i]["error"] = error
+        else:
+            features[i] = feature
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        if not conn:
+            raise HTTPException(status_code=500, detail="数据库连接失败")
+        cursor = conn.cursor()
+
+        # 一次查询所有涉及任务的状态和未签到学生
+        task_ids = sorted({req.items[i].sign_task_id for i in features})
+        pending = {}
+        if task_ids:
+            placeholders = ",".join(["%s"] * len(task_ids))
+            cursor.execute(
+                f"SELECT sign_task_id, status FROM sign_task WHERE sign_task_id IN ({placeholders})",
+                tuple(task_ids)
+            )
+            status = {r[0]: r[1] for r in cursor.fetchall()}
+            cursor.execute(
+                f"SELECT sign_task_id, student_id FROM sign_record "
+                f"WHERE sign_task_id IN ({placeholders}) AND sign_status != 1",
+                tuple(task_ids)
+            )
+            for task_id, student_id in cursor.fetchall():
+                pending.setdefault(task_id, []).append(student_id)
+
+            for i in list(features):
+                task_id = req.items[i].sign_task_id
+                if task_id not in status:
+                    details[i]["error"] = "签到任务不存在"
+                    features.pop(i)
+                elif status[task_id] == 2:
+                    details[i]["error"] = "签到任务已结束"
+                    features.pop(i)
+
+        # 所有任务的未签到学生合并成一个底库，一次矩阵乘法得到全部相似度
+        all_students = sorted({sid for ids in pending.values() for sid in ids})
+        gallery = load_student_gallery(cursor, all_students, projection) if all_students else None
+        order = sorted(features)
+        sims = None
+        if gallery is not None and len(gallery) and order:
+            queries = np.concatenate([gallery.prepare_queries(features[i]) for i in order])
+            sims = queries @ gallery.matrix.T
+        column = {sid: j for j, sid in enumerate(gallery.ids)} if gallery is not None else {}
+        templates = TemplateCache(cursor, projection)
+
+        matched_students = set()
+        for task_id in task_ids:
+            rows = [k for k, i in enumerate(order) if req.items[i].sign_task_id == task_id]
+            cols = [column[sid] for sid in pending.get(task_id, []) if sid in column]
+            if not rows:
+                continue
+            if sims is None or not cols:
+                assignments = [(None, None)] * len(rows)
+            else:
+                task_sims = sims[np.ix_(rows, cols)]
+                task_gallery = Gallery([gallery.ids[c] for c in cols], gallery.matrix[cols], gallery.projection)
+                refine_with_templates(task_sims, queries[rows], task_gallery, templates, cos_threshold)
+                assignments = greedy_match(task_sims, cos_threshold)
+            for k, (col, best_cos) in zip(rows, assignments):
+                i = order[k]
+                details[i]["similarity"] = best_cos
+                details[i]["distance"] = cosine_to_distance(best_cos) if best_cos is not None else None
+                if col is not None:
+                    student_id = gallery.ids[cols[col]]
+                    mark_signed(cursor, task_id, student_id, details[i]["distance"])
+                    details[i]["student_id"] = student_id
+                    details[i]["matched"] = 1
+                    matched_students.add((task_id, student_id))
+        conn.commit()
+        for detail in details:
+            if detail["matched"]:
+                sign_event_bus.publish_sign_status(detail["sign_task_id"], detail["student_id"], 1, detail["distance"])
+
+        # 缩略图原样追加到各任务的打包文件（端侧已裁剪，服务端不再解码/重编码）
+        for i, item in enumerate(req.items):
+            if not item.thumbnail or details[i]["error"]:
+                continue
+            try:
+                data = base64.b64decode(item.thumbnail, validate=True)
+                if len(data) > EDGE_THUMBNAIL_MAX_BYTES or not data.startswith(b"\xff\xd8"):
+                    logger.warning(f"端侧缩略图无效或过大，已忽略: idx={i}, size={len(data)}")
+                    continue
+                entry = get_sign_in_pack(item.sign_task_id).append(
+                    data,
+                    idx=i,
+                    student_id=details[i]["student_id"],
+                    matched=details[i]["matched"],
+                    distance=details[i]["distance"],
+                    kiosk_id=item.kiosk_id,
+                    mode="edge"
+                )
+                details[i]["crop_id"] = entry["crop_id"]
+                details[i]["saved_path"] = crop_url(item.sign_task_id, entry["crop_id"])
+            except Exception as e:
+                logger.error(f"保存端侧缩略图失败: {e}")
+
+        logger.info(f"端侧签到: {len(req.items)} 条, 匹配 {len(matched_students)} 人")
+        return {
+            "code": 200,
+            "message": "端侧签到完成",
+            "matched_count": len(matched_students),
+            "details": details
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        logger.error(f"端侧签到失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"服务器错误: {str(e)}")
+    finally:
+        try:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        except Exception:
+            pass
+
+
+@router.get("/api/sign_task/crops", response_model=dict, status_code=200)
+def list_sign_in_crops(sign_task_id: str):
+    """
+    列出签到任务的全部裁剪图索引
+    返回: {"code":200, "data": [{"crop_id","idx","student_id","matched","distance","created_at","url"}, ...]}
+    """
+    if not sign_task_id or sign_task_id.strip() == "":
+        raise HTTPException(status_code=400, detail="需要提供 sign_task_id")
+    try:
+        pack = get_sign_in_pack(sign_task_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="sign_task_id 格式错误")
+
+    data = []
+    for entry in pack.entries():
+        item = {k: v for k, v in entry.items() if k not in ("offset", "length")}
+        item["url"] = crop_url(sign_task_id, entry["crop_id"])
+        data.append(item)
+    return {"code": 200, "data": data}
+
+
+@router.get("/api/sign_task/crop/{sign_task_id}/{crop_id}")
+def get_sign_in_crop(sign_task_id: str, crop_id: str):
+    """
+    按 crop_id 从打包文件中读取单张裁剪图（只读取对应的字节区间）
+    """
+    try:
+        pack = get_sign_in_pack(sign_task_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="sign_task_id 格式错误")
+
+    data, entry = pack.read(crop_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="裁剪图不存在")
+    return Response(
+        content=data,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+
+@router.post("/api/identify", response_model=dict, status_code=200)
+async def identify(
+    photo: UploadFile = File(..., description="照片文件"),
+    top_k: int = Form(5, description="每张人脸返回的候选数量"),
+    nprobe: int = Form(8, description="扫描的倒排列表数量，越大越准越慢"),
+    threshold: float = Form(0.8, description="距离阈值，用于标记候选是否可信"),
+    exact: bool = Form(False, description="是否使用暴力搜索（用于核对）；启用分片底库时总是精确检索"),
+    quality_profile: Optional[str] = Form(None, description="人脸质量配置，默认 identify")
+):
+    """
+    全校范围的开放集人脸识别：对照片中每张人脸，在所有已采集人脸的用户中检索 top_k 个最相似的身份
+    返回:
+    {
+        "code": 200,
+        "data": [
+            {"box": [x1,y1,x2,y2], "candidates": [{"user_id","name","similarity","distance","matched"}, ...]}
+        ],
+        "exact": 本次是否为精确检索（分片底库或 exact=true）
+    }
+    """
+    if not photo or not photo.filename:
+        raise HTTPException(status_code=400, detail="需要上传照片文件")
+    if top_k < 1 or top_k > 100:
+        raise HTTPException(status_code=400, detail="top_k 必须在 1~100 之间")
+    quality_profile = resolve_quality_profile(quality_profile, "identify")
+
+    content = await photo.read()
+    if len(content) == 0:
+        raise HTTPException(status_code=400, detail="上传的文件为空")
+
+    # 人脸检测、特征提取、首次使用时构建 ANN 索引和检索都是阻塞的 CPU / IO 操作，放到线程池执行，不阻塞事件循环
+    return await run_in_threadpool(_identify, content, top_k, nprobe, threshold, exact, quality_profile)
+
+
+def _identify(content: bytes, top_k: int, nprobe: int, threshold: float, exact: bool, quality_profile: str):
+    """identify 的同步部分（在线程池中执行）"""
+    conn = None
+    cursor = None
+    try:
+        cache_key = inference_cache.key(content, quality_profile)
+        cached = inference_cache.get(cache_key)
+        if cached is not None:
+            features_list, boxes, rejected = list(cached.features), cached.boxes, cached.rejected
+        else:
+            try:
+                pil_image = Image.open(io.BytesIO(content)).convert('RGB')
+            except Exception as e:
+                logger.error(f"图片解析失败: {e}")
+                raise HTTPException(status_code=400, detail="图片格式错误，无法解析")
+
+            features_list, boxes, rejected = face_service.detect_and_extract_quality(pil_image, quality_profile)
+            inference_cache.put(cache_key, InferenceResult(features_list, boxes, rejected))
+        if len(features_list) == 0:
+            message = "照片中的人脸质量均不合格" if rejected else "照片中未检测到人脸"
+            return {"code": 200, "message": message, "data": [], "rejected": rejected}
+
+        projection = get_active_projection()
+        queries = np.stack(features_list)
+        if projection is not None:
+            queries = projection.project(queries)
+
+        # 启用分片底库时在各分片进程中并行精确检索（已满足 exact），否则使用 ANN 索引
+        sharded = get_sharded_gallery(projection)
+        if sharded is not None:
+            index = sharded
+            exact = True
+            hits = sharded.search(queries, k=top_k)
+        else:
+            index = get_ann_index(projection)
+            if exact:
+                hits = index.search_exact(queries, k=top_k)
+            else:
+                hits = index.search(queries, k=top_k, nprobe=nprobe)
+
+        # 一次查询补全所有候选的姓名
+        user_ids = sorted({uid for face_hits in hits for uid, _ in face_hits})
+        names = {}
+        if user_ids:
+            conn = get_connection()
+            if not conn:
+                raise HTTPException(status_code=500, detail="数据库连接失败")
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, name FROM user_info WHERE id IN ({})".format(",".join(["%s"] * len(user_ids))),
+                tuple(user_ids)
+            )
+            names = {r[0]: r[1] for r in cursor.fetchall()}
+
+        cos_threshold = distance_to_cosine(threshold)
+        data = []
+        for idx, face_hits in enumerate(hits):
+            box = boxes[idx] if idx < len(boxes) else None
+            data.append({
+                "box": [float(v) for v in box] if box is not None else None,
+                "candidates": [
+                    {
+                        "user_id": uid,
+                        "name": names.get(uid),
+                        "similarity": score,
+                        "distance": cosine_to_distance(score),
+                        "matched": 1 if score >= cos_threshold else 0
+                    }
+                    for uid, score in face_hits
+                ]
+            })
+
+        return {"code": 200, "gallery_size": len(index), "exact": exact, "data": data, "rejected": rejected}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"全校人脸检索失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"服务器错误: {str(e)}")
+    finally:
+        if 'pil_image' in locals():
+            try:
+                pil_image.close()
+            except Exception:
+                pass
+        try:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        except Exception:
+            pass
+
+
+@router.get("/api/face_quality/metrics", response_model=dict, status_code=200)
+def get_face_quality_metrics():
+    """
+    人脸质量过滤统计（本进程启动以来）: 按质量配置统计检测到、通过、各原因被过滤的人脸数
+    """
+    return {
+        "code": 200,
+        "data": quality_stats.snapshot(),
+        "profiles": {name: dict(profile._asdict()) for name, profile in PROFILES.items()},
+        "reasons": REASON_TEXT
+    }
+
+
+@router.get("/api/inference_cache/stats", response_model=dict, status_code=200)
+def get_inference_cache_stats():
+    """推理结果缓存统计（本进程）"""
+    return {"code": 200, "data": inference_cache.stats()}
@@ -2,8 +2,9 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional
 from app.db.connection import get_connection
+from app.db.id_generator import new_id
+from app.services.ProfileCache import profile_cache
 import logging
-import uuid
 
 logger = logging.getLogger()
 router = APIRouter()
@@ -25,51 +26,37 @@ class LoginReq(BaseModel):
 
 @router.post("/api/addusers", response_model=dict, status_code=200)
 def create_user(user: UserCreate):
+    conn = None
+    cursor = None
     try:
         conn = get_connection()
         if not conn:
             raise HTTPException(status_code=500, detail="数据库连接失败")
 
         cursor = conn.cursor()
-         # 使用 uuid4 的 hex 前 8 位作为 id，若冲突重试最多 5 次
-        user_id = None
-        for _ in range(5):
-            candidate = uuid.uuid4().hex[:12]
-            try:
-                sql = """
-                    INSERT INTO user_info (id, name, phone, student_id, face_feature, role, password)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """
-                cursor.execute(sql, (candidate, user.name, user.phone, user.student_id, user.face_feature, user.role, user.password))
-                conn.commit()
-                user_id = candidate
-                break
-            except Exception as e:
-                conn.rollback()
-                msg = str(e).lower()
-                # 若为唯一键冲突则重试，否则抛出
-                if "duplicate" in msg or "unique" in msg or "1062" in msg:
-                    continue
-                cursor.close()
-                conn.close()
-                raise
-
-        if user_id is None:
-            cursor.close()
-            conn.close()
-            raise HTTPException(status_code=500, detail="生成用户ID失败，请重试")
-
+        user_id = new_id()
+        sql = """
+            INSERT INTO user_info (id, name, phone, student_id, face_feature, role, password)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """
+        cursor.execute(sql, (user_id, user.name, user.phone, user.student_id, user.face_feature, user.role, user.password))
+        conn.commit()
 
         logger.info(f"新增用户成功: ID={user_id}, 数据={user.dict()}")
 
-        cursor.close()
-        conn.close()
-
         return {"code": 200, "user_id": user_id}
 
     except Exception as e:
         logger.error(f"新增用户失败: {e}")
         raise HTTPException(status_code=500, detail=f"服务器错误: {e}")
+    finally:
+        try:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        except Exception:
+            pass
 
 
 @router.post("/api/login", response_model=dict, status_code=200)
@@ -82,35 +69,22 @@ def login(req: LoginReq):
         raise HTTPException(status_code=400, detail="需要提供 phone 或 student_id")
 
     try:
-        conn = get_connection()
-        if not conn:
-            raise HTTPException(status_code=500, detail="数据库连接失败")
-
-        cursor = conn.cursor()
         if req.phone:
-            sql = "SELECT id, name, phone, role ,student_id FROM user_info WHERE phone = %s AND password = %s LIMIT 1"
-            params = (req.phone, req.password)
+            user = profile_cache.get_user("phone", req.phone)
         else:
-            sql = "SELECT id, name, phone, role ,student_id FROM user_info WHERE student_id = %s AND password = %s LIMIT 1"
-            params = (req.student_id, req.password)
-
-        cursor.execute(sql, params)
-        row = cursor.fetchone()
-        cursor.close()
-        conn.close()
+            user = profile_cache.get_user("student_id", req.student_id)
 
-        if not row:
+        if not user or not profile_cache.check_password(user, req.password):
             return {"code": 401, "message": "账号或密码错误"}
 
-        uid, name, phone, role, student_id = row
         return {
             "code": 200, 
             "data": {
-                "id": uid, 
-                "name": name, 
-                "phone": phone, 
-                "role": role,
-                "student_id": student_id
+                "id": user["id"], 
+                "name": user["name"], 
+                "phone": user["phone"], 
+                "role": user["role"],
+                "student_id": user["student_id"]
                 }
         }
 
@@ -2,6 +2,11 @@ import logging
 from fastapi import HTTPException
 from pydantic import BaseModel
 from app.db.connection import get_connection
+from app.services.AnnIndex import get_ann_index
+from app.services.GallerySnapshot import get_gallery_snapshot
+from app.services.ShardedGallery import get_sharded_gallery
+from app.services.FeatureProjection import get_active_projection
+from app.services.ProfileCache import profile_cache
 from typing import Optional
 from fastapi import APIRouter
 
@@ -30,12 +35,31 @@ def delete_user(req: DeleteUserReq):
             raise HTTPException(status_code=500, detail="数据库连接失败")
 
         cursor = conn.cursor()
+        cursor.execute("DELETE FROM face_template WHERE user_id = %s", (user_id,))
         sql = "DELETE FROM user_info WHERE id = %s"
         cursor.execute(sql, (user_id,))
         conn.commit()
+        profile_cache.invalidate_user(user_id)
 
         logger.info(f"删除用户成功: ID={user_id}")
 
+        # 从全校 ANN 索引中移除
+        try:
+            index = get_ann_index(get_active_projection(), build_if_missing=False)
+            if index is not None:
+                index.remove(user_id)
+        except Exception as e:
+            logger.error(f"从 ANN 索引移除用户失败: ID={user_id}, {e}")
+        try:
+            get_gallery_snapshot().remove(user_id)
+        except Exception as e:
+            logger.error(f"从底库快照移除用户失败: ID={user_id}, {e}")
+        try:
+            # 分片底库跟随快照同步（其他 worker 也会在下次检索时同步到这次删除）
+            get_sharded_gallery(get_active_projection())
+        except Exception as e:
+            logger.error(f"从分片底库移除用户失败: ID={user_id}, {e}")
+
         cursor.close()
         conn.close()
 
@@ -71,38 +95,24 @@ def search_users(req: UserSearchReq):
         raise HTTPException(status_code=400, detail="需要提供 id 或 phone 或 student_id 任一参数")
 
     try:
-        conn = get_connection()
-        if not conn:
-            raise HTTPException(status_code=500, detail="数据库连接失败")
-
-        cursor = conn.cursor()
         if id is not None:
-            sql = "SELECT id, phone, role, name, student_id FROM user_info WHERE id = %s LIMIT 1"
-            params = (id,)
+            user = profile_cache.get_user("id", id)
         elif phone:
-            sql = "SELECT id, phone, role, name, student_id FROM user_info WHERE phone = %s LIMIT 1"
-            params = (phone,)
+            user = profile_cache.get_user("phone", phone)
         else:
-            sql = "SELECT id, phone, role, name, student_id FROM user_info WHERE student_id = %s LIMIT 1"
-            params = (student_id,)
-
-        cursor.execute(sql, params)
-        row = cursor.fetchone()
-        cursor.close()
-        conn.close()
+            user = profile_cache.get_user("student_id", student_id)
 
-        if not row:
+        if not user:
             return {"code": 404, "message": "用户未找到"}
 
-        uid, phone_v, role_v, name_v, student_id_v = row
         return {
             "code": 200,
             "data": {
-                "id": uid,
-                "phone": phone_v,
-                "role": role_v,
-                "name": name_v,
-                "student_id": student_id_v
+                "id": user["id"],
+                "phone": user["phone"],
+                "role": user["role"],
+                "name": user["name"],
+                "student_id": user["student_id"]
             }
         }
 
@@ -182,6 +192,7 @@ def update_user(req: UpdateUserReq):
         params.append(req.id)
         cursor.execute(sql, tuple(params))
         conn.commit()
+        profile_cache.invalidate_user(req.id)
 
         logger.info(f"更新用户成功: ID={req.id}, 更新字段={updates}")
 
@@ -251,6 +262,7 @@ def change_password(req: PasswordChangeReq):
 
         cursor.execute("UPDATE user_info SET password = %s WHERE id = %s", (data.new_password, data.id))
         conn.commit()
+        profile_cache.invalidate_user(data.id)
 
         cursor.close()
         conn.close()
@@ -263,8 +275,58 @@ def change_password(req: PasswordChangeReq):
         raise HTTPException(status_code=500, detail=f"服务器错误: {e}")
     
 
+# 分页时每页最多返回的用户数
+USER_PAGE_MAX = 500
+
+# 列表只读取 has_face 生成列，不读取 face_feature BLOB
+USER_LIST_COLUMNS = "u.id, u.name, u.phone, u.student_id, u.role, u.created_at, u.updated_at, u.has_face"
+
+
+def build_user_search(role: str, class_id: str = None, has_face: bool = None, after: str = None, limit: int = None):
+    """
+    拼接用户列表查询，按 id 做 keyset 分页
+
+    - 按班级筛选时从 student_class.idx_class_student 出发，按 student_id 翻页
+    - 否则走主键 / idx_role_has_face / idx_has_face（二级索引隐含主键，按 id 有序）
+    id 顺序只保证翻页不重复、不遗漏，不代表注册顺序: 旧的小写十六进制 ID 与新的时间递增 ID
+    在不区分大小写的排序规则下相互穿插（见 app/db/id_generator.py）
+
+    返回:
+        (sql, params)
+    """
+    conditions, params = [], []
+    if class_id:
+        sql = f"SELECT {USER_LIST_COLUMNS} FROM student_class sc JOIN user_info u ON u.id = sc.student_id"
+        conditions.append("sc.class_id = %s")
+        params.append(class_id)
+        order_col = "sc.student_id"
+    else:
+        sql = f"SELECT {USER_LIST_COLUMNS} FROM user_info u"
+        order_col = "u.id"
+    if role != "all":
+        conditions.append("u.role = %s")
+        params.append(role)
+    if has_face is not None:
+        conditions.append("u.has_face = %s")
+        params.append(1 if has_face else 0)
+    if after:
+        conditions.append(f"{order_col} > %s")
+        params.append(after)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY {order_col}"
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit)
+    return sql, tuple(params)
+
+
 class RoleSearchReq(BaseModel):
     role: str  # "all" / "teacher" / "student"
+    class_id: Optional[str] = None  # 只返回该班级的成员
+    has_face: Optional[bool] = None  # True 只返回已采集人脸的用户，False 只返回未采集的
+    limit: Optional[int] = None  # 每页数量，不传时返回全部
+    cursor: Optional[str] = None  # 上一页返回的 next_cursor
 
 @router.post("/api/search_by_role", response_model=dict, status_code=200)
 def search_by_role(req: RoleSearchReq):
@@ -273,51 +335,69 @@ def search_by_role(req: RoleSearchReq):
     role = "all" 返回所有用户
     role = "teacher" 返回 role 字段为 teacher 的用户
     role = "student" 返回 role 字段为 student 的用户
-    返回 data 包含 users 列表，每项含 id,name,phone,student_id,role,created_time,update_time
+    可选 class_id / has_face 筛选；传 limit 时分页，用返回的 next_cursor 作为下一页的 cursor，
+    next_cursor 为 null 表示已到最后一页
+    返回 data 包含 users 列表，每项含 id,name,phone,student_id,role,created_time,update_time,face_collected
     """
     role = (req.role or "").lower()
     if role not in ("all", "teacher", "student"):
         raise HTTPException(status_code=400, detail="role 必须为 all/teacher/student")
+    if req.limit is not None and not 1 <= req.limit <= USER_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit 必须在 1~{USER_PAGE_MAX} 之间")
 
+    conn = None
+    cursor = None
     try:
         conn = get_connection()
         if not conn:
             raise HTTPException(status_code=500, detail="数据库连接失败")
 
         cursor = conn.cursor()
-        # 增加 face_feature, face_path 两列用于判断是否采集过人脸数据
-        if role == "all":
-            sql = "SELECT id, name, phone, student_id, role, created_at, updated_at, face_feature, face_path FROM user_info"
-            params = ()
-        else:
-            sql = "SELECT id, name, phone, student_id, role, created_at, updated_at, face_feature, face_path FROM user_info WHERE role = %s"
-            params = (role,)
-
+        # 多取一条判断是否还有下一页
+        sql, params = build_user_search(
+            role, req.class_id, req.has_face, req.cursor,
+            req.limit + 1 if req.limit is not None else None
+        )
         cursor.execute(sql, params)
         rows = cursor.fetchall()
-        users = []
-        if rows:
-            for r in rows:
-                # r indices: 0:id,1:name,2:phone,3:student_id,4:role,5:created_at,6:updated_at,7:face_feature,8:face_path
-                face_collected = bool(r[7]) and bool(r[8])
-                users.append({
-                    "id": r[0],
-                    "name": r[1],
-                    "phone": r[2],
-                    "student_id": r[3],
-                    "role": r[4],
-                    "created_time": r[5],
-                    "update_time": r[6],
-                    "face_collected": face_collected
-                })
-
-
-
-        cursor.close()
-        conn.close()
 
-        return {"code": 200, "data": {"users": users}}
+        next_cursor = None
+        if req.limit is not None and len(rows) > req.limit:
+            rows = rows[:req.limit]
+            next_cursor = rows[-1][0]
 
+        users = []
+        for r in rows:
+            # r indices: 0:id,1:name,2:phone,3:student_id,4:role,5:created_at,6:updated_at,7:has_face
+            users.append({
+                "id": r[0],
+                "name": r[1],
+                "phone": r[2],
+                "student_id": r[3],
+                "role": r[4],
+                "created_time": r[5],
+                "update_time": r[6],
+                "face_collected": bool(r[7])
+            })
+
+        return {"code": 200, "data": {"users": users, "next_cursor": next_cursor}}
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"按 role 查询用户失败: {e}")
-        raise HTTPException(status_code=500, detail=f"服务器错误: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"服务器错误: {e}")
+    finally:
+        try:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        except Exception:
+            pass
+
+
+@router.get("/api/profile_cache/stats", response_model=dict, status_code=200)
+def get_profile_cache_stats():
+    """用户资料与班级列表缓存统计（本进程）"""
+    return {"code": 200, "data": profile_cache.stats()}
@@ -0,0 +1,233 @@
+"""
+按时间递增的主键 ID（snowflake 风格）
+
+64 位整数 = 42 位毫秒时间戳（自 ID_EPOCH_MS 起）+ 10 位 worker_id + 12 位序号，
+编码为 13 位 Crockford base32（数字 + 大写字母），字符串顺序与生成顺序一致。
+新记录总是追加在 InnoDB 聚簇索引的末尾，不会像随机 ID 那样随机分裂页。
+
+注意: 迁移 0008 之前的旧 ID 是 12 位小写十六进制（uuid4().hex[:12]），ID 列的排序规则
+utf8mb4_0900_ai_ci 不区分大小写，新旧 ID 按字母穿插排序。因此混有旧数据时按 id 排序不等于创建顺序，
+只能作为稳定的翻页顺序；需要按时间排序的查询使用 created_at, id（签到历史、考勤导出均如此）。
+
+worker_id 保证多进程 / 多机器不会生成相同 ID:
+    - 设置了环境变量 ID_WORKER_ID 时直接使用（固定分配的部署，每个编号只能对应一个进程；
+      fork 出的子进程继承同一编号时拒绝生成 ID，需为每个进程单独设置）
+    - 否则在 id_worker 表中租用一个空闲编号，后台线程定期续租；
+      租约过期（进程退出 ID_WORKER_LEASE 秒后）的编号才会被其他进程复用。
+      超过 ID_WORKER_LEASE 的 2/3 没有成功续租时，本进程不再使用该编号，生成下一个 ID 前重新租用
+时钟回拨时沿用上一次的时间戳继续递增序号，不会生成重复或倒序的 ID。
+"""
+import logging
+import os
+import socket
+import threading
+import time
+
+from app.db.connection import get_connection
+
+logger = logging.getLogger()
+
+# 2024-01-01 00:00:00 UTC
+ID_EPOCH_MS = 1704067200000
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKERS = 1 << WORKER_BITS
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+ID_LENGTH = 13
+CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_CROCKFORD_INDEX = {c: i for i, c in enumerate(CROCKFORD)}
+
+# worker_id 租约秒数，续租间隔为其三分之一
+ID_WORKER_LEASE = int(os.environ.get("ID_WORKER_LEASE", "600"))
+# 距上次成功续租超过租约的这一比例即视为失效（留出应用与数据库之间时钟误差的余量）
+ID_WORKER_LEASE_SAFETY = 2 / 3
+
+
+def encode_id(value: int) -> str:
+    chars = []
+    for _ in range(ID_LENGTH):
+        chars.append(CROCKFORD[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def decode_id(text: str) -> int:
+    """13 位 ID 还原为整数，格式不正确时抛出 ValueError"""
+    if len(text) != ID_LENGTH:
+        raise ValueError(f"ID 长度应为 {ID_LENGTH}: {text}")
+    value = 0
+    for c in text.upper():
+        if c not in _CROCKFORD_INDEX:
+            raise ValueError(f"ID 含有非法字符: {text}")
+        value = (value << 5) | _CROCKFORD_INDEX[c]
+    return value
+
+
+def id_timestamp_ms(text: str) -> int:
+    """ID 生成时的 Unix 毫秒时间戳"""
+    return (decode_id(text) >> (WORKER_BITS + SEQUENCE_BITS)) + ID_EPOCH_MS
+
+
+def _is_duplicate(e: Exception) -> bool:
+    msg = str(e).lower()
+    return "duplicate" in msg or "unique" in msg or "1062" in msg
+
+
+def acquire_worker_id(conn, owner: str, lease: int = ID_WORKER_LEASE) -> int:
+    """在 id_worker 表中租用一个空闲或租约已过期的编号"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT worker_id, heartbeat_at < NOW() - INTERVAL %s SECOND FROM id_worker", (lease,)
+        )
+        leased = {int(r[0]): bool(r[1]) for r in cursor.fetchall()}
+        conn.commit()
+        candidates = [w for w in range(MAX_WORKERS) if w not in leased]
+        candidates += [w for w, expired in leased.items() if expired]
+        for worker_id in candidates:
+            if worker_id in leased:
+                cursor.execute(
+                    "UPDATE id_worker SET owner = %s, heartbeat_at = NOW() "
+                    "WHERE worker_id = %s AND heartbeat_at < NOW() - INTERVAL %s SECOND",
+                    (owner, worker_id, lease)
+                )
+                acquired = cursor.rowcount == 1
+            else:
+                try:
+                    cursor.execute(
+                        "INSERT INTO id_worker (worker_id, owner, heartbeat_at) VALUES (%s, %s, NOW())",
+                        (worker_id, owner)
+                    )
+                    acquired = True
+                except Exception as e:
+                    conn.rollback()
+                    if not _is_duplicate(e):
+                        raise
+                    acquired = False
+            conn.commit()
+            if acquired:
+                return worker_id
+        raise RuntimeError(f"没有可用的 worker_id（{MAX_WORKERS} 个编号均在租约中）")
+    finally:
+        cursor.close()
+
+
+class IdGenerator:
+    """
+    线程安全的 ID 生成器
+
+    参数:
+        worker_id: 固定的 worker 编号；为 None 时首次生成 ID 前从 id_worker 表租用
+    """
+
+    def __init__(self, worker_id=None, lease: int = ID_WORKER_LEASE):
+        if worker_id is not None and not 0 <= worker_id < MAX_WORKERS:
+            raise ValueError(f"worker_id 应在 0..{MAX_WORKERS - 1} 之间: {worker_id}")
+        self.fixed = worker_id is not None
+        self.worker_id = worker_id
+        self.lease = lease
+        self._pid = os.getpid() if self.fixed else None
+        self._owner = None
+        self._renewed_at = 0.0  # 最近一次成功租用 / 续租开始时的 time.monotonic()
+        self._last_ms = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def _lease_worker_id(self):
+        """
+        在锁内调用；fork 出的子进程（pid 变化）或租约失效后重新租用，不与其他进程共用编号。
+        租用失败时抛出 RuntimeError，此时不生成 ID
+        """
+        self._pid = None
+        owner = f"{socket.gethostname()}:{os.getpid()}:{int(time.time())}"[:100]
+        started = time.monotonic()
+        conn = get_connection()
+        if not conn:
+            raise RuntimeError("数据库连接失败，无法分配 worker_id")
+        try:
+            self.worker_id = acquire_worker_id(conn, owner, self.lease)
+        finally:
+            conn.close()
+        self._owner = owner
+        self._renewed_at = started
+        self._pid = os.getpid()
+        logger.info(f"ID 生成器租用 worker_id={self.worker_id}, owner={self._owner}")
+        threading.Thread(target=self._renew_loop, args=(self._pid, self.worker_id, owner),
+                         name="id-worker-lease", daemon=True).start()
+
+    def _lease_expired(self) -> bool:
+        return time.monotonic() - self._renewed_at > self.lease * ID_WORKER_LEASE_SAFETY
+
+    def _renew_loop(self, pid: int, worker_id: int, owner: str):
+        while True:
+            time.sleep(max(1, self.lease // 3))
+            if os.getpid() != pid or self._owner != owner:
+                # 子进程或已重新租用（由新的续租线程负责）
+                return
+            started = time.monotonic()
+            conn = None
+            try:
+                conn = get_connection()
+                if not conn:
+                    continue
+                cursor = conn.cursor()
+                cursor.execute(
+                    "UPDATE id_worker SET heartbeat_at = NOW() WHERE worker_id = %s AND owner = %s",
+                    (worker_id, owner)
+                )
+                renewed = cursor.rowcount == 1
+                conn.commit()
+                cursor.close()
+                if renewed:
+                    with self._lock:
+                        if self._owner == owner:
+                            self._renewed_at = started
+                else:
+                    # 长时间未续租，编号已被其他进程租走，下次生成 ID 前重新租用
+                    logger.error(f"worker_id 租约已失效: worker_id={worker_id}, owner={owner}")
+                    with self._lock:
+                        if self._owner == owner:
+                            self._pid = None
+                    return
+            except Exception as e:
+                logger.error(f"worker_id 续租失败: {e}")
+            finally:
+                if conn:
+                    conn.close()
+
+    def next_int(self) -> int:
+        with self._lock:
+            if self.fixed:
+                if self._pid != os.getpid():
+                    raise RuntimeError(
+                        f"固定的 worker_id={self.worker_id} 属于进程 {self._pid}，不能在 fork 出的子进程中使用，"
+                        f"请为每个进程设置不同的 ID_WORKER_ID 或不设置（自动租用）"
+                    )
+            elif self._pid != os.getpid() or self._lease_expired():
+                if self._pid == os.getpid():
+                    logger.error(f"worker_id 租约超时未续租，停止使用并重新租用: worker_id={self.worker_id}")
+                self._lease_worker_id()
+            now = int(time.time() * 1000) - ID_EPOCH_MS
+            if now > self._last_ms:
+                self._last_ms = now
+                self._sequence = 0
+            elif self._sequence < MAX_SEQUENCE:
+                self._sequence += 1
+            else:
+                # 同一毫秒序号用完（或时钟回拨）时借用下一毫秒
+                self._last_ms += 1
+                self._sequence = 0
+            return (self._last_ms << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+    def next_id(self) -> str:
+        return encode_id(self.next_int())
+
+
+_env_worker = os.environ.get("ID_WORKER_ID")
+id_generator = IdGenerator(int(_env_worker) if _env_worker else None)
+
+
+def new_id() -> str:
+    """生成一个新的 13 位主键 ID"""
+    return id_generator.next_id()
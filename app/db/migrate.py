@@ -0,0 +1,182 @@
+"""
+数据库版本迁移
+
+app/db/migrations 下的 NNNN_说明.sql 按版本号顺序执行，已执行的版本记录在 schema_migrations 表中。
+MySQL 的 DDL 会隐式提交，因此每个迁移执行完后立即记录版本；中途失败时修复 SQL 后重新执行即可
+（已成功的语句需要手工确认，迁移文件尽量一个文件只做一件事）。
+
+用法:
+    python -m app.db.migrate                # 执行所有未执行的迁移
+    python -m app.db.migrate --status       # 查看各版本的执行情况
+    python -m app.db.migrate --baseline 2   # 已有库: 把 0..2 标记为已执行（不执行 SQL）
+    python -m app.db.migrate --dry-run      # 只打印将要执行的语句
+"""
+import argparse
+import hashlib
+import logging
+import re
+from collections import namedtuple
+from pathlib import Path
+
+from app.db.connection import get_connection
+
+logger = logging.getLogger()
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+
+Migration = namedtuple("Migration", "version name path checksum")
+
+_FILE_RE = re.compile(r"^(\d{4})_(.+)\.sql$")
+
+CREATE_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS `schema_migrations` (
+  `version` int NOT NULL COMMENT '迁移版本号',
+  `name` varchar(100) NOT NULL COMMENT '迁移名称',
+  `checksum` CHAR(64) NOT NULL COMMENT '迁移文件 sha256',
+  `applied_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '执行时间',
+  PRIMARY KEY (`version`)
+) ENGINE=InnoDB
+DEFAULT CHARSET=utf8mb4
+COLLATE=utf8mb4_0900_ai_ci
+COMMENT='数据库迁移记录表'
+"""
+
+
+def load_migrations(directory: Path = MIGRATIONS_DIR):
+    """按版本号排序返回全部迁移文件，版本号重复时报错"""
+    migrations = []
+    for path in sorted(directory.glob("*.sql")):
+        m = _FILE_RE.match(path.name)
+        if not m:
+            logger.warning(f"忽略不符合命名规则的迁移文件: {path.name}")
+            continue
+        content = path.read_bytes()
+        migrations.append(Migration(int(m.group(1)), m.group(2), path, hashlib.sha256(content).hexdigest()))
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"迁移版本号重复: {versions}")
+    return migrations
+
+
+def split_statements(sql: str):
+    """去掉 -- 注释行，按行尾分号拆分为单条语句"""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    statements = re.split(r";\s*$", "\n".join(lines), flags=re.MULTILINE)
+    return [s.strip() for s in statements if s.strip()]
+
+
+def applied_versions(cursor) -> dict:
+    cursor.execute(CREATE_MIGRATIONS_TABLE)
+    cursor.execute("SELECT version, checksum FROM schema_migrations")
+    return {int(r[0]): r[1] for r in cursor.fetchall()}
+
+
+def _record(cursor, migration: Migration):
+    cursor.execute(
+        "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+        (migration.version, migration.name, migration.checksum)
+    )
+
+
+def migrate(conn, target: int = None, dry_run: bool = False):
+    """
+    执行所有未执行的迁移（版本号不超过 target）
+
+    返回:
+        本次执行的迁移版本号列表
+    """
+    cursor = conn.cursor()
+    try:
+        applied = applied_versions(cursor)
+        done = []
+        for migration in load_migrations():
+            if target is not None and migration.version > target:
+                break
+            if migration.version in applied:
+                if applied[migration.version] != migration.checksum:
+                    logger.warning(f"迁移 {migration.path.name} 执行后被修改过（checksum 不一致）")
+                continue
+            statements = split_statements(migration.path.read_text(encoding="utf-8"))
+            if dry_run:
+                print(f"-- {migration.path.name}")
+                for statement in statements:
+                    print(statement + ";\n")
+                continue
+            logger.info(f"执行迁移: {migration.path.name}（{len(statements)} 条语句）")
+            for statement in statements:
+                cursor.execute(statement)
+            _record(cursor, migration)
+            conn.commit()
+            done.append(migration.version)
+        return done
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def baseline(conn, version: int):
+    """已有库: 把不超过 version 的迁移标记为已执行，不执行其中的 SQL"""
+    cursor = conn.cursor()
+    try:
+        applied = applied_versions(cursor)
+        marked = []
+        for migration in load_migrations():
+            if migration.version > version:
+                break
+            if migration.version not in applied:
+                _record(cursor, migration)
+                marked.append(migration.version)
+        conn.commit()
+        return marked
+    finally:
+        cursor.close()
+
+
+def status(conn):
+    """返回 [(版本号, 文件名, 状态)]，状态为 applied / pending / modified"""
+    cursor = conn.cursor()
+    try:
+        applied = applied_versions(cursor)
+        conn.commit()
+    finally:
+        cursor.close()
+    result = []
+    for migration in load_migrations():
+        if migration.version not in applied:
+            state = "pending"
+        elif applied[migration.version] != migration.checksum:
+            state = "modified"
+        else:
+            state = "applied"
+        result.append((migration.version, migration.path.name, state))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="执行数据库迁移")
+    parser.add_argument("--status", action="store_true", help="查看各版本的执行情况")
+    parser.add_argument("--baseline", type=int, default=None, help="把不超过该版本的迁移标记为已执行")
+    parser.add_argument("--target", type=int, default=None, help="只执行到该版本")
+    parser.add_argument("--dry-run", action="store_true", help="只打印将要执行的语句")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    conn = get_connection()
+    if conn is None:
+        raise SystemExit("数据库连接失败")
+    try:
+        if args.status:
+            for version, name, state in status(conn):
+                print(f"{version:>5}  {state:<9} {name}")
+        elif args.baseline is not None:
+            print(f"已标记为执行: {baseline(conn, args.baseline)}")
+        else:
+            print(f"已执行迁移: {migrate(conn, target=args.target, dry_run=args.dry_run)}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
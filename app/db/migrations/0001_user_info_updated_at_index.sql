@@ -0,0 +1,2 @@
+-- 底库快照按 updated_at 增量同步
+ALTER TABLE `user_info` ADD KEY `idx_updated_at` (`updated_at`);
@@ -0,0 +1,17 @@
+-- 多模板注册: user_info.face_feature 改为模板质心，模板保存在 face_template
+ALTER TABLE `user_info`
+  ADD COLUMN `face_spread` float DEFAULT NULL COMMENT '注册模板到质心的平均余弦距离' AFTER `face_path`,
+  ADD COLUMN `face_template_count` int NOT NULL DEFAULT '0' COMMENT '注册模板数量' AFTER `face_spread`;
+
+CREATE TABLE IF NOT EXISTS `face_template` (
+  `id` CHAR(36) NOT NULL COMMENT '模板ID',
+  `user_id` CHAR(36) NOT NULL COMMENT '用户ID',
+  `feature` blob NOT NULL COMMENT '人脸特征向量（二进制）',
+  `crop_id` varchar(32) DEFAULT NULL COMMENT '对齐人脸图在 enroll.pack 中的ID',
+  `created_at` datetime DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+  PRIMARY KEY (`id`),
+  KEY `idx_user_id` (`user_id`)
+) ENGINE=InnoDB
+DEFAULT CHARSET=utf8mb4
+COLLATE=utf8mb4_0900_ai_ci
+COMMENT='人脸注册模板表';
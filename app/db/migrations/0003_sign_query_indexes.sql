@@ -0,0 +1,16 @@
+-- 签到相关查询的索引
+--
+-- sign_task:
+--   idx_sign_task_id_status   按 sign_task_id 关闭任务、识别前查任务状态、与 sign_record 关联
+--   idx_initiator_status      老师查询进行中签到（覆盖 DISTINCT sign_task_id）、老师签到历史
+-- sign_record:
+--   idx_task_status_student   识别时按任务取未签到学生（覆盖索引，不回表）、按任务统计各状态人数
+--   idx_student_task_status   学生查询进行中签到 / 签到历史（覆盖索引），替代原 idx_student_id
+ALTER TABLE `sign_task`
+  ADD KEY `idx_sign_task_id_status` (`sign_task_id`, `status`),
+  ADD KEY `idx_initiator_status` (`initiator`, `status`, `sign_task_id`);
+
+ALTER TABLE `sign_record`
+  ADD KEY `idx_task_status_student` (`sign_task_id`, `sign_status`, `student_id`),
+  ADD KEY `idx_student_task_status` (`student_id`, `sign_task_id`, `sign_status`),
+  DROP KEY `idx_student_id`;
@@ -0,0 +1,32 @@
+-- 签到人数统计: 每个 sign_task_id 一行，由 app/db/sign_record.py 与 sign_record 在同一事务中增量维护
+CREATE TABLE IF NOT EXISTS `sign_task_summary` (
+  `sign_task_id` CHAR(36) NOT NULL COMMENT '签到任务ID',
+  `total_num` int NOT NULL DEFAULT '0' COMMENT '应签到人数',
+  `num_0` int NOT NULL DEFAULT '0' COMMENT '未签到人数',
+  `num_1` int NOT NULL DEFAULT '0' COMMENT '已签到人数',
+  `num_2` int NOT NULL DEFAULT '0' COMMENT '请假人数',
+  `num_3` int NOT NULL DEFAULT '0' COMMENT '迟到人数',
+  `updated_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  PRIMARY KEY (`sign_task_id`)
+) ENGINE=InnoDB
+DEFAULT CHARSET=utf8mb4
+COLLATE=utf8mb4_0900_ai_ci
+COMMENT='签到人数统计表';
+
+-- 回填已有任务（之后可随时用 python -m app.scripts.rebuild_sign_summary 重建）
+INSERT INTO `sign_task_summary` (sign_task_id, total_num, num_0, num_1, num_2, num_3)
+SELECT sign_task_id,
+       COUNT(*),
+       SUM(sign_status = 0),
+       SUM(sign_status = 1),
+       SUM(sign_status = 2),
+       SUM(sign_status = 3)
+FROM sign_record
+GROUP BY sign_task_id
+ON DUPLICATE KEY UPDATE
+    total_num = VALUES(total_num),
+    num_0 = VALUES(num_0),
+    num_1 = VALUES(num_1),
+    num_2 = VALUES(num_2),
+    num_3 = VALUES(num_3);
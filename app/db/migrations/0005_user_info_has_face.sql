@@ -0,0 +1,18 @@
+-- 用户列表: 是否已采集人脸由生成列给出，列表查询不再读取 face_feature BLOB
+--
+-- user_info:
+--   has_face             face_feature 与 face_path 均非空时为 1（STORED，可建索引）
+--   idx_role_has_face    按角色 / 角色 + 人脸状态分页（二级索引隐含主键 id，按 id 翻页不需要排序）
+--   idx_has_face         只按人脸状态分页
+-- student_class:
+--   idx_class_student    按班级筛选时按 student_id 翻页（覆盖索引），替代原 idx_class_id
+ALTER TABLE `user_info`
+  ADD COLUMN `has_face` tinyint(1) GENERATED ALWAYS AS (
+    `face_feature` IS NOT NULL AND LENGTH(`face_feature`) > 0 AND `face_path` IS NOT NULL AND `face_path` <> ''
+  ) STORED COMMENT '是否已采集人脸' AFTER `face_template_count`,
+  ADD KEY `idx_role_has_face` (`role`, `has_face`),
+  ADD KEY `idx_has_face` (`has_face`);
+
+ALTER TABLE `student_class`
+  ADD KEY `idx_class_student` (`class_id`, `student_id`),
+  DROP KEY `idx_class_id`;
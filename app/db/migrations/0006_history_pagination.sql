@@ -0,0 +1,14 @@
+-- 签到历史分页与增量同步
+--
+-- sign_record:
+--   updated_at             签到状态变化时间，学生历史按 since 增量同步
+--   idx_student_created    学生历史按 (created_at, id) 倒序翻页
+-- sign_task:
+--   idx_initiator_created  老师历史按 (created_at, sign_task_id) 倒序翻页
+ALTER TABLE `sign_record`
+  ADD COLUMN `updated_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间' AFTER `created_at`,
+  ADD KEY `idx_student_created` (`student_id`, `created_at`);
+
+ALTER TABLE `sign_task`
+  ADD KEY `idx_initiator_created` (`initiator`, `created_at`, `sign_task_id`);
@@ -0,0 +1,7 @@
+-- 考勤导出按班级 / 日期范围从 sign_task 出发，按创建时间顺序读取
+--   idx_class_created   按班级 + 日期导出，替代原 idx_class_id
+--   idx_created_at      只按日期范围导出（整学期）
+ALTER TABLE `sign_task`
+  ADD KEY `idx_class_created` (`class_id`, `created_at`),
+  ADD KEY `idx_created_at` (`created_at`),
+  DROP KEY `idx_class_id`;
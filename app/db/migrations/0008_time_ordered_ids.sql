@@ -0,0 +1,41 @@
+-- 主键改为按时间递增的 13 位 ID（app/db/id_generator.py），ID 列由 CHAR(36) 缩短为 CHAR(13)
+-- 已有的 12 位 uuid 前缀 ID 保持不变，仍可放入 CHAR(13)；
+-- 若库中有超过 13 位的 ID，严格模式下 ALTER 会报错而不会截断，需先人工处理。
+-- 每个 ALTER 都会重建整张表，大表请在低峰期执行。
+ALTER TABLE `user_info`
+  MODIFY `id` CHAR(13) NOT NULL COMMENT '用户ID';
+
+ALTER TABLE `class`
+  MODIFY `id` CHAR(13) NOT NULL COMMENT '班级ID';
+
+ALTER TABLE `sign_task`
+  MODIFY `id` CHAR(13) NOT NULL COMMENT '签到任务ID（数据库主键）',
+  MODIFY `sign_task_id` CHAR(13) NOT NULL COMMENT '签到任务ID',
+  MODIFY `class_id` CHAR(13) NOT NULL COMMENT '签到班级ID';
+
+ALTER TABLE `sign_record`
+  MODIFY `id` CHAR(13) NOT NULL COMMENT '签到记录ID',
+  MODIFY `sign_task_id` CHAR(13) NOT NULL COMMENT '签到任务ID',
+  MODIFY `student_id` CHAR(13) NOT NULL COMMENT '学生ID';
+
+ALTER TABLE `student_class`
+  MODIFY `student_id` CHAR(13) NOT NULL COMMENT '学生ID',
+  MODIFY `class_id` CHAR(13) NOT NULL COMMENT '班级ID';
+
+ALTER TABLE `face_template`
+  MODIFY `id` CHAR(13) NOT NULL COMMENT '模板ID',
+  MODIFY `user_id` CHAR(13) NOT NULL COMMENT '用户ID';
+
+ALTER TABLE `sign_task_summary`
+  MODIFY `sign_task_id` CHAR(13) NOT NULL COMMENT '签到任务ID';
+
+-- 各进程租用的 worker 编号，保证多进程生成的 ID 不重复
+CREATE TABLE IF NOT EXISTS `id_worker` (
+  `worker_id` smallint NOT NULL COMMENT 'worker 编号（0-1023）',
+  `owner` varchar(100) NOT NULL COMMENT '租用者（主机:进程号:启动时间）',
+  `heartbeat_at` datetime NOT NULL COMMENT '最近一次续租时间',
+  PRIMARY KEY (`worker_id`)
+) ENGINE=InnoDB
+DEFAULT CHARSET=utf8mb4
+COLLATE=utf8mb4_0900_ai_ci
+COMMENT='ID 生成器 worker 编号租约表';
@@ -0,0 +1,35 @@
+-- 签到冷热分离: 结束已久的签到由 app/db/sign_archive.py 分批移入以下归档表
+-- 列与热表相同；只保留签到历史、任务详情和考勤导出需要的索引
+CREATE TABLE IF NOT EXISTS `sign_task_archive` (
+  `id` CHAR(13) NOT NULL COMMENT '签到任务ID（数据库主键）',
+  `sign_task_id` CHAR(13) NOT NULL COMMENT '签到任务ID',
+  `class_id` CHAR(13) NOT NULL COMMENT '签到班级ID',
+  `initiator` varchar(50) NOT NULL COMMENT '签到发起人',
+  `status` tinyint NOT NULL DEFAULT '2' COMMENT '状态：2已结束',
+  `created_at` datetime NOT NULL COMMENT '创建时间',
+  `updated_at` datetime NOT NULL COMMENT '更新时间',
+  PRIMARY KEY (`id`),
+  KEY `idx_sign_task_id` (`sign_task_id`),
+  KEY `idx_class_created` (`class_id`, `created_at`),
+  KEY `idx_created_at` (`created_at`),
+  KEY `idx_initiator_created` (`initiator`, `created_at`, `sign_task_id`)
+) ENGINE=InnoDB
+DEFAULT CHARSET=utf8mb4
+COLLATE=utf8mb4_0900_ai_ci
+COMMENT='签到任务归档表';
+
+CREATE TABLE IF NOT EXISTS `sign_record_archive` (
+  `id` CHAR(13) NOT NULL COMMENT '签到记录ID',
+  `sign_task_id` CHAR(13) NOT NULL COMMENT '签到任务ID',
+  `student_id` CHAR(13) NOT NULL COMMENT '学生ID',
+  `sign_status` tinyint NOT NULL DEFAULT '0' COMMENT '0未签到 1已签到 2请假 3迟到',
+  `face_score` float DEFAULT NULL COMMENT '人脸相似度得分',
+  `created_at` datetime DEFAULT NULL COMMENT '创建时间',
+  `updated_at` datetime NOT NULL COMMENT '更新时间',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_task_student` (`sign_task_id`, `student_id`),
+  KEY `idx_student_created` (`student_id`, `created_at`)
+) ENGINE=InnoDB
+DEFAULT CHARSET=utf8mb4
+COLLATE=utf8mb4_0900_ai_ci
+COMMENT='签到记录归档表';
@@ -0,0 +1,202 @@
+"""
+签到冷热分离: 结束已久的签到任务从 sign_task / sign_record 移到 sign_task_archive / sign_record_archive
+
+热表只保留进行中和近期的签到，识别、进行中签到等高频查询只扫热表；
+签到历史、任务详情和考勤导出同时读取两组表（app/api/signTask.py），对客户端透明。
+sign_task_summary 不归档，归档任务的人数统计仍从中读取。
+
+归档以 sign_task_id 为单位（同一次发布的全部班级及签到记录一起移动），每批一个事务，
+因此同一个 sign_task_id 的数据只会整体位于热表或归档表之一。归档后的签到视为只读，
+修改签到状态等接口会返回记录不存在。
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app.db.connection import get_connection
+
+logger = logging.getLogger()
+
+# 结束且创建超过这么多天的签到任务会被归档
+SIGN_ARCHIVE_AFTER_DAYS = int(os.environ.get("SIGN_ARCHIVE_AFTER_DAYS", "180"))
+# 每批（一个事务）归档的 sign_task_id 数
+SIGN_ARCHIVE_BATCH_TASKS = int(os.environ.get("SIGN_ARCHIVE_BATCH_TASKS", "100"))
+# 后台归档的执行间隔（秒），0 表示不在服务进程中归档（可改用 python -m app.scripts.archive_sign_tasks）
+SIGN_ARCHIVE_INTERVAL = int(os.environ.get("SIGN_ARCHIVE_INTERVAL", "3600"))
+
+# 查询构造函数通过这两组表名分别生成热表与归档表的查询
+HOT_TABLES = {"sign_task": "sign_task", "sign_record": "sign_record"}
+ARCHIVE_TABLES = {"sign_task": "sign_task_archive", "sign_record": "sign_record_archive"}
+SIGN_TABLES = (HOT_TABLES, ARCHIVE_TABLES)
+
+SIGN_TASK_COLUMNS = "id, sign_task_id, class_id, initiator, status, created_at, updated_at"
+SIGN_RECORD_COLUMNS = "id, sign_task_id, student_id, sign_status, face_score, created_at, updated_at"
+
+# 走 sign_task.idx_created_at；同一 sign_task_id 下还有未结束班级的任务不作为候选，
+# 否则这些任务会一直占满每批的 LIMIT，之后的任务永远归档不到
+ARCHIVE_CANDIDATES_SQL = (
+    "SELECT sign_task_id FROM sign_task WHERE created_at < %s "
+    "GROUP BY sign_task_id HAVING MIN(status) = 2 AND MAX(status) = 2 LIMIT %s"
+)
+ARCHIVE_COUNT_SQL = (
+    "SELECT COUNT(*) FROM (SELECT sign_task_id FROM sign_task WHERE created_at < %s "
+    "GROUP BY sign_task_id HAVING MIN(status) = 2 AND MAX(status) = 2) t"
+)
+
+# 连续这么多批候选全部被并发修改挡住（锁定后发现又有班级未结束）时停止本轮归档
+MAX_BLOCKED_BATCHES = 3
+
+# 多个服务进程同时运行后台归档时只有一个真正执行
+ARCHIVE_LOCK_NAME = "signin_sign_archive"
+
+
+def union_all(parts, order_by: str, limit_param: bool = False) -> str:
+    """
+    把热表与归档表的同构查询合并为一条语句并整体排序
+
+    每个部分各自带 ORDER BY + LIMIT 时，外层只需合并两个已截断的小结果；
+    limit_param 为 True 时末尾追加 LIMIT %s（参数由调用方追加）
+    """
+    sql = "SELECT * FROM (\n" + "\nUNION ALL\n".join(f"({p}\n)" for p in parts) + f"\n) u\nORDER BY {order_by}"
+    if limit_param:
+        sql += "\nLIMIT %s"
+    return sql
+
+
+def archive_batch(conn, cutoff, batch_size: int = SIGN_ARCHIVE_BATCH_TASKS):
+    """
+    归档一批创建时间早于 cutoff 的已结束签到
+
+    返回:
+        (归档的 sign_task_id 数, 归档的签到记录数, 被跳过的候选数)；
+        没有可归档的任务时返回 (0, 0, 0)。候选在锁定后发现仍有未结束的班级（查询与加锁之间被修改）时跳过
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(ARCHIVE_CANDIDATES_SQL, (cutoff, batch_size))
+        candidates = [r[0] for r in cursor.fetchall()]
+        if not candidates:
+            conn.commit()
+            return 0, 0, 0
+
+        # 锁住这些任务的全部行；同一 sign_task_id 下仍有未结束的班级时跳过
+        marks = ",".join(["%s"] * len(candidates))
+        cursor.execute(f"SELECT sign_task_id, status FROM sign_task WHERE sign_task_id IN ({marks}) FOR UPDATE",
+                       tuple(candidates))
+        open_ids = set()
+        locked = set()
+        for sign_task_id, status in cursor.fetchall():
+            locked.add(sign_task_id)
+            if int(status) != 2:
+                open_ids.add(sign_task_id)
+        ids = [i for i in candidates if i in locked and i not in open_ids]
+        blocked = len(candidates) - len(ids)
+        if not ids:
+            conn.rollback()
+            return 0, 0, blocked
+
+        marks = ",".join(["%s"] * len(ids))
+        params = tuple(ids)
+        cursor.execute(
+            f"INSERT INTO sign_record_archive ({SIGN_RECORD_COLUMNS}) "
+            f"SELECT {SIGN_RECORD_COLUMNS} FROM sign_record WHERE sign_task_id IN ({marks})", params
+        )
+        records = cursor.rowcount
+        cursor.execute(
+            f"INSERT INTO sign_task_archive ({SIGN_TASK_COLUMNS}) "
+            f"SELECT {SIGN_TASK_COLUMNS} FROM sign_task WHERE sign_task_id IN ({marks})", params
+        )
+        cursor.execute(f"DELETE FROM sign_record WHERE sign_task_id IN ({marks})", params)
+        cursor.execute(f"DELETE FROM sign_task WHERE sign_task_id IN ({marks})", params)
+        conn.commit()
+        return len(ids), records, blocked
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def archive(conn, days: int = SIGN_ARCHIVE_AFTER_DAYS, batch_size: int = SIGN_ARCHIVE_BATCH_TASKS,
+            pause: float = 0.0, max_batches: int = None):
+    """
+    分批归档，直到没有可归档的任务（或达到 max_batches）
+
+    参数:
+        pause: 每批之间的间隔秒数，减轻对线上库和从库的压力
+
+    返回:
+        (归档的 sign_task_id 数, 归档的签到记录数)
+    """
+    cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    total_tasks = total_records = batches = blocked_batches = 0
+    while max_batches is None or batches < max_batches:
+        tasks, records, blocked = archive_batch(conn, cutoff, batch_size)
+        if not tasks and not blocked:
+            # 没有可归档的任务了
+            break
+        batches += 1
+        if not tasks:
+            # 整批被并发修改挡住不代表后面没有可归档的任务，重试几次
+            blocked_batches += 1
+            logger.warning(f"签到归档: 本批 {blocked} 个候选均有未结束的班级，跳过")
+            if blocked_batches >= MAX_BLOCKED_BATCHES:
+                break
+            if pause:
+                time.sleep(pause)
+            continue
+        blocked_batches = 0
+        total_tasks += tasks
+        total_records += records
+        logger.info(f"已归档 {total_tasks} 个签到任务, {total_records} 条签到记录")
+        if pause:
+            time.sleep(pause)
+    return total_tasks, total_records
+
+
+def _run_once(days: int, batch_size: int):
+    conn = get_connection()
+    if not conn:
+        logger.error("签到归档: 数据库连接失败")
+        return
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (ARCHIVE_LOCK_NAME,))
+        if cursor.fetchone()[0] != 1:
+            return
+        try:
+            tasks, records = archive(conn, days, batch_size, pause=0.5)
+            if tasks:
+                logger.info(f"签到归档完成: {tasks} 个签到任务, {records} 条签到记录")
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (ARCHIVE_LOCK_NAME,))
+            cursor.fetchone()
+    except Exception as e:
+        logger.error(f"签到归档失败: {e}")
+    finally:
+        try:
+            if cursor:
+                cursor.close()
+            conn.close()
+        except Exception:
+            pass
+
+
+def start_archive_worker(interval: int = SIGN_ARCHIVE_INTERVAL, days: int = SIGN_ARCHIVE_AFTER_DAYS,
+                         batch_size: int = SIGN_ARCHIVE_BATCH_TASKS):
+    """启动后台归档线程（守护线程），interval 为 0 时不启动并返回 None"""
+    if interval <= 0:
+        return None
+
+    def loop():
+        while True:
+            _run_once(days, batch_size)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="sign-archive", daemon=True)
+    thread.start()
+    logger.info(f"后台签到归档已启动: 每 {interval} 秒归档结束超过 {days} 天的签到")
+    return thread
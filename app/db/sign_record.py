@@ -0,0 +1,118 @@
+import logging
+
+logger = logging.getLogger()
+
+# 0未签到 1已签到 2请假 3迟到
+SIGN_STATUSES = (0, 1, 2, 3)
+SIGN_STATUS_TEXT = {0: "未签到", 1: "已签到", 2: "请假", 3: "迟到"}
+
+# 走 sign_record.idx_task_status_student 覆盖索引，不回表
+PENDING_STUDENTS_SQL = "SELECT student_id FROM sign_record WHERE sign_task_id = %s AND sign_status != 1"
+
+SIGN_STATUS_FOR_UPDATE_SQL = (
+    "SELECT sign_status FROM sign_record WHERE sign_task_id = %s AND student_id = %s FOR UPDATE"
+)
+
+MARK_SIGNED_SQL = "UPDATE sign_record SET sign_status = %s, face_score = %s WHERE sign_task_id = %s AND student_id = %s"
+
+# -----------------------------
+# 签到人数统计（sign_task_summary）
+# -----------------------------
+# 每个 sign_task_id 一行，total_num / num_0..num_3 与 sign_record 在同一事务中增量维护，
+# 老师签到历史直接读取，不再聚合 sign_record。
+# 所有对 sign_record 的新增和状态修改都应通过本模块的函数，否则统计会偏差，
+# 偏差后执行 python -m app.scripts.rebuild_sign_summary 重建。
+
+# 由 sign_record 重新计算一批任务的统计（包括没有签到记录的任务）
+REFRESH_SUMMARY_SQL = """
+INSERT INTO sign_task_summary (sign_task_id, total_num, num_0, num_1, num_2, num_3)
+SELECT t.sign_task_id,
+       COUNT(sr.id),
+       COALESCE(SUM(sr.sign_status = 0), 0),
+       COALESCE(SUM(sr.sign_status = 1), 0),
+       COALESCE(SUM(sr.sign_status = 2), 0),
+       COALESCE(SUM(sr.sign_status = 3), 0)
+FROM (SELECT DISTINCT sign_task_id FROM sign_task WHERE sign_task_id IN ({})) t
+LEFT JOIN sign_record sr ON sr.sign_task_id = t.sign_task_id
+GROUP BY t.sign_task_id
+ON DUPLICATE KEY UPDATE
+    total_num = VALUES(total_num),
+    num_0 = VALUES(num_0),
+    num_1 = VALUES(num_1),
+    num_2 = VALUES(num_2),
+    num_3 = VALUES(num_3)
+"""
+
+
+def pending_students(cursor, sign_task_id: str):
+    """签到任务中尚未签到（sign_status != 1）的学生 id 列表"""
+    cursor.execute(PENDING_STUDENTS_SQL, (sign_task_id,))
+    return [r[0] for r in cursor.fetchall()]
+
+
+def insert_sign_record(cursor, record_id: str, sign_task_id: str, student_id: str, sign_status: int = 0):
+    """新增一条签到记录并计入任务统计（事务由调用方提交）"""
+    cursor.execute(
+        "INSERT INTO sign_record (id, sign_task_id, student_id, sign_status) VALUES (%s, %s, %s, %s)",
+        (record_id, sign_task_id, student_id, sign_status)
+    )
+    cursor.execute(
+        f"INSERT INTO sign_task_summary (sign_task_id, total_num, num_{sign_status}) VALUES (%s, 1, 1) "
+        f"ON DUPLICATE KEY UPDATE total_num = total_num + 1, num_{sign_status} = num_{sign_status} + 1",
+        (sign_task_id,)
+    )
+
+
+def set_sign_status(cursor, sign_task_id: str, student_id: str, new_status: int, face_score=None,
+                    update_score: bool = True):
+    """
+    修改签到状态，状态变化时同步调整任务统计（事务由调用方提交）
+
+    先以 FOR UPDATE 读取原状态，并发修改同一条记录时统计不会重复计数
+
+    参数:
+        update_score: 为 False 时保留原有 face_score
+
+    返回:
+        原状态；记录不存在时返回 None
+    """
+    if new_status not in SIGN_STATUSES:
+        raise ValueError(f"未知的签到状态: {new_status}")
+    cursor.execute(SIGN_STATUS_FOR_UPDATE_SQL, (sign_task_id, student_id))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    old_status = int(row[0])
+
+    if update_score:
+        cursor.execute(MARK_SIGNED_SQL, (new_status, face_score, sign_task_id, student_id))
+    else:
+        cursor.execute(
+            "UPDATE sign_record SET sign_status = %s WHERE sign_task_id = %s AND student_id = %s",
+            (new_status, sign_task_id, student_id)
+        )
+    if old_status != new_status:
+        cursor.execute(
+            f"UPDATE sign_task_summary SET num_{old_status} = num_{old_status} - 1, "
+            f"num_{new_status} = num_{new_status} + 1 WHERE sign_task_id = %s",
+            (sign_task_id,)
+        )
+    return old_status
+
+
+def mark_signed(cursor, sign_task_id: str, student_id: str, face_score=None) -> int:
+    """
+    将学生在签到任务中的记录标记为已签到（1），并写入人脸比对距离
+
+    事务由调用方提交；返回 1 表示已更新，0 表示记录不存在
+    """
+    return 0 if set_sign_status(cursor, sign_task_id, student_id, 1, face_score) is None else 1
+
+
+def refresh_task_summary(cursor, sign_task_ids) -> int:
+    """按 sign_record 重新计算这些任务的统计（事务由调用方提交），返回任务数"""
+    sign_task_ids = list(sign_task_ids)
+    if not sign_task_ids:
+        return 0
+    cursor.execute(REFRESH_SUMMARY_SQL.format(",".join(["%s"] * len(sign_task_ids))), tuple(sign_task_ids))
+    return len(sign_task_ids)
@@ -54,6 +54,12 @@
 
 import logging
 from .utils.logging import setup_logging
+from .services.ShardedGallery import start_sharded_gallery
+
+# 分片底库进程通过 fork 创建，必须在加载模型、启动任何后台线程之前启动
+setup_logging()
+start_sharded_gallery()
+
 from .services.FaceRecognitionService import FaceRecognitionService
 from PIL import Image
 from fastapi import FastAPI, HTTPException
@@ -67,13 +73,13 @@ from .middlewares.exception_handlers import (
 )
 import uvicorn
 from app.db import connection
+from app.db.sign_archive import start_archive_worker
 
 # -----------------------------
 # 全局初始化
 # -----------------------------
 #读yaml
 
-setup_logging()
 logger = logging.getLogger()
 e = connection.get_connection()
 if e is None:
@@ -107,6 +113,9 @@ app.include_router(classInfo.router)
 app.include_router(signTask.router)
 app.include_router(faceRecognitionService.router)
 
+# 后台归档结束已久的签到（SIGN_ARCHIVE_INTERVAL 秒一次，为 0 时不启动）
+start_archive_worker()
+
 logger.info("程序启动")
 
 uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
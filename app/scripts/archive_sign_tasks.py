@@ -0,0 +1,49 @@
+"""
+把结束已久的签到移入归档表（sign_task_archive / sign_record_archive）
+
+服务进程默认每 SIGN_ARCHIVE_INTERVAL 秒在后台执行一次（见 app/db/sign_archive.py）；
+首次上线积压较多、或服务中关闭了后台归档时可手工执行。每批一个事务，可随时中断。
+
+用法:
+    python -m app.scripts.archive_sign_tasks [--days 180] [--batch-size 100] [--pause 0.5] [--dry-run]
+"""
+import argparse
+import logging
+from datetime import datetime, timedelta
+
+from app.db.connection import get_connection
+from app.db.sign_archive import ARCHIVE_COUNT_SQL, SIGN_ARCHIVE_AFTER_DAYS, SIGN_ARCHIVE_BATCH_TASKS, archive
+
+logger = logging.getLogger()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="归档结束已久的签到")
+    parser.add_argument("--days", type=int, default=SIGN_ARCHIVE_AFTER_DAYS, help="归档创建超过多少天的已结束签到")
+    parser.add_argument("--batch-size", type=int, default=SIGN_ARCHIVE_BATCH_TASKS, help="每批归档的签到任务数")
+    parser.add_argument("--pause", type=float, default=0.5, help="每批之间的间隔秒数")
+    parser.add_argument("--dry-run", action="store_true", help="只统计可归档的数量")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    conn = get_connection()
+    if conn is None:
+        raise SystemExit("数据库连接失败")
+    try:
+        if args.dry_run:
+            cutoff = (datetime.now() - timedelta(days=args.days)).strftime("%Y-%m-%d %H:%M:%S")
+            cursor = conn.cursor()
+            try:
+                cursor.execute(ARCHIVE_COUNT_SQL, (cutoff,))
+                print(f"可归档签到任务: {cursor.fetchone()[0]}（创建早于 {cutoff}）")
+            finally:
+                cursor.close()
+            return
+        tasks, records = archive(conn, args.days, args.batch_size, pause=args.pause)
+        print(f"已归档 {tasks} 个签到任务, {records} 条签到记录")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+特征编码对比报告: 每种编码的存储大小、底库加载（解码）耗时与匹配准确率
+
+底库优先从 user_info.face_feature 读取，也可以用 --synthetic 生成随机单位向量。
+查询向量 = 底库向量 + 高斯噪声（模拟同一个人的另一张照片），
+准确率以 float32 原始特征的最近邻结果为基准。
+
+用法:
+    python -m app.scripts.bench_feature_codec [--synthetic 5000] [--noise 0.35] [--threshold 0.8]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.utils.FeatureBinaryConver import ENCODINGS, decode_matrix, feature_to_bytes
+
+
+def load_gallery_from_db():
+    from app.db.connection import get_connection
+
+    conn = get_connection()
+    if not conn:
+        raise RuntimeError("数据库连接失败")
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT face_feature FROM user_info WHERE face_feature IS NOT NULL")
+        blobs = [r[0] for r in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+    matrix, _ = decode_matrix(blobs)
+    return matrix
+
+
+def synthetic_gallery(n, dim, rng):
+    g = rng.standard_normal((n, dim)).astype(np.float32)
+    return g / np.linalg.norm(g, axis=1, keepdims=True)
+
+
+def nearest(probes, gallery):
+    # |p - g|^2 = |p|^2 + |g|^2 - 2 p.g
+    d2 = (probes ** 2).sum(1)[:, None] + (gallery ** 2).sum(1)[None, :] - 2.0 * probes @ gallery.T
+    idx = np.argmin(d2, axis=1)
+    dist = np.sqrt(np.maximum(d2[np.arange(len(idx)), idx], 0.0))
+    return idx, dist
+
+
+def main():
+    parser = argparse.ArgumentParser(description="特征编码对比报告")
+    parser.add_argument("--synthetic", type=int, default=0, help="使用 N 个随机特征代替数据库")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--noise", type=float, default=0.35, help="查询向量噪声强度")
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    raw = synthetic_gallery(args.synthetic, args.dim, rng) if args.synthetic else load_gallery_from_db()
+    n, dim = raw.shape
+    if n == 0:
+        print("底库为空")
+        return
+
+    probes = raw + rng.standard_normal(raw.shape).astype(np.float32) * (args.noise / np.sqrt(dim))
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+    truth = np.arange(n)
+    base_idx, base_dist = nearest(probes, raw)
+    base_match = base_dist <= args.threshold
+
+    print(f"底库 {n} 人, 维度 {dim}, 噪声 {args.noise}, 阈值 {args.threshold}")
+    print(f"{'encoding':<10}{'bytes':>8}{'load ms':>10}{'top1 acc':>10}{'agree':>8}{'max |dd|':>10}")
+    for name in ENCODINGS:
+        blobs = [feature_to_bytes(v, encoding=name) for v in raw]
+        size = len(blobs[0])
+
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            gallery, _ = decode_matrix(blobs, dim=dim)
+            best = min(best, time.perf_counter() - t0)
+
+        idx, dist = nearest(probes, gallery)
+        match = dist <= args.threshold
+        acc = float(np.mean((idx == truth) & match))
+        agree = float(np.mean((idx == base_idx) & (match == base_match)))
+        max_err = float(np.max(np.abs(dist - base_dist)))
+        print(f"{name:<10}{size:>8}{best * 1000:>10.2f}{acc:>10.4f}{agree:>8.4f}{max_err:>10.5f}")
+
+
+if __name__ == "__main__":
+    main()
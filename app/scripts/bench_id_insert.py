@@ -0,0 +1,139 @@
+"""
+主键写入吞吐对比: 随机 ID（uuid4().hex[:12]，CHAR(36)）与按时间递增 ID（app/db/id_generator.py，CHAR(13)）
+
+在测试库中建两张与 sign_record 结构相同的临时表，按发布签到的方式（每个班级一个事务）各写入 --rows 行，
+每写入 --report-every 行打印一次这一段的吞吐。表越大，随机主键的页分裂和缓冲池未命中越明显，
+吞吐随行数下降；递增主键总是追加在聚簇索引末尾，吞吐基本不变。
+同时给出纯 Python 生成 ID 的速度。结束后删除临时表（--keep 保留）。
+
+需要一个本地 MySQL 测试库，不要指向线上库:
+    python -m app.scripts.bench_id_insert --database signin_test --rows 1000000
+"""
+import argparse
+import logging
+import random
+import time
+import uuid
+
+import mysql.connector
+
+from app.db.id_generator import MAX_WORKERS, IdGenerator
+
+logger = logging.getLogger()
+
+TABLE_SQL = """
+CREATE TABLE `{name}` (
+  `id` {id_type} NOT NULL,
+  `sign_task_id` {id_type} NOT NULL,
+  `student_id` {id_type} NOT NULL,
+  `sign_status` tinyint NOT NULL DEFAULT '0',
+  `face_score` float DEFAULT NULL,
+  `created_at` datetime DEFAULT CURRENT_TIMESTAMP,
+  `updated_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_task_student` (`sign_task_id`, `student_id`),
+  KEY `idx_task_status_student` (`sign_task_id`, `sign_status`, `student_id`),
+  KEY `idx_student_task_status` (`student_id`, `sign_task_id`, `sign_status`),
+  KEY `idx_student_created` (`student_id`, `created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+"""
+
+INSERT_SQL = "INSERT INTO `{name}` (id, sign_task_id, student_id, sign_status) VALUES (%s, %s, %s, 0)"
+
+
+def random_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def bench_generate(count: int = 200000):
+    """纯 Python 生成 ID 的速度（个/秒）"""
+    gen = IdGenerator(worker_id=MAX_WORKERS - 1)
+    results = {}
+    for name, fn in (("random", random_id), ("ordered", gen.next_id)):
+        start = time.perf_counter()
+        for _ in range(count):
+            fn()
+        results[name] = count / (time.perf_counter() - start)
+    return results
+
+
+def bench_insert(conn, name: str, id_type: str, new_id, students, rows: int, class_size: int, report_every: int):
+    """
+    按班级（class_size 名学生一个事务）写入 rows 行
+
+    返回:
+        [(已写入行数, 这一段的行/秒), ...]
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DROP TABLE IF EXISTS `{name}`")
+        cursor.execute(TABLE_SQL.format(name=name, id_type=id_type))
+        sql = INSERT_SQL.format(name=name)
+        rng = random.Random(0)
+        points = []
+        written = 0
+        segment_start = time.perf_counter()
+        segment_rows = 0
+        while written < rows:
+            task_id = new_id()
+            batch = [(new_id(), task_id, sid) for sid in rng.sample(students, min(class_size, rows - written))]
+            cursor.executemany(sql, batch)
+            conn.commit()
+            written += len(batch)
+            segment_rows += len(batch)
+            if segment_rows >= report_every or written >= rows:
+                elapsed = time.perf_counter() - segment_start
+                points.append((written, segment_rows / elapsed))
+                print(f"  {name:<24}{written:>10} 行  {segment_rows / elapsed:>10.0f} 行/秒")
+                segment_start = time.perf_counter()
+                segment_rows = 0
+        return points
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比随机主键与递增主键的写入吞吐")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--database", required=True, help="测试库名")
+    parser.add_argument("--rows", type=int, default=500000, help="每张表写入的行数")
+    parser.add_argument("--students", type=int, default=20000)
+    parser.add_argument("--class-size", type=int, default=50, help="每个事务写入的行数")
+    parser.add_argument("--report-every", type=int, default=50000)
+    parser.add_argument("--keep", action="store_true", help="保留临时表")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    rates = bench_generate()
+    print(f"生成 ID: random {rates['random']:.0f} 个/秒, ordered {rates['ordered']:.0f} 个/秒")
+
+    gen = IdGenerator(worker_id=MAX_WORKERS - 1)
+    cases = [
+        ("bench_id_random", "CHAR(36)", random_id, [random_id() for _ in range(args.students)]),
+        ("bench_id_ordered", "CHAR(13)", gen.next_id, [gen.next_id() for _ in range(args.students)]),
+    ]
+    conn = mysql.connector.connect(host=args.host, port=args.port, user=args.user,
+                                   password=args.password, database=args.database)
+    try:
+        summary = []
+        for name, id_type, new_id, students in cases:
+            print(f"{name} ({id_type}):")
+            points = bench_insert(conn, name, id_type, new_id, students, args.rows, args.class_size, args.report_every)
+            summary.append((name, points[0][1], points[-1][1]))
+        print("首段 / 末段吞吐（行/秒）:")
+        for name, first, last in summary:
+            print(f"  {name:<24}{first:>10.0f} -> {last:.0f}")
+        if not args.keep:
+            cursor = conn.cursor()
+            for name, _, _, _ in cases:
+                cursor.execute(f"DROP TABLE IF EXISTS `{name}`")
+            cursor.close()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
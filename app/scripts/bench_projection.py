@@ -0,0 +1,66 @@
+"""
+降维投影基准: 不同维度下的匹配速度、底库内存与准确率
+
+底库优先从 user_info.face_feature 读取（随机数据没有主成分结构，PCA 对其无意义，仅用于冒烟测试）。
+一半特征用于拟合 PCA，另一半作为底库；查询 = 底库特征 + 噪声。
+
+用法:
+    python -m app.scripts.bench_projection [--dims 512,256,128,64] [--whiten] [--synthetic 5000]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.services.FaceMatcher import l2_normalize
+from app.services.FeatureProjection import FeatureProjection
+from app.scripts.bench_feature_codec import load_gallery_from_db, synthetic_gallery
+
+
+def main():
+    parser = argparse.ArgumentParser(description="降维投影基准")
+    parser.add_argument("--dims", default="512,256,128,64")
+    parser.add_argument("--whiten", action="store_true")
+    parser.add_argument("--synthetic", type=int, default=0)
+    parser.add_argument("--noise", type=float, default=0.35)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = synthetic_gallery(args.synthetic, 512, rng) if args.synthetic else l2_normalize(load_gallery_from_db())
+    if len(data) < 4:
+        print("特征数量不足")
+        return
+    perm = rng.permutation(len(data))
+    fit_set = data[perm[: len(data) // 2]]
+    gallery_raw = data[perm[len(data) // 2:]]
+    n = len(gallery_raw)
+
+    probes_raw = l2_normalize(gallery_raw + rng.standard_normal(gallery_raw.shape).astype(np.float32)
+                              * (args.noise / np.sqrt(512)))
+    truth = np.arange(n)
+
+    print(f"拟合集 {len(fit_set)}, 底库 {n}, whiten={args.whiten}")
+    print(f"{'dim':>5}{'gallery KB':>12}{'match ms':>10}{'top1 acc':>10}{'explained':>11}")
+    for dim in [int(d) for d in args.dims.split(",")]:
+        if dim >= 512:
+            gallery, probes, explained = gallery_raw, probes_raw, 1.0
+        else:
+            if dim > len(fit_set):
+                print(f"{dim:>5}  拟合样本不足，跳过")
+                continue
+            proj = FeatureProjection.fit(fit_set, dim, version=0, whiten=args.whiten)
+            gallery, probes, explained = proj.project(gallery_raw), proj.project(probes_raw), proj.explained
+
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            sims = probes @ gallery.T
+            idx = np.argmax(sims, axis=1)
+            best = min(best, time.perf_counter() - t0)
+        acc = float(np.mean(idx == truth))
+        print(f"{dim:>5}{gallery.nbytes / 1024:>12.1f}{best * 1000:>10.2f}{acc:>10.4f}{explained:>11.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+分片底库基准: 不同分片数下的 scatter-gather 查询延迟，以及与单进程暴力搜索的结果一致性
+
+用法:
+    python -m app.scripts.bench_shards [--synthetic 100000] [--shards 1,2,4,8] [--queries 200] [--batch 8] [--k 5]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.services.FaceMatcher import l2_normalize
+from app.services.ShardedGallery import ShardedGallery
+from app.scripts.bench_feature_codec import synthetic_gallery
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分片底库查询延迟")
+    parser.add_argument("--synthetic", type=int, default=100000, help="随机底库人数")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--shards", default="1,2,4,8")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=8, help="每次请求的人脸数（一张合照）")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--churn", type=int, default=1000, help="删除的用户数，用于观察再平衡")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    ids = [f"u{i}" for i in range(args.synthetic)]
+    vectors = synthetic_gallery(args.synthetic, args.dim, rng)
+    pick = rng.choice(args.synthetic, size=args.queries, replace=False)
+    queries = l2_normalize(vectors[pick] + rng.standard_normal((len(pick), args.dim)).astype(np.float32) * 0.02)
+    batches = [queries[i:i + args.batch] for i in range(0, len(queries), args.batch)]
+
+    # 单进程暴力搜索作为基线
+    t0 = time.perf_counter()
+    baseline = []
+    for q in batches:
+        scores = q @ vectors.T
+        baseline.extend(np.argsort(-scores, axis=1)[:, :args.k].tolist())
+    base_ms = (time.perf_counter() - t0) * 1000 / len(batches)
+    expected = [[ids[j] for j in row] for row in baseline]
+
+    print(f"底库 {args.synthetic} 人, dim={args.dim}, 每次 {args.batch} 张人脸, k={args.k}")
+    print(f"{'shards':>7}{'load s':>9}{'ms/req':>9}{'speedup':>9}{'top1':>8}{'sizes after churn':>22}")
+    print(f"{'single':>7}{'-':>9}{base_ms:>9.2f}{1.0:>9.1f}{1.0:>8.4f}")
+    for n in [int(x) for x in args.shards.split(",")]:
+        sharded = ShardedGallery(n, args.dim)
+        try:
+            t0 = time.perf_counter()
+            sharded.load(ids, vectors)
+            load_s = time.perf_counter() - t0
+
+            sharded.search(batches[0], k=args.k)  # 预热
+            t0 = time.perf_counter()
+            results = []
+            for q in batches:
+                results.extend(sharded.search(q, k=args.k))
+            ms = (time.perf_counter() - t0) * 1000 / len(batches)
+            top1 = np.mean([bool(r) and r[0][0] == e[0] for r, e in zip(results, expected)])
+
+            # 集中删除同一分片上的用户，触发再平衡
+            victims = [uid for uid, shard in sharded.placement.items() if shard == 0][:args.churn]
+            for uid in victims:
+                sharded.remove(uid)
+            print(f"{n:>7}{load_s:>9.2f}{ms:>9.2f}{base_ms / ms:>9.1f}{top1:>8.4f}{str(sharded.sizes):>22}")
+        finally:
+            sharded.close()
+
+
+if __name__ == "__main__":
+    main()
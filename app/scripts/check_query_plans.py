@@ -0,0 +1,264 @@
+"""
+签到与用户列表查询的执行计划检查: 对路由中的每条查询执行 EXPLAIN，断言每张基础表都走索引（不出现全表扫描 / 全索引扫描）
+
+需要一个本地 MySQL 测试库（会执行迁移，--seed 时写入模拟数据，不要指向线上库）:
+    python -m app.scripts.check_query_plans --database signin_test --seed
+    python -m app.scripts.check_query_plans --database signin_test -v
+
+数据量太小时优化器会认为全表扫描更便宜，因此默认按一所学校的规模造数据:
+2 万学生、400 个班级、200 名老师、5000 次签到（约 25 万条签到记录）。
+签到分布在最近两年，一年前的签到移入归档表，热表与归档表上的查询都会检查。
+任意一条查询不满足时返回码为 1。
+
+CI 中通过 pytest 运行同一组检查（tests/test_query_plans.py，未配置测试库时跳过）。
+"""
+import argparse
+import logging
+import random
+import sys
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+from app.api import signTask, userInfo
+from app.db import sign_record
+from app.db.id_generator import MAX_WORKERS, IdGenerator
+from app.db.migrate import migrate
+from app.db.sign_archive import ARCHIVE_CANDIDATES_SQL, ARCHIVE_TABLES, archive
+from app.db.sign_record import refresh_task_summary
+
+logger = logging.getLogger()
+
+# (名称, 生成 (SQL, 参数) 的函数)；参数取测试库中真实存在的值
+QUERIES = [
+    ("query_student_sign", lambda s: (signTask.STUDENT_ACTIVE_SIGN_SQL, (s.student,))),
+    ("close_sign_task", lambda s: (signTask.CLOSE_SIGN_TASK_SQL, (2, s.task))),
+    ("update_sign_status", lambda s: (sign_record.SIGN_STATUS_FOR_UPDATE_SQL, (s.task, s.student))),
+    ("query_teacher_sign", lambda s: (signTask.TEACHER_ACTIVE_SIGN_SQL, (s.teacher, 1))),
+    ("query_sign_task_students.meta", lambda s: (signTask.SIGN_TASK_META_SQL, (s.task,))),
+    ("query_sign_task_students.list", lambda s: (signTask.SIGN_TASK_STUDENTS_SQL, (s.task,))),
+    ("query_sign_task_students.meta.archive", lambda s: (signTask.ARCHIVED_SIGN_TASK_META_SQL, (s.archived_task,))),
+    ("query_sign_task_students.list.archive", lambda s: (signTask.ARCHIVED_SIGN_TASK_STUDENTS_SQL, (s.archived_task,))),
+    ("query_teacher_history", lambda s: signTask.build_teacher_history(s.teacher)),
+    ("query_teacher_history.page", lambda s: signTask.build_teacher_history(
+        s.teacher, after=("2030-01-01 00:00:00", "~"), limit=21)),
+    ("query_teacher_history.since", lambda s: signTask.build_teacher_history(s.teacher, since="2000-01-01 00:00:00")),
+    ("query_student_history", lambda s: signTask.build_student_history(s.student)),
+    ("query_student_history.page", lambda s: signTask.build_student_history(
+        s.student, after=("2030-01-01 00:00:00", "~"), limit=21)),
+    ("query_student_history.since", lambda s: signTask.build_student_history(s.student, since="2000-01-01 00:00:00")),
+    ("recognize.task_status", lambda s: ("SELECT status FROM sign_task WHERE sign_task_id = %s LIMIT 1", (s.task,))),
+    ("recognize.pending_students", lambda s: (sign_record.PENDING_STUDENTS_SQL, (s.task,))),
+    ("recognize.mark_signed", lambda s: (sign_record.MARK_SIGNED_SQL, (1, 0.5, s.task, s.student))),
+    ("export_attendance.class", lambda s: signTask.build_attendance_export(
+        class_id=s.class_id, start="2000-01-01", end="2100-01-01")),
+    ("export_attendance.term", lambda s: signTask.build_attendance_export(start="2030-01-01", end="2030-07-01")),
+    ("export_attendance.class.archive", lambda s: signTask.build_attendance_export(
+        class_id=s.class_id, start="2000-01-01", end="2100-01-01", tables=ARCHIVE_TABLES)),
+    ("export_attendance.term.archive", lambda s: signTask.build_attendance_export(
+        start="2000-01-01", end="2000-07-01", tables=ARCHIVE_TABLES)),
+    ("archive.candidates", lambda s: (ARCHIVE_CANDIDATES_SQL, ("2000-01-01 00:00:00", 100))),
+    ("search_by_role.all.first_page", lambda s: userInfo.build_user_search("all", limit=51)),
+    ("search_by_role.all", lambda s: userInfo.build_user_search("all", after=s.student, limit=51)),
+    ("search_by_role.teacher.first_page", lambda s: userInfo.build_user_search("teacher", limit=51)),
+    ("search_by_role.student_face", lambda s: userInfo.build_user_search("student", has_face=False, limit=51)),
+    ("search_by_role.class", lambda s: userInfo.build_user_search("student", class_id=s.class_id, limit=51)),
+]
+
+# 全表扫描 / 全索引扫描
+BAD_TYPES = {"ALL", "index"}
+
+# 检查前更新统计信息的表
+ANALYZE_TABLES = ("user_info", "class", "student_class", "sign_task", "sign_record", "sign_task_summary",
+                  "sign_task_archive", "sign_record_archive")
+
+
+class Sample:
+    """从测试库中取一个有签到记录的学生、任务、老师和班级，以及一个已归档的任务作为查询参数"""
+
+    def __init__(self, cursor):
+        cursor.execute(
+            "SELECT sr.student_id, st.sign_task_id, st.initiator, st.class_id FROM sign_record sr "
+            "JOIN sign_task st ON st.sign_task_id = sr.sign_task_id ORDER BY sr.id LIMIT 1"
+        )
+        row = cursor.fetchone()
+        if not row:
+            raise SystemExit("测试库中没有签到记录，请加 --seed 造数据")
+        self.student, self.task, self.teacher, self.class_id = row
+        cursor.execute("SELECT sign_task_id FROM sign_task_archive LIMIT 1")
+        row = cursor.fetchone()
+        self.archived_task = row[0] if row else ""
+
+
+# 测试库专用的固定 worker 编号，不占用 id_worker 租约
+_ids = IdGenerator(worker_id=MAX_WORKERS - 1)
+
+
+def _new_id():
+    return _ids.next_id()
+
+
+def _insert_many(conn, cursor, sql, rows, batch=5000):
+    for i in range(0, len(rows), batch):
+        cursor.executemany(sql, rows[i:i + batch])
+        conn.commit()
+
+
+def seed(conn, students: int, classes: int, teachers: int, tasks: int, class_size: int):
+    """写入模拟数据（仅在 sign_task 为空时）"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM sign_task")
+        if cursor.fetchone()[0] > 0:
+            logger.info("测试库已有数据，跳过造数据")
+            return
+        rng = random.Random(0)
+        teacher_ids = [_new_id() for _ in range(teachers)]
+        student_ids = [_new_id() for _ in range(students)]
+        _insert_many(conn, cursor,
+                     "INSERT INTO user_info (id, name, password, role, student_id) VALUES (%s, %s, %s, %s, %s)",
+                     [(uid, f"老师{i}", "x", "teacher", None) for i, uid in enumerate(teacher_ids)]
+                     + [(uid, f"学生{i}", "x", "student", f"S{i:08d}") for i, uid in enumerate(student_ids)])
+
+        class_ids = [_new_id() for _ in range(classes)]
+        owners = [rng.choice(teacher_ids) for _ in class_ids]
+        _insert_many(conn, cursor, "INSERT INTO class (id, name, owner) VALUES (%s, %s, %s)",
+                     [(cid, f"班级{i}", owners[i]) for i, cid in enumerate(class_ids)])
+        members = {cid: rng.sample(student_ids, class_size) for cid in class_ids}
+        _insert_many(conn, cursor, "INSERT INTO student_class (student_id, class_id) VALUES (%s, %s)",
+                     [(sid, cid) for cid, sids in members.items() for sid in sids])
+
+        task_rows, record_rows = [], []
+        now = datetime.now().replace(microsecond=0)
+        for i in range(tasks):
+            ci = rng.randrange(classes)
+            cid = class_ids[ci]
+            task_id = _new_id()
+            # 任务均匀分布在最近两年；只有最近的少量任务处于进行中
+            created = now - timedelta(days=730 * (tasks - i) / tasks)
+            status = 1 if i >= tasks - tasks // 100 else 2
+            task_rows.append((_new_id(), task_id, cid, owners[ci], status, created))
+            for sid in members[cid]:
+                record_rows.append((_new_id(), task_id, sid, rng.choice((0, 1, 1, 1, 2, 3)), created))
+        _insert_many(conn, cursor,
+                     "INSERT INTO sign_task (id, sign_task_id, class_id, initiator, status, created_at) "
+                     "VALUES (%s, %s, %s, %s, %s, %s)",
+                     task_rows)
+        _insert_many(conn, cursor,
+                     "INSERT INTO sign_record (id, sign_task_id, student_id, sign_status, created_at) "
+                     "VALUES (%s, %s, %s, %s, %s)",
+                     record_rows)
+        task_ids = [row[1] for row in task_rows]
+        for i in range(0, len(task_ids), 500):
+            refresh_task_summary(cursor, task_ids[i:i + 500])
+            conn.commit()
+        # 一年前的签到移入归档表，热表与归档表各约一半
+        archived, _ = archive(conn, days=365, batch_size=500)
+        logger.info(f"造数据完成: {students} 学生, {classes} 班级, {tasks} 次签到, {len(record_rows)} 条签到记录, "
+                    f"其中 {archived} 次签到已归档")
+    finally:
+        cursor.close()
+
+
+def check_plan(plan):
+    """返回执行计划中的问题列表；派生表 / 物化子查询（<derived2> 等）不是基础表，不检查"""
+    problems = []
+    for row in plan:
+        table = row.get("table")
+        if not table or table.startswith("<"):
+            continue
+        if row.get("type") in BAD_TYPES or row.get("key") is None:
+            problems.append(f"{table}: type={row.get('type')}, key={row.get('key')}, rows={row.get('rows')}")
+    return problems
+
+
+def prepare(conn, seed_args=None) -> Sample:
+    """
+    执行迁移、（seed_args 不为 None 时）造数据并更新统计信息，返回查询参数
+
+    参数:
+        seed_args: seed 的关键字参数（students / classes / teachers / tasks / class_size）
+    """
+    migrate(conn)
+    if seed_args is not None:
+        seed(conn, **seed_args)
+
+    cursor = conn.cursor(dictionary=True)
+    try:
+        for table in ANALYZE_TABLES:
+            cursor.execute(f"ANALYZE TABLE `{table}`")
+            cursor.fetchall()
+    finally:
+        cursor.close()
+
+    cursor = conn.cursor()
+    try:
+        return Sample(cursor)
+    finally:
+        cursor.close()
+
+
+def explain(conn, sample: Sample, query):
+    """
+    对 QUERIES 中的一条查询执行 EXPLAIN
+
+    返回:
+        (执行计划行列表, 问题列表)
+    """
+    sql, params = query(sample)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("EXPLAIN " + sql.strip(), params)
+        plan = cursor.fetchall()
+    finally:
+        cursor.close()
+    return plan, check_plan(plan)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查签到查询的执行计划")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--database", required=True, help="测试库名")
+    parser.add_argument("--seed", action="store_true", help="测试库为空时写入模拟数据")
+    parser.add_argument("--students", type=int, default=20000)
+    parser.add_argument("--classes", type=int, default=400)
+    parser.add_argument("--teachers", type=int, default=200)
+    parser.add_argument("--tasks", type=int, default=5000)
+    parser.add_argument("--class-size", type=int, default=50)
+    parser.add_argument("-v", "--verbose", action="store_true", help="打印每条查询的完整执行计划")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    conn = mysql.connector.connect(host=args.host, port=args.port, user=args.user,
+                                   password=args.password, database=args.database)
+    try:
+        seed_args = None
+        if args.seed:
+            seed_args = dict(students=args.students, classes=args.classes, teachers=args.teachers,
+                             tasks=args.tasks, class_size=args.class_size)
+        sample = prepare(conn, seed_args)
+
+        failed = 0
+        for name, query in QUERIES:
+            plan, problems = explain(conn, sample, query)
+            print(f"{'FAIL' if problems else 'ok':<5}{name}")
+            for p in problems:
+                print(f"       {p}")
+            if args.verbose or problems:
+                for row in plan:
+                    print(f"       {row.get('table')}: type={row.get('type')} key={row.get('key')} "
+                          f"rows={row.get('rows')} extra={row.get('Extra')}")
+            failed += bool(problems)
+        conn.rollback()
+    finally:
+        conn.close()
+
+    print(f"{len(QUERIES) - failed}/{len(QUERIES)} 条查询走索引")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+用已注册用户的人脸特征离线拟合 PCA（可选白化）降维投影
+
+只使用原始特征空间（未投影）的 user_info.face_feature。
+结果保存为 app/models/projection/pca_v<版本>.npz，版本号自动递增；
+加 --activate 后写入 current，配合 FEATURE_PROJECTION=current 生效。
+
+用法:
+    python -m app.scripts.fit_projection --dim 128 [--whiten] [--activate]
+"""
+import argparse
+import logging
+
+import numpy as np
+
+from app.db.connection import get_connection
+from app.services.FaceMatcher import l2_normalize
+from app.services.FeatureProjection import FeatureProjection, next_version, set_current_version
+from app.utils.FeatureBinaryConver import decode_matrix, parse_header
+
+logger = logging.getLogger()
+
+
+def load_raw_features():
+    """读取所有未投影的特征，返回 (N, 512) 归一化矩阵"""
+    conn = get_connection()
+    if not conn:
+        raise RuntimeError("数据库连接失败")
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT face_feature FROM user_info WHERE face_feature IS NOT NULL")
+        blobs = []
+        for (blob,) in cursor.fetchall():
+            header = parse_header(blob)
+            if header is None or header.proj_id == 0:
+                blobs.append(blob)
+    finally:
+        cursor.close()
+        conn.close()
+    matrix, _ = decode_matrix(blobs)
+    return l2_normalize(matrix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="拟合人脸特征降维投影")
+    parser.add_argument("--dim", type=int, default=128, help="目标维度")
+    parser.add_argument("--whiten", action="store_true", help="是否白化")
+    parser.add_argument("--activate", action="store_true", help="拟合后设为 current 版本")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+    data = load_raw_features()
+    logger.info(f"读取到 {len(data)} 个原始特征")
+
+    version = next_version()
+    projection = FeatureProjection.fit(data, args.dim, version, whiten=args.whiten)
+    path = projection.save()
+    logger.info(
+        f"投影已保存: {path}, {projection.in_dim} -> {projection.out_dim}, "
+        f"whiten={projection.whiten}, 方差解释率={projection.explained:.4f}"
+    )
+
+    # 拟合集上的重构质量：投影后两两相似度与原始相似度的相关性（抽样）
+    sample = data[np.random.default_rng(0).choice(len(data), size=min(len(data), 2000), replace=False)]
+    orig = (sample @ sample.T).ravel()
+    proj = projection.project(sample)
+    red = (proj @ proj.T).ravel()
+    corr = float(np.corrcoef(orig, red)[0, 1])
+    logger.info(f"抽样相似度相关系数: {corr:.4f}")
+
+    if args.activate:
+        set_current_version(version)
+        logger.info(f"已设为 current 版本: {version}")
+
+
+if __name__ == "__main__":
+    main()
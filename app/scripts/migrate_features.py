@@ -0,0 +1,104 @@
+"""
+将 user_info.face_feature 统一重写为带版本头、L2 归一化的编码
+
+旧的无头部 float32 特征会被归一化后按 --encoding 重新编码；
+已经是目标编码且已归一化的特征会被跳过，可重复执行。
+指定 --projection 时，原始空间的特征会被投影到该版本（需要先用 fit_projection 拟合）。
+
+用法:
+    python -m app.scripts.migrate_features [--encoding float16] [--projection 1] [--batch-size 500] [--dry-run]
+"""
+import argparse
+import logging
+
+from app.db.connection import get_connection
+from app.services.FeatureProjection import load_projection
+from app.utils.FeatureBinaryConver import (
+    ENCODINGS,
+    FLAG_NORMALIZED,
+    bytes_to_feature,
+    feature_to_bytes,
+    parse_header,
+)
+
+logger = logging.getLogger()
+
+
+def needs_migration(blob: bytes, dtype_code: int, proj_id: int = 0) -> bool:
+    header = parse_header(blob)
+    if header is None:
+        return True
+    if proj_id and header.proj_id == 0:
+        return True
+    return header.dtype != dtype_code or not (header.flags & FLAG_NORMALIZED)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="迁移人脸特征为归一化编码")
+    parser.add_argument("--encoding", default="float32", choices=list(ENCODINGS))
+    parser.add_argument("--projection", type=int, default=0, help="投影版本，0 表示不投影")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    dtype_code = ENCODINGS[args.encoding][0]
+    projection = load_projection(args.projection) if args.projection else None
+
+    conn = get_connection()
+    if not conn:
+        logger.error("数据库连接失败")
+        return
+    cursor = conn.cursor()
+
+    migrated = 0
+    skipped = 0
+    failed = 0
+    last_id = ""
+    try:
+        # 按主键分批读取，避免一次性拉取全部 BLOB
+        while True:
+            cursor.execute(
+                "SELECT id, face_feature FROM user_info "
+                "WHERE id > %s AND face_feature IS NOT NULL ORDER BY id LIMIT %s",
+                (last_id, args.batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            updates = []
+            for uid, blob in rows:
+                if not needs_migration(blob, dtype_code, args.projection):
+                    skipped += 1
+                    continue
+                try:
+                    header = parse_header(blob)
+                    proj_id = header.proj_id if header is not None else 0
+                    feature = bytes_to_feature(blob)
+                    if projection is not None and proj_id == 0:
+                        feature = projection.project(feature)
+                        proj_id = projection.version
+                    updates.append((
+                        feature_to_bytes(feature, encoding=args.encoding, normalize=True, proj_id=proj_id),
+                        uid
+                    ))
+                except Exception as e:
+                    logger.error(f"解析用户 {uid} 特征失败: {e}")
+                    failed += 1
+
+            if updates and not args.dry_run:
+                cursor.executemany("UPDATE user_info SET face_feature = %s WHERE id = %s", updates)
+                conn.commit()
+            migrated += len(updates)
+            logger.info(f"已迁移 {migrated}，跳过 {skipped}，失败 {failed}")
+
+        logger.info(f"迁移完成: 迁移 {migrated}，跳过 {skipped}，失败 {failed}")
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
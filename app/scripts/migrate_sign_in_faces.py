@@ -0,0 +1,138 @@
+"""
+将旧版散落的签到裁剪图迁移到打包文件
+
+旧格式: app/static/signInFaces/<sign_task_id>/<sign_task_id>_<idx>_<student_id|unknown>_<matched>_<rand>.jpg
+新格式: app/static/signInFaces/<sign_task_id>.pack + <sign_task_id>.idx
+
+可重复执行: 打包文件中已有同名来源（source）的图片不会再次追加；
+之前用 --keep 迁移过的目录，不带 --keep 重新执行时只校验并删除原文件。
+
+用法:
+    python -m app.scripts.migrate_sign_in_faces [--base-dir DIR] [--dry-run] [--keep]
+"""
+import argparse
+import logging
+import os
+from pathlib import Path
+
+from app.utils.CropArchive import SIGN_IN_FACES_DIR, get_pack
+
+logger = logging.getLogger()
+
+
+def parse_crop_filename(stem: str):
+    """
+    解析旧裁剪图文件名，返回 (sign_task_id, idx, student_id, matched)，无法解析时返回 None
+    """
+    parts = stem.rsplit("_", 4)
+    if len(parts) != 5:
+        return None
+    sign_task_id, idx, id_part, matched, _ = parts
+    try:
+        idx = int(idx)
+        matched = int(matched)
+    except ValueError:
+        return None
+    student_id = None if id_part == "unknown" else id_part
+    return sign_task_id, idx, student_id, matched
+
+
+def migrate_task_dir(task_dir: Path, dry_run: bool = False, keep: bool = False):
+    """
+    迁移单个签到任务目录，打包文件写在同一个 base_dir 下（task_dir 的上级目录）
+
+    返回:
+        (迁移数量, 跳过数量, 此前已迁移的数量)
+    """
+    sign_task_id = task_dir.name
+    pack = get_pack(task_dir.parent, sign_task_id)
+    existing = {e["source"]: e for e in pack.entries() if e.get("source")}
+    migrated = 0
+    skipped = 0
+    already = 0
+
+    # 按修改时间排序，保持原有写入顺序
+    files = sorted(task_dir.glob("*.jpg"), key=lambda p: p.stat().st_mtime)
+    for path in files:
+        parsed = parse_crop_filename(path.stem)
+        if parsed is None or parsed[0] != sign_task_id:
+            logger.warning(f"无法解析文件名，跳过: {path}")
+            skipped += 1
+            continue
+        _, idx, student_id, matched = parsed
+        entry = existing.get(path.name)
+        if entry is not None:
+            # 已迁移过（例如上次使用了 --keep）: 不再追加，内容一致时按需删除原文件
+            already += 1
+            if dry_run or keep:
+                continue
+            data = path.read_bytes()
+            if pack.read_range(entry["offset"], entry["length"]) != data:
+                logger.error(f"打包文件中的同名图片内容不一致，保留原文件: {path}")
+                continue
+            os.remove(path)
+            continue
+        if dry_run:
+            migrated += 1
+            continue
+
+        data = path.read_bytes()
+        entry = pack.append(
+            data,
+            idx=idx,
+            student_id=student_id,
+            matched=matched,
+            distance=None,
+            source=path.name
+        )
+        # 回读校验后再删除原文件
+        if pack.read_range(entry["offset"], entry["length"]) != data:
+            logger.error(f"回读校验失败，保留原文件: {path}")
+            skipped += 1
+            continue
+        if not keep:
+            os.remove(path)
+        migrated += 1
+
+    if not dry_run and not keep:
+        try:
+            task_dir.rmdir()
+        except OSError:
+            # 目录中还有无法迁移的文件
+            pass
+    return migrated, skipped, already
+
+
+def main():
+    parser = argparse.ArgumentParser(description="迁移签到裁剪图到打包文件")
+    parser.add_argument("--base-dir", default=str(SIGN_IN_FACES_DIR))
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不写入")
+    parser.add_argument("--keep", action="store_true", help="迁移后保留原文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+    base_dir = Path(args.base_dir)
+    if not base_dir.exists():
+        logger.info(f"目录不存在，无需迁移: {base_dir}")
+        return
+
+    total_migrated = 0
+    total_skipped = 0
+    total_already = 0
+    for task_dir in sorted(p for p in base_dir.iterdir() if p.is_dir()):
+        try:
+            migrated, skipped, already = migrate_task_dir(task_dir, dry_run=args.dry_run, keep=args.keep)
+        except ValueError as e:
+            logger.warning(f"跳过目录 {task_dir}: {e}")
+            continue
+        total_migrated += migrated
+        total_skipped += skipped
+        total_already += already
+        logger.info(f"{task_dir.name}: 迁移 {migrated} 张，跳过 {skipped} 张，此前已迁移 {already} 张")
+
+    logger.info(f"迁移完成: 共迁移 {total_migrated} 张，跳过 {total_skipped} 张，此前已迁移 {total_already} 张")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+按 sign_record 重建签到人数统计表 sign_task_summary
+
+统计由 app/db/sign_record.py 增量维护；直接改过数据库、或怀疑统计有偏差时执行。
+按 sign_task_id 分批重算，每批单独提交，不会长时间锁住 sign_record。
+
+用法:
+    python -m app.scripts.rebuild_sign_summary [--batch-size 500] [--sign-task-id ID]
+"""
+import argparse
+import logging
+
+from app.db.connection import get_connection
+from app.db.sign_record import refresh_task_summary
+
+logger = logging.getLogger()
+
+
+def rebuild(conn, batch_size: int = 500) -> int:
+    """重算热表中的全部任务，并删除任务已不存在（也未归档）的统计行，返回重算的任务数"""
+    cursor = conn.cursor()
+    try:
+        total = 0
+        last = ""
+        while True:
+            cursor.execute(
+                "SELECT DISTINCT sign_task_id FROM sign_task WHERE sign_task_id > %s ORDER BY sign_task_id LIMIT %s",
+                (last, batch_size)
+            )
+            ids = [r[0] for r in cursor.fetchall()]
+            if not ids:
+                break
+            total += refresh_task_summary(cursor, ids)
+            conn.commit()
+            last = ids[-1]
+            logger.info(f"已重算 {total} 个签到任务")
+
+        # 已归档任务的统计仍需保留（归档任务的签到记录不再变化，无需重算）
+        cursor.execute(
+            "DELETE ss FROM sign_task_summary ss "
+            "LEFT JOIN sign_task st ON st.sign_task_id = ss.sign_task_id "
+            "LEFT JOIN sign_task_archive sa ON sa.sign_task_id = ss.sign_task_id "
+            "WHERE st.sign_task_id IS NULL AND sa.sign_task_id IS NULL"
+        )
+        if cursor.rowcount:
+            logger.info(f"删除 {cursor.rowcount} 条无对应任务的统计")
+        conn.commit()
+        return total
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重建签到人数统计")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--sign-task-id", default=None, help="只重算指定的签到任务")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    conn = get_connection()
+    if conn is None:
+        raise SystemExit("数据库连接失败")
+    try:
+        if args.sign_task_id:
+            cursor = conn.cursor()
+            try:
+                refresh_task_summary(cursor, [args.sign_task_id])
+                conn.commit()
+            finally:
+                cursor.close()
+            print(f"已重算签到任务: {args.sign_task_id}")
+        else:
+            print(f"已重算 {rebuild(conn, args.batch_size)} 个签到任务")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
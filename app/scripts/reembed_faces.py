@@ -0,0 +1,151 @@
+"""
+使用注册时保存的对齐人脸图重新生成 user_info.face_feature（更换模型权重后使用）
+
+对齐图已经是 160x160 的 MTCNN 输出，直接送入 InceptionResnetV1，跳过人脸检测。
+face_template 中带 crop_id 的注册模板同样重新提取，并重新计算质心写回 face_feature；
+没有对齐图的旧模板（由旧版 face_feature 迁入）会被删除。
+
+用法:
+    python -m app.scripts.reembed_faces [--batch-size 64] [--dry-run]
+"""
+import argparse
+import io
+import logging
+
+import numpy as np
+from PIL import Image
+
+from app.db.connection import get_connection
+from app.services.FaceRecognitionService import FaceRecognitionService
+from app.services.FaceTemplates import refresh_summary
+from app.services.FeatureProjection import get_active_projection
+from app.utils.CropArchive import get_face_crop_pack
+from app.utils.FeatureBinaryConver import feature_to_bytes
+
+logger = logging.getLogger()
+
+
+def latest_crops_by_user(pack):
+    """一次遍历索引，得到每个用户最新的对齐图条目"""
+    latest = {}
+    for entry in pack.entries():
+        user_id = entry.get("user_id")
+        if user_id:
+            latest[user_id] = entry
+    return latest
+
+
+def encode_features(features, projection):
+    if projection is not None:
+        return [feature_to_bytes(f, normalize=True, proj_id=projection.version)
+                for f in projection.project(np.stack(features))]
+    return [feature_to_bytes(f, normalize=True) for f in features]
+
+
+def reembed_templates(conn, cursor, pack, face_service, projection, batch_size, dry_run):
+    """重新提取所有带对齐图的模板，并刷新这些用户的质心"""
+    cursor.execute("SELECT id, user_id, crop_id FROM face_template WHERE crop_id IS NOT NULL")
+    rows = cursor.fetchall()
+    users = set()
+    for start in range(0, len(rows), batch_size):
+        batch = []
+        crops = []
+        for template_id, user_id, crop_id in rows[start:start + batch_size]:
+            data, _ = pack.read(crop_id)
+            if data is None:
+                logger.warning(f"模板对齐图不存在: template_id={template_id}, crop_id={crop_id}")
+                continue
+            batch.append((template_id, user_id))
+            crops.append(Image.open(io.BytesIO(data)).convert("RGB"))
+        if not crops:
+            continue
+
+        features = face_service.extract_features_from_crops(crops)
+        if len(features) != len(batch):
+            logger.error(f"模板批次特征提取失败: start={start}")
+            continue
+        if not dry_run:
+            cursor.executemany(
+                "UPDATE face_template SET feature = %s WHERE id = %s",
+                list(zip(encode_features(features, projection), [t for t, _ in batch]))
+            )
+            conn.commit()
+        users.update(u for _, u in batch)
+
+    if not dry_run:
+        for user_id in users:
+            cursor.execute("DELETE FROM face_template WHERE user_id = %s AND crop_id IS NULL", (user_id,))
+            refresh_summary(cursor, user_id, projection)
+        conn.commit()
+    logger.info(f"模板重新提取完成: {len(users)} 个用户")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从对齐人脸图重新提取人脸特征")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--dry-run", action="store_true", help="只提取，不写入数据库")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+    conn = get_connection()
+    if not conn:
+        logger.error("数据库连接失败")
+        return
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("SELECT id FROM user_info WHERE face_feature IS NOT NULL")
+        user_ids = [r[0] for r in cursor.fetchall()]
+
+        pack = get_face_crop_pack()
+        latest = latest_crops_by_user(pack)
+        todo = [uid for uid in user_ids if uid in latest]
+        missing = len(user_ids) - len(todo)
+        if missing:
+            logger.warning(f"{missing} 个用户没有对齐人脸图，需要重新上传照片")
+
+        face_service = FaceRecognitionService()
+        projection = get_active_projection()
+        updated = 0
+        broken = 0
+        for start in range(0, len(todo), args.batch_size):
+            batch_ids = []
+            crops = []
+            for uid in todo[start:start + args.batch_size]:
+                data, _ = pack.read(latest[uid]["crop_id"])
+                if data is None:
+                    # 索引条目对应的数据缺失或不完整，跳过该用户，不中断整个任务
+                    logger.warning(f"对齐人脸图不存在或不完整: user_id={uid}, crop_id={latest[uid]['crop_id']}")
+                    broken += 1
+                    continue
+                batch_ids.append(uid)
+                crops.append(Image.open(io.BytesIO(data)).convert("RGB"))
+            if not crops:
+                continue
+
+            features = face_service.extract_features_from_crops(crops)
+            if len(features) != len(batch_ids):
+                logger.error(f"批次特征提取失败: start={start}")
+                continue
+
+            if not args.dry_run:
+                blobs = encode_features(features, projection)
+                cursor.executemany(
+                    "UPDATE user_info SET face_feature = %s WHERE id = %s",
+                    list(zip(blobs, batch_ids))
+                )
+                conn.commit()
+            updated += len(batch_ids)
+            logger.info(f"已处理 {updated}/{len(todo)}")
+
+        logger.info(f"重新提取完成: 更新 {updated} 个用户，缺少对齐图 {missing} 个，对齐图损坏 {broken} 个")
+
+        reembed_templates(conn, cursor, pack, face_service, projection, args.batch_size, args.dry_run)
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
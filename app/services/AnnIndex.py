@@ -0,0 +1,395 @@
+import base64
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from app.services.FaceMatcher import Gallery, l2_normalize
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，仅依赖进程内锁
+    fcntl = None
+
+logger = logging.getLogger()
+
+# 索引文件目录
+ANN_DIR = Path("app/data/ann")
+
+# 增量日志累计多少条后合并为新的快照
+COMPACT_EVERY = 2000
+
+# 少于该人数时不做聚类，直接使用单个倒排列表（即暴力搜索）
+MIN_TRAIN_SIZE = 1000
+
+
+def default_nlist(n: int) -> int:
+    """倒排列表数量: 约 4 * sqrt(N)"""
+    if n < MIN_TRAIN_SIZE:
+        return 1
+    return int(min(max(4 * np.sqrt(n), 16), 4096))
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iters: int = 20, sample: int = 50000, seed: int = 0):
+    """
+    球面 k-means（余弦相似度）训练粗聚类中心
+
+    参数:
+        vectors: (N, D) 归一化特征
+        nlist: 聚类中心数量
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    if nlist <= 1 or n == 0:
+        dim = vectors.shape[1]
+        c = vectors.mean(axis=0, keepdims=True) if n else np.zeros((1, dim), dtype=np.float32)
+        return l2_normalize(c) if n else np.zeros((1, dim), dtype=np.float32)
+
+    data = vectors if n <= sample else vectors[rng.choice(n, size=sample, replace=False)]
+    nlist = min(nlist, len(data))
+    centroids = data[rng.choice(len(data), size=nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(data @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # 空簇用随机样本重新初始化
+            sums[empty] = data[rng.choice(len(data), size=int(empty.sum()), replace=False)]
+        centroids = l2_normalize(sums)
+    return centroids.astype(np.float32)
+
+
+@contextmanager
+def _file_lock(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class IvfIndex:
+    """
+    倒排文件（IVF）近似最近邻索引，全部使用 NumPy 实现
+
+    - 粗聚类中心 centroids: (nlist, D)
+    - 每个用户特征归入最近的聚类中心对应的倒排列表
+    - 查询时只扫描与查询最相似的 nprobe 个列表，代价约为 N * nprobe / nlist
+
+    持久化:
+        ivf.npz          快照（centroids / ids / vectors / 代数 gen / 投影版本）
+        ivf-<gen>.log    快照之后的增量更新，每行一条 JSON（U 更新 / D 删除）
+    多个 worker 进程共享同一份文件: 写入时持有文件锁并追加日志，
+    其它进程在查询前读取日志的新增部分即可同步，日志过长时合并为新一代快照。
+    """
+
+    def __init__(self, base_dir=ANN_DIR, name: str = "ivf"):
+        self.base_dir = Path(base_dir)
+        self.name = name
+        self.snapshot_path = self.base_dir / f"{name}.npz"
+        self.lock_path = self.base_dir / f"{name}.lock"
+        self._lock = threading.RLock()
+        self._reset(np.zeros((1, 0), dtype=np.float32))
+        self.gen = 0
+        self.proj_id = 0
+        self._snapshot_stamp_seen = None
+        self._log_pos = 0
+        self._log_records = 0
+
+    # -----------------------------
+    # 内存结构
+    # -----------------------------
+    def _reset(self, centroids: np.ndarray):
+        self.centroids = centroids.astype(np.float32)
+        self.dim = centroids.shape[1]
+        self.ids = []
+        self.pos = {}  # user_id -> 行号
+        self.vectors = np.empty((0, self.dim), dtype=np.float32)
+        self.assign = np.empty(0, dtype=np.int32)  # 行号 -> 倒排列表，-1 表示已删除
+        self.count = 0
+        self._lists = None  # 懒构建: 每个倒排列表的行号数组
+
+    def __len__(self):
+        return len(self.pos)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def _ensure_capacity(self, n: int):
+        if n <= len(self.vectors):
+            return
+        cap = max(n, int(len(self.vectors) * 1.5) + 64)
+        vectors = np.empty((cap, self.dim), dtype=np.float32)
+        vectors[:self.count] = self.vectors[:self.count]
+        assign = np.full(cap, -1, dtype=np.int32)
+        assign[:self.count] = self.assign[:self.count]
+        self.vectors, self.assign = vectors, assign
+
+    def _apply_upsert(self, user_id: str, vec: np.ndarray):
+        vec = l2_normalize(vec)
+        list_no = int(np.argmax(self.centroids @ vec))
+        row = self.pos.get(user_id)
+        if row is None:
+            self._ensure_capacity(self.count + 1)
+            row = self.count
+            self.count += 1
+            self.ids.append(user_id)
+            self.pos[user_id] = row
+        self.vectors[row] = vec
+        self.assign[row] = list_no
+        self._lists = None
+
+    def _apply_remove(self, user_id: str):
+        row = self.pos.pop(user_id, None)
+        if row is not None:
+            self.assign[row] = -1
+            self._lists = None
+
+    def _inverted_lists(self):
+        if self._lists is None:
+            assign = self.assign[:self.count]
+            order = np.argsort(assign, kind="stable")
+            bounds = np.searchsorted(assign[order], np.arange(self.nlist + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(self.nlist)]
+        return self._lists
+
+    # -----------------------------
+    # 构建与查询
+    # -----------------------------
+    def build(self, ids, vectors: np.ndarray, nlist: int = None, proj_id: int = 0):
+        """用全部特征重新训练并构建索引"""
+        vectors = l2_normalize(vectors)
+        nlist = nlist or default_nlist(len(ids))
+        with self._lock:
+            self._reset(train_centroids(vectors, nlist))
+            self.proj_id = proj_id
+            self._ensure_capacity(len(ids))
+            if len(ids):
+                self.vectors[:len(ids)] = vectors
+                self.assign[:len(ids)] = np.argmax(vectors @ self.centroids.T, axis=1)
+            self.ids = list(ids)
+            self.pos = {uid: i for i, uid in enumerate(self.ids)}
+            self.count = len(ids)
+
+    def search(self, queries: np.ndarray, k: int = 5, nprobe: int = 8):
+        """
+        近似搜索
+
+        参数:
+            queries: (M, D) 已变换到索引空间的特征
+            k: 每个查询返回的候选数量
+            nprobe: 扫描的倒排列表数量
+
+        返回:
+            长度为 M 的列表，每项为 [(user_id, 余弦相似度), ...]，按相似度降序
+        """
+        self.sync()
+        q = l2_normalize(np.atleast_2d(queries))
+        with self._lock:
+            lists = self._inverted_lists()
+            nprobe = max(1, min(nprobe, self.nlist))
+            coarse = q @ self.centroids.T
+            probe = np.argsort(-coarse, axis=1)[:, :nprobe]
+            results = []
+            for i in range(len(q)):
+                rows = np.concatenate([lists[j] for j in probe[i]])
+                results.append(self._top_k(q[i], rows, k))
+            return results
+
+    def search_exact(self, queries: np.ndarray, k: int = 5):
+        """暴力搜索（用于评估召回率）"""
+        self.sync()
+        q = l2_normalize(np.atleast_2d(queries))
+        with self._lock:
+            rows = np.nonzero(self.assign[:self.count] >= 0)[0]
+            return [self._top_k(q[i], rows, k) for i in range(len(q))]
+
+    def _top_k(self, q: np.ndarray, rows: np.ndarray, k: int):
+        if len(rows) == 0:
+            return []
+        scores = self.vectors[rows] @ q
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[rows[t]], float(scores[t])) for t in top]
+
+    # -----------------------------
+    # 持久化与多进程同步
+    # -----------------------------
+    def _log_path(self, gen: int) -> Path:
+        return self.base_dir / f"{self.name}-{gen}.log"
+
+    def exists(self) -> bool:
+        return self.snapshot_path.exists()
+
+    def save(self):
+        """写入新一代快照并切换到新的增量日志（调用方需持有文件锁）"""
+        with self._lock:
+            old_gen = self.gen
+            self.gen += 1
+            live = np.nonzero(self.assign[:self.count] >= 0)[0]
+            self.base_dir.mkdir(parents=True, exist_ok=True)
+            tmp = self.snapshot_path.with_name(self.snapshot_path.name + ".tmp")
+            with open(tmp, "wb") as f:
+                np.savez(
+                    f,
+                    gen=np.int64(self.gen),
+                    proj_id=np.int64(self.proj_id),
+                    centroids=self.centroids,
+                    ids=np.array([self.ids[r] for r in live], dtype=str),
+                    vectors=self.vectors[live],
+                )
+            open(self._log_path(self.gen), "ab").close()
+            os.replace(tmp, self.snapshot_path)
+            self._snapshot_stamp_seen = self._snapshot_stamp()
+            self._log_pos = 0
+            self._log_records = 0
+            try:
+                os.remove(self._log_path(old_gen))
+            except OSError:
+                pass
+
+    def _load_snapshot(self):
+        with np.load(self.snapshot_path) as data:
+            centroids = data["centroids"]
+            ids = [str(x) for x in data["ids"]]
+            vectors = data["vectors"]
+            self._reset(centroids)
+            self.gen = int(data["gen"])
+            self.proj_id = int(data["proj_id"])
+        self._ensure_capacity(len(ids))
+        if ids:
+            self.vectors[:len(ids)] = vectors
+            self.assign[:len(ids)] = np.argmax(vectors @ self.centroids.T, axis=1)
+        self.ids = ids
+        self.pos = {uid: i for i, uid in enumerate(ids)}
+        self.count = len(ids)
+        self._snapshot_stamp_seen = self._snapshot_stamp()
+        self._log_pos = 0
+        self._log_records = 0
+
+    def _snapshot_stamp(self):
+        st = os.stat(self.snapshot_path)
+        return st.st_mtime_ns, st.st_ino
+
+    def sync(self):
+        """读取其它进程写入的快照/增量日志"""
+        with self._lock:
+            if not self.snapshot_path.exists():
+                return
+            if self._snapshot_stamp() != self._snapshot_stamp_seen:
+                self._load_snapshot()
+            log_path = self._log_path(self.gen)
+            if not log_path.exists():
+                return
+            with open(log_path, "rb") as f:
+                f.seek(self._log_pos)
+                chunk = f.read()
+            end = chunk.rfind(b"\n")
+            if end < 0:
+                return
+            for line in chunk[:end].splitlines():
+                try:
+                    rec = json.loads(line)
+                    if rec["op"] == "U":
+                        vec = np.frombuffer(base64.b64decode(rec["v"]), dtype=np.float32)
+                        if vec.size == self.dim:
+                            self._apply_upsert(rec["id"], vec)
+                    elif rec["op"] == "D":
+                        self._apply_remove(rec["id"])
+                except Exception as e:
+                    logger.error(f"解析 ANN 增量日志失败: {e}")
+                self._log_records += 1
+            self._log_pos += end + 1
+
+    def _append_log(self, rec: dict):
+        with open(self._log_path(self.gen), "ab") as f:
+            f.write((json.dumps(rec) + "\n").encode("utf-8"))
+
+    def upsert(self, user_id: str, vec: np.ndarray):
+        """新增/更新一个用户的特征（写增量日志，必要时合并快照）"""
+        vec = l2_normalize(np.asarray(vec, dtype=np.float32).reshape(-1))
+        with _file_lock(self.lock_path):
+            self.sync()
+            if vec.size != self.dim:
+                raise ValueError(f"特征维度不匹配: {vec.size} != {self.dim}")
+            self._append_log({"op": "U", "id": user_id, "v": base64.b64encode(vec.tobytes()).decode("ascii")})
+            self.sync()
+            if self._log_records >= COMPACT_EVERY:
+                self.save()
+
+    def remove(self, user_id: str):
+        with _file_lock(self.lock_path):
+            self.sync()
+            if user_id not in self.pos:
+                return
+            self._append_log({"op": "D", "id": user_id})
+            self.sync()
+            if self._log_records >= COMPACT_EVERY:
+                self.save()
+
+    def rebuild(self, ids, vectors: np.ndarray, nlist: int = None, proj_id: int = 0):
+        """重新训练聚类中心并写入快照"""
+        with _file_lock(self.lock_path):
+            self.sync()
+            self.build(ids, vectors, nlist=nlist, proj_id=proj_id)
+            self.save()
+
+
+def load_gallery_from_db(projection=None) -> Gallery:
+    """读取全部已采集人脸的用户，构建（可投影的）底库"""
+    from app.db.connection import get_connection
+
+    conn = get_connection()
+    if not conn:
+        raise RuntimeError("数据库连接失败")
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id, face_feature FROM user_info WHERE face_feature IS NOT NULL")
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+    return Gallery.from_rows(rows, projection=projection)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_ann_index(projection=None, build_if_missing: bool = True):
+    """
+    获取进程内共享的全校 ANN 索引
+
+    索引文件不存在或投影版本与当前不一致时，从数据库重新构建。
+    build_if_missing=False 时只加载已有索引（不存在返回 None），用于写路径上的增量更新。
+    """
+    global _index
+    proj_id = projection.version if projection is not None else 0
+    with _index_lock:
+        if _index is None:
+            _index = IvfIndex()
+        index = _index
+        index.sync()
+
+        if index.exists() and index.proj_id == proj_id:
+            return index
+        if not build_if_missing:
+            return None
+
+        logger.info(f"构建全校 ANN 索引: proj_id={proj_id}")
+        gallery = load_gallery_from_db(projection)
+        index.rebuild(gallery.ids, gallery.matrix, proj_id=proj_id)
+        logger.info(f"ANN 索引构建完成: {len(index)} 人, nlist={index.nlist}")
+        return index
@@ -0,0 +1,134 @@
+import logging
+
+import numpy as np
+
+from app.utils.FeatureBinaryConver import decode_matrix, parse_header, LEGACY_SHAPE
+
+logger = logging.getLogger()
+
+
+# -----------------------------
+# 距离阈值与余弦阈值换算
+# -----------------------------
+# 对 L2 归一化的向量: |a - b|^2 = 2 - 2 * cos(a, b)
+# 因此欧氏距离阈值 t 等价于余弦阈值 1 - t^2 / 2（默认 0.8 -> 0.68）
+
+def distance_to_cosine(threshold: float) -> float:
+    """欧氏距离阈值 -> 余弦相似度阈值"""
+    return 1.0 - (threshold ** 2) / 2.0
+
+
+def cosine_to_distance(cos):
+    """余弦相似度 -> 欧氏距离（支持标量与数组）"""
+    d = np.sqrt(np.maximum(2.0 - 2.0 * np.asarray(cos, dtype=np.float64), 0.0))
+    return float(d) if np.ndim(d) == 0 else d
+
+
+def l2_normalize(x: np.ndarray, axis: int = -1) -> np.ndarray:
+    """L2 归一化（零向量保持为零）"""
+    x = np.asarray(x, dtype=np.float32)
+    norm = np.linalg.norm(x, axis=axis, keepdims=True)
+    norm[norm == 0] = 1.0
+    return x / norm
+
+
+class Gallery:
+    """
+    人脸特征底库：ids 与 L2 归一化后的 (N, D) float32 矩阵一一对应
+
+    查询时只需一次矩阵乘法 queries @ matrix.T 得到全部余弦相似度。
+    启用降维投影时底库位于投影空间，原始维度的查询特征会先被投影。
+    """
+
+    def __init__(self, ids, matrix: np.ndarray, projection=None):
+        self.ids = list(ids)
+        self.projection = projection
+        dim = projection.out_dim if projection is not None else LEGACY_SHAPE[0]
+        self.matrix = l2_normalize(matrix) if len(self.ids) else np.empty((0, dim), dtype=np.float32)
+
+    @classmethod
+    def from_rows(cls, rows, dim: int = LEGACY_SHAPE[0], projection=None):
+        """
+        从数据库行 [(id, face_feature), ...] 构建底库，无特征或解析失败的行被跳过
+
+        参数:
+            projection: 可选的 FeatureProjection；已按该版本投影存储的特征直接使用，
+                        原始特征在加载时投影，其它投影版本的特征被跳过
+        """
+        if projection is None:
+            matrix, valid = decode_matrix([r[1] for r in rows], dim=dim)
+            ids = [rows[i][0] for i in valid]
+        else:
+            direct, raw = [], []
+            for i, (_, blob) in enumerate(rows):
+                if blob is None:
+                    continue
+                header = parse_header(blob)
+                proj_id = header.proj_id if header is not None else 0
+                if proj_id == projection.version:
+                    direct.append(i)
+                elif proj_id == 0:
+                    raw.append(i)
+            m1, v1 = decode_matrix([rows[i][1] for i in direct], dim=projection.out_dim)
+            m2, v2 = decode_matrix([rows[i][1] for i in raw], dim=projection.in_dim)
+            matrix = np.concatenate([m1, projection.project(m2)]) if len(v2) else m1
+            ids = [rows[direct[j]][0] for j in v1] + [rows[raw[j]][0] for j in v2]
+
+        if len(ids) < len(rows):
+            logger.warning(f"{len(rows) - len(ids)} 个用户没有可用的人脸特征")
+        return cls(ids, matrix, projection)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def prepare_queries(self, queries: np.ndarray) -> np.ndarray:
+        """把查询特征变换到底库所在空间并归一化"""
+        q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.projection is not None and q.shape[1] == self.projection.in_dim:
+            return self.projection.project(q)
+        return l2_normalize(q)
+
+    def similarities(self, queries: np.ndarray) -> np.ndarray:
+        """
+        计算查询特征与底库的余弦相似度
+
+        参数:
+            queries: (M, D) 特征矩阵或 (D,) 单个特征
+
+        返回:
+            (M, N) 相似度矩阵
+        """
+        return self.prepare_queries(queries) @ self.matrix.T
+
+
+def greedy_match(sims: np.ndarray, cos_threshold: float):
+    """
+    按人脸顺序逐个分配：每张人脸取尚未被匹配的底库中相似度最高者，
+    达到阈值则匹配成功，该底库成员不再参与后续人脸的比对。
+
+    参数:
+        sims: (M, N) 相似度矩阵
+        cos_threshold: 余弦相似度阈值
+
+    返回:
+        长度为 M 的列表，每项为 (底库列下标或 None, 最佳相似度或 None)
+    """
+    m, n = sims.shape
+    results = []
+    if n == 0:
+        return [(None, None)] * m
+
+    available = np.ones(n, dtype=bool)
+    for i in range(m):
+        if not available.any():
+            results.append((None, None))
+            continue
+        row = np.where(available, sims[i], -np.inf)
+        j = int(np.argmax(row))
+        best = float(row[j])
+        if best >= cos_threshold:
+            available[j] = False
+            results.append((j, best))
+        else:
+            results.append((None, best))
+    return results
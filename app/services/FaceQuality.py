@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger()
+
+
+# -----------------------------
+# 人脸质量门限
+# -----------------------------
+# 在检测与特征提取之间过滤掉不可能匹配的人脸（过小、模糊、低置信度、侧脸过大），
+# 既省去 InceptionResnetV1 的计算，也避免保存无用的裁剪图。
+#
+#   min_prob       MTCNN 检测置信度下限
+#   min_size       人脸框短边像素下限
+#   min_sharpness  拉普拉斯方差下限（人脸缩放到 96x96 灰度后计算，越大越清晰）
+#   max_yaw        由五点关键点估计的偏航角上限（度）
+
+QualityProfile = namedtuple("QualityProfile", "min_prob min_size min_sharpness max_yaw")
+
+DEFAULT_PROFILES = {
+    "enroll": QualityProfile(0.95, 80, 60.0, 25.0),    # 注册: 要求正脸、清晰
+    "verify": QualityProfile(0.93, 60, 40.0, 35.0),    # 自拍签到
+    "recognize": QualityProfile(0.90, 32, 25.0, 45.0),  # 合照签到
+    "burst": QualityProfile(0.90, 32, 25.0, 45.0),     # 连拍/视频
+    "live": QualityProfile(0.90, 40, 30.0, 40.0),      # 门口摄像头
+    "identify": QualityProfile(0.90, 32, 25.0, 45.0),  # 全校检索
+    "off": QualityProfile(0.0, 0, 0.0, 180.0),         # 不过滤
+}
+
+# 通过环境变量覆盖，例如 FACE_QUALITY_PROFILES='{"recognize": {"min_size": 48}}'
+_overrides = json.loads(os.environ.get("FACE_QUALITY_PROFILES", "{}") or "{}")
+PROFILES = {
+    name: profile._replace(**_overrides.get(name, {})) for name, profile in DEFAULT_PROFILES.items()
+}
+for _name, _fields in _overrides.items():
+    if _name not in PROFILES:
+        PROFILES[_name] = DEFAULT_PROFILES["recognize"]._replace(**_fields)
+
+# 拒绝原因
+REASON_LOW_PROB = "low_prob"
+REASON_TOO_SMALL = "too_small"
+REASON_BLURRY = "blurry"
+REASON_POSE = "pose"
+
+REASON_TEXT = {
+    REASON_LOW_PROB: "检测置信度过低",
+    REASON_TOO_SMALL: "人脸过小",
+    REASON_BLURRY: "人脸模糊",
+    REASON_POSE: "侧脸角度过大",
+}
+
+
+def get_profile(name: str, **overrides) -> QualityProfile:
+    """按名称取质量门限，overrides 中非 None 的字段覆盖默认值"""
+    if name not in PROFILES:
+        raise ValueError(f"未知的质量配置: {name}")
+    fields = {k: v for k, v in overrides.items() if v is not None}
+    return PROFILES[name]._replace(**fields) if fields else PROFILES[name]
+
+
+def sharpness(image: Image.Image, box) -> float:
+    """人脸区域的拉普拉斯方差（缩放到固定尺寸，与人脸大小无关）"""
+    x1, y1, x2, y2 = [int(round(v)) for v in box]
+    crop = image.crop((max(0, x1), max(0, y1), min(image.width, x2), min(image.height, y2)))
+    gray = np.asarray(crop.convert("L").resize((96, 96), Image.BILINEAR), dtype=np.float32)
+    lap = gray[1:-1, :-2] + gray[1:-1, 2:] + gray[:-2, 1:-1] + gray[2:, 1:-1] - 4.0 * gray[1:-1, 1:-1]
+    return float(lap.var())
+
+
+def estimate_yaw(landmarks) -> float:
+    """
+    由 MTCNN 五点关键点（左眼、右眼、鼻尖、左嘴角、右嘴角）粗略估计偏航角（度）
+
+    正脸时鼻尖位于两眼中点正下方；转头时鼻尖相对两眼中点的水平偏移与半眼距之比约为 sin(yaw)
+    """
+    if landmarks is None:
+        return 0.0
+    pts = np.asarray(landmarks, dtype=np.float64)
+    left_eye, right_eye, nose = pts[0], pts[1], pts[2]
+    half = abs(right_eye[0] - left_eye[0]) / 2.0
+    if half < 1e-6:
+        return 90.0
+    ratio = (nose[0] - (left_eye[0] + right_eye[0]) / 2.0) / half
+    return float(np.degrees(np.arcsin(np.clip(ratio, -1.0, 1.0))))
+
+
+def assess(image: Image.Image, box, prob, landmarks, profile: QualityProfile):
+    """
+    评估单个人脸，按开销从小到大依次检查，第一个不满足的条件即为拒绝原因
+
+    返回:
+        (reason 或 None, 指标字典)
+    """
+    metrics = {"prob": float(prob) if prob is not None else None}
+    if prob is not None and prob < profile.min_prob:
+        return REASON_LOW_PROB, metrics
+
+    size = float(min(box[2] - box[0], box[3] - box[1]))
+    metrics["size"] = size
+    if size < profile.min_size:
+        return REASON_TOO_SMALL, metrics
+
+    yaw = estimate_yaw(landmarks)
+    metrics["yaw"] = yaw
+    if abs(yaw) > profile.max_yaw:
+        return REASON_POSE, metrics
+
+    if profile.min_sharpness > 0:
+        metrics["sharpness"] = sharpness(image, box)
+        if metrics["sharpness"] < profile.min_sharpness:
+            return REASON_BLURRY, metrics
+    return None, metrics
+
+
+def filter_faces(image: Image.Image, boxes, probs, landmarks, profile_name: str, profile: QualityProfile = None):
+    """
+    对一帧的全部检测结果做质量过滤
+
+    返回:
+        keep: 通过的人脸下标列表
+        rejected: [{"box", "reason", "message", **指标}, ...]
+    """
+    profile = profile or get_profile(profile_name)
+    keep = []
+    rejected = []
+    if boxes is None:
+        return keep, rejected
+    for i, box in enumerate(boxes):
+        reason, metrics = assess(
+            image, box,
+            probs[i] if probs is not None else None,
+            landmarks[i] if landmarks is not None else None,
+            profile
+        )
+        if reason is None:
+            keep.append(i)
+        else:
+            rejected.append(dict(
+                {"box": [float(v) for v in box], "reason": reason, "message": REASON_TEXT[reason]}, **metrics
+            ))
+    quality_stats.record(profile_name, len(keep), [r["reason"] for r in rejected])
+    return keep, rejected
+
+
+class QualityStats:
+    """按质量配置统计检测到、通过、各原因拒绝的人脸数（进程内累计）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, profile_name: str, passed: int, reasons):
+        with self._lock:
+            counts = self._counts.setdefault(profile_name, {"detected": 0, "passed": 0, "rejected": {}})
+            counts["detected"] += passed + len(reasons)
+            counts["passed"] += passed
+            for reason in reasons:
+                counts["rejected"][reason] = counts["rejected"].get(reason, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            result = {}
+            for name, counts in self._counts.items():
+                rejected = sum(counts["rejected"].values())
+                result[name] = {
+                    "detected": counts["detected"],
+                    "passed": counts["passed"],
+                    "rejected": dict(counts["rejected"]),
+                    "rejected_ratio": rejected / counts["detected"] if counts["detected"] else 0.0,
+                }
+            return result
+
+
+quality_stats = QualityStats()
@@ -6,14 +6,21 @@ import torch
 import logging
 import time
 from pathlib import Path
+from app.services.FaceQuality import filter_faces
 
 logger = logging.getLogger()
 
 class FaceRecognitionService:
-    def __init__(self):
-        """初始化人脸检测器和特征提取模型（从本地加载权重）"""
+    def __init__(self, normalize=True):
+        """
+        初始化人脸检测器和特征提取模型（从本地加载权重）
+        
+        参数:
+            normalize: 是否输出 L2 归一化的特征，归一化后可以直接用点积（余弦相似度）比对
+        """
         logger.info("FaceRecognitionService 初始化开始")
         start_ts = time.time()
+        self.normalize = normalize
         
         # 模型权重文件路径
         models_dir = Path("app/models")
@@ -131,8 +138,11 @@ class FaceRecognitionService:
             logger.info(f"成功提取 {len(embeddings)} 个人脸特征，每个特征维度: {embeddings.shape[1]}")
             logger.debug(f"embeddings tensor shape: {embeddings.shape}")
             
+            if self.normalize:
+                embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
+            
             # 转换为 numpy 数组列表
-            features = [embedding.cpu().numpy() for embedding in embeddings]
+            features = [embedding.cpu().numpy().astype(np.float32) for embedding in embeddings]
             logger.debug(f"转换为 numpy 特征列表，长度: {len(features)}，单个维度: {features[0].shape if len(features)>0 else None}")
             
             logger.debug(f"extract_features 耗时 {time.time() - t0:.3f}s")
@@ -143,6 +153,54 @@ class FaceRecognitionService:
             logger.debug(f"extract_features 异常耗时 {time.time() - t0:.3f}s")
             return []
     
+    def face_tensor_to_image(self, face):
+        """
+        将 MTCNN 输出的对齐人脸 tensor 还原为图片（用于保存注册对齐图）
+        
+        参数:
+            face: torch.Tensor (3, 160, 160)，已做 (x - 127.5) / 128 标准化
+            
+        返回:
+            PIL Image，RGB，160x160
+        """
+        arr = face.detach().cpu().permute(1, 2, 0).numpy() * 128.0 + 127.5
+        arr = np.clip(np.round(arr), 0, 255).astype(np.uint8)
+        return Image.fromarray(arr)
+
+    def image_to_face_tensor(self, image):
+        """
+        将对齐人脸图转换为模型输入 tensor（face_tensor_to_image 的逆过程）
+        
+        参数:
+            image: PIL Image，对齐后的人脸图
+            
+        返回:
+            torch.Tensor (3, 160, 160)
+        """
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        size = self.mtcnn.image_size
+        if image.size != (size, size):
+            image = image.resize((size, size), Image.BILINEAR)
+        arr = np.asarray(image, dtype=np.float32)
+        tensor = torch.from_numpy(arr).permute(2, 0, 1)
+        return (tensor - 127.5) / 128.0
+
+    def extract_features_from_crops(self, crops):
+        """
+        直接从已对齐的人脸图提取特征（跳过 MTCNN 检测，用于重新生成特征）
+        
+        参数:
+            crops: PIL Image 列表，每张为对齐后的人脸图
+            
+        返回:
+            features: 特征向量列表
+        """
+        if not crops:
+            return []
+        faces = torch.stack([self.image_to_face_tensor(c) for c in crops])
+        return self.extract_features(faces)
+
     def detect_and_extract(self, image):
         """
         检测人脸并提取特征
@@ -163,6 +221,109 @@ class FaceRecognitionService:
         
         return features, boxes
     
+    def align_faces(self, image, boxes):
+        """
+        按给定的人脸框做对齐裁剪（复用已有的检测结果，不再运行检测网络）
+        
+        返回:
+            torch.Tensor (N, 3, 160, 160)
+        """
+        return self.mtcnn.extract(image, np.asarray(boxes, dtype=np.float32), None)
+
+    def extract_features_for_boxes(self, image, boxes):
+        """
+        只对给定的人脸框做对齐裁剪并提取特征
+        
+        参数:
+            image: PIL Image，RGB
+            boxes: (N, 4) 人脸位置框
+            
+        返回:
+            features: 特征向量列表，与 boxes 一一对应
+        """
+        if boxes is None or len(boxes) == 0:
+            return []
+        return self.extract_features(self.align_faces(image, boxes))
+
+    def detect_with_landmarks(self, image):
+        """
+        检测人脸，返回位置框、置信度和五点关键点（均为 numpy 数组，未检测到人脸时为 None）
+        """
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        boxes, probs, landmarks = self.mtcnn.detect(image, landmarks=True)
+        return boxes, probs, landmarks
+
+    def detect_and_extract_quality(self, image, profile_name: str, profile=None):
+        """
+        检测人脸 -> 质量过滤 -> 只对通过的人脸提取特征
+        
+        参数:
+            image: PIL Image，RGB
+            profile_name: 质量配置名称（enroll / verify / recognize / burst / live / identify / off）
+            profile: 可选的 QualityProfile，覆盖按名称取得的配置
+            
+        返回:
+            features: 通过质量检查的人脸特征列表
+            boxes: 与 features 对应的人脸位置框
+            rejected: 被过滤的人脸及原因
+        """
+        t0 = time.time()
+        boxes, probs, landmarks = self.detect_with_landmarks(image)
+        if boxes is None:
+            logger.warning("未在图片中检测到人脸")
+            return [], [], []
+        keep, rejected = filter_faces(image, boxes, probs, landmarks, profile_name, profile)
+        features = self.extract_features_for_boxes(image, boxes[keep]) if keep else []
+        logger.info(f"检测到 {len(boxes)} 个人脸，质量过滤 {len(rejected)} 个，耗时 {time.time() - t0:.3f}s")
+        return features, boxes[keep], rejected
+
+    def detect_and_extract_largest(self, image, profile_name: str = "off", profile=None):
+        """
+        只取面积最大的一张人脸并提取特征（用于 1:1 验证，比多人识别少做裁剪和批量前向）
+        
+        参数:
+            image: PIL Image 对象或 numpy array
+            profile_name: 质量配置名称
+            
+        返回:
+            feature: 特征向量 (512,)，未检测到人脸或未通过质量检查时为 None
+            box: 人脸位置框 [x1,y1,x2,y2]
+            rejected: 未通过质量检查时为拒绝信息，否则为 None
+        """
+        t0 = time.time()
+        try:
+            if isinstance(image, np.ndarray):
+                image = Image.fromarray(image)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            
+            boxes, probs, landmarks = self.detect_with_landmarks(image)
+            if boxes is None:
+                logger.warning("未在图片中检测到人脸")
+                return None, None, None
+            
+            areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+            i = int(np.argmax(areas))
+            keep, rejected = filter_faces(
+                image, boxes[i:i + 1], probs[i:i + 1], landmarks[i:i + 1] if landmarks is not None else None,
+                profile_name, profile
+            )
+            if not keep:
+                return None, boxes[i], rejected[0]
+            # 复用检测结果，只对选中的人脸做对齐裁剪，避免再次运行检测网络
+            features = self.extract_features_for_boxes(image, boxes[i:i + 1])
+            if not features:
+                return None, None, None
+            
+            logger.info(f"检测到 {len(boxes)} 个人脸，取最大人脸，耗时 {time.time() - t0:.3f}s")
+            return features[0], boxes[i], None
+        except Exception as e:
+            logger.error(f"最大人脸提取失败: {e}", exc_info=True)
+            return None, None, None
+
     def compare_features(self, faces1, faces2, threshold=0.8):
         """
         比对两组人脸特征向量（使用第一个人脸）
@@ -190,17 +351,24 @@ class FaceRecognitionService:
             face1 = faces1[0]
             face2 = faces2[0]
             
-            # 提取特征（添加 batch 维度）
+            # 两张人脸拼成一个 batch，一次前向提取特征
             with torch.no_grad():
-                img1_tensor = self.resnet(face1.unsqueeze(0))
-                img2_tensor = self.resnet(face2.unsqueeze(0))
+                embeddings = self.resnet(torch.stack([face1, face2]))
             
             # 转换为 numpy
-            x1 = img1_tensor.detach().cpu().numpy()
-            x2 = img2_tensor.detach().cpu().numpy()
+            embeddings = embeddings.detach().cpu().numpy()
+            x1 = embeddings[0:1]
+            x2 = embeddings[1:2]
             
-            # 计算欧氏距离
-            distance = float(np.linalg.norm(x1 - x2, axis=1)[0])
+            if self.normalize:
+                # 归一化向量: 距离由点积得到 |a - b| = sqrt(2 - 2 a.b)
+                x1 = x1 / np.linalg.norm(x1, axis=1, keepdims=True)
+                x2 = x2 / np.linalg.norm(x2, axis=1, keepdims=True)
+                cos = float(np.sum(x1 * x2, axis=1)[0])
+                distance = float(np.sqrt(max(2.0 - 2.0 * cos, 0.0)))
+            else:
+                # 计算欧氏距离
+                distance = float(np.linalg.norm(x1 - x2, axis=1)[0])
             
             is_match = distance <= threshold
             
@@ -210,4 +378,4 @@ class FaceRecognitionService:
             
         except Exception as e:
             logger.error(f"特征比对失败: {e}")
-            return False, 0.0
\ No newline at end of file
+            return False, 0.0
@@ -0,0 +1,228 @@
+import logging
+
+import numpy as np
+
+from app.db.id_generator import new_id
+from app.services.FaceMatcher import Gallery, l2_normalize
+from app.utils.FeatureBinaryConver import feature_to_bytes, parse_header
+
+logger = logging.getLogger()
+
+
+# -----------------------------
+# 多模板注册
+# -----------------------------
+# face_template 表保存每个用户的多张注册特征；user_info.face_feature 保存这些模板的
+# 归一化均值（质心），face_spread 为模板到质心的平均余弦距离。
+# 所有底库（快照 / ANN / 分片）仍只使用质心，匹配开销与模板数量无关；
+# 只有质心相似度落在阈值附近的“模糊”人脸才取候选学生的模板逐一比对。
+
+# 每个用户最多保留的模板数，超出时删除与其余模板最不一致的一个
+MAX_TEMPLATES = 5
+# 质心相似度在 [阈值 - margin, 阈值 + margin) 内视为模糊
+AMBIGUOUS_MARGIN = 0.12
+# 每张模糊人脸最多比对的候选学生数
+TEMPLATE_CANDIDATES = 3
+
+
+def summarize(matrix: np.ndarray):
+    """
+    计算模板质心与离散度
+
+    返回:
+        centroid: 归一化均值向量
+        spread: 模板与质心的平均余弦距离（1 - cos），越大说明注册照差异越大
+    """
+    matrix = l2_normalize(matrix)
+    centroid = l2_normalize(matrix.mean(axis=0))
+    spread = float(np.mean(1.0 - matrix @ centroid))
+    return centroid, spread
+
+
+def _outlier(matrix: np.ndarray) -> int:
+    """与其余模板平均相似度最低的模板下标"""
+    sims = matrix @ matrix.T
+    np.fill_diagonal(sims, 0.0)
+    return int(np.argmin(sims.sum(axis=1)))
+
+
+def _seed_legacy_template(cursor, user_id: str, projection=None):
+    """
+    旧数据只有 user_info.face_feature，将其转换到当前投影空间后作为第一个模板
+
+    原始特征按当前投影变换后写入；属于其他投影版本（无法还原）或无法解析的特征不作为模板，记录日志
+    """
+    cursor.execute("SELECT face_feature FROM user_info WHERE id = %s AND face_feature IS NOT NULL", (user_id,))
+    row = cursor.fetchone()
+    if not row:
+        return
+    gallery = Gallery.from_rows([(user_id, row[0])], projection=projection)
+    if len(gallery) == 0:
+        header = parse_header(row[0])
+        logger.warning(
+            f"旧人脸特征无法转换到当前投影空间，未作为模板: user_id={user_id}, "
+            f"特征 proj_id={header.proj_id if header is not None else 0}, "
+            f"当前 proj_id={projection.version if projection is not None else 0}"
+        )
+        return
+    proj_id = projection.version if projection is not None else 0
+    cursor.execute(
+        "INSERT INTO face_template (id, user_id, feature, crop_id) VALUES (%s, %s, %s, NULL)",
+        (new_id(), user_id, feature_to_bytes(gallery.matrix[0], normalize=True, proj_id=proj_id))
+    )
+
+
+def add_template(cursor, user_id: str, vec: np.ndarray, projection=None, crop_id: str = None, replace: bool = False):
+    """
+    为用户新增一个模板并重新计算质心（事务由调用方提交）
+
+    参数:
+        vec: 已位于当前投影空间的特征
+        replace: 为 True 时先删除该用户已有的全部模板（重新注册）
+
+    返回:
+        (centroid, spread, 模板数量)
+    """
+    proj_id = projection.version if projection is not None else 0
+    if replace:
+        cursor.execute("DELETE FROM face_template WHERE user_id = %s", (user_id,))
+    else:
+        cursor.execute("SELECT COUNT(*) FROM face_template WHERE user_id = %s", (user_id,))
+        if cursor.fetchone()[0] == 0:
+            _seed_legacy_template(cursor, user_id, projection)
+
+    cursor.execute(
+        "INSERT INTO face_template (id, user_id, feature, crop_id) VALUES (%s, %s, %s, %s)",
+        (new_id(), user_id, feature_to_bytes(vec, normalize=True, proj_id=proj_id), crop_id)
+    )
+    return refresh_summary(cursor, user_id, projection)
+
+
+def refresh_summary(cursor, user_id: str, projection=None):
+    """
+    读取用户全部模板，超出 MAX_TEMPLATES 时删除离群模板，并把质心、离散度写回 user_info
+
+    返回:
+        (centroid, spread, 模板数量)，用户没有可用模板时返回 (None, 0.0, 0)
+    """
+    cursor.execute("SELECT id, feature FROM face_template WHERE user_id = %s ORDER BY created_at, id", (user_id,))
+    rows = cursor.fetchall()
+    gallery = Gallery.from_rows(rows, projection=projection)
+    if len(gallery) < len(rows):
+        usable = set(gallery.ids)
+        skipped = [r[0] for r in rows if r[0] not in usable]
+        logger.warning(f"模板与当前投影版本不一致或无法解析，不计入质心: user_id={user_id}, template_ids={skipped}")
+    template_ids = list(gallery.ids)
+    matrix = gallery.matrix
+    while len(template_ids) > MAX_TEMPLATES:
+        i = _outlier(matrix)
+        cursor.execute("DELETE FROM face_template WHERE id = %s", (template_ids[i],))
+        logger.info(f"模板数超过 {MAX_TEMPLATES}，删除离群模板: user_id={user_id}, template_id={template_ids[i]}")
+        del template_ids[i]
+        matrix = np.delete(matrix, i, axis=0)
+
+    if not template_ids:
+        return None, 0.0, 0
+
+    centroid, spread = summarize(matrix)
+    proj_id = projection.version if projection is not None else 0
+    cursor.execute(
+        "UPDATE user_info SET face_feature = %s, face_spread = %s, face_template_count = %s WHERE id = %s",
+        (feature_to_bytes(centroid, normalize=True, proj_id=proj_id), spread, len(template_ids), user_id)
+    )
+    return centroid, spread, len(template_ids)
+
+
+class TemplateCache:
+    """
+    请求内的模板缓存: 按需批量读取候选学生的模板（只读取多于一个模板的学生）
+
+    同一请求中多帧 / 多张人脸命中同一学生时不重复查询
+    """
+
+    def __init__(self, cursor, projection=None):
+        self.cursor = cursor
+        self.projection = projection
+        self._templates = {}  # user_id -> (K, D) 矩阵
+
+    def load(self, user_ids):
+        missing = [uid for uid in user_ids if uid not in self._templates]
+        if missing:
+            self.cursor.execute(
+                "SELECT t.user_id, t.feature FROM face_template t JOIN user_info u ON u.id = t.user_id "
+                "WHERE t.user_id IN ({}) AND u.face_template_count > 1".format(",".join(["%s"] * len(missing))),
+                tuple(missing)
+            )
+            gallery = Gallery.from_rows(self.cursor.fetchall(), projection=self.projection)
+            grouped = {}
+            for i, uid in enumerate(gallery.ids):
+                grouped.setdefault(uid, []).append(i)
+            for uid in missing:
+                rows = grouped.get(uid)
+                self._templates[uid] = gallery.matrix[rows] if rows else None
+
+    def stacked(self, user_ids):
+        """
+        返回:
+            matrix: 所有候选学生模板堆叠成的 (K, D) 矩阵
+            owner: 长度 K，每行模板属于 user_ids 中的哪个下标
+        """
+        self.load(user_ids)
+        parts, owner = [], []
+        for j, uid in enumerate(user_ids):
+            mat = self._templates.get(uid)
+            if mat is not None:
+                parts.append(mat)
+                owner.extend([j] * len(mat))
+        if not parts:
+            return None, np.empty(0, dtype=np.int64)
+        return np.concatenate(parts), np.asarray(owner, dtype=np.int64)
+
+
+def refine_with_templates(sims: np.ndarray, queries: np.ndarray, gallery, templates: TemplateCache,
+                          cos_threshold: float, margin: float = AMBIGUOUS_MARGIN, top: int = TEMPLATE_CANDIDATES) -> int:
+    """
+    对质心相似度模糊的人脸，用候选学生的模板做二次比对，原地更新相似度矩阵
+
+    融合分数 = max(质心相似度, 该学生所有模板中的最高相似度)；
+    只更新每张模糊人脸的 top 个候选，其余人脸与学生保持质心相似度不变。
+
+    参数:
+        sims: (M, N) 质心相似度，会被原地修改
+        queries: (M, D) 已变换到底库空间的查询特征
+        gallery: 质心底库（提供学生 id）
+        templates: TemplateCache
+
+    返回:
+        做了模板比对的人脸数
+    """
+    m, n = sims.shape
+    if m == 0 or n == 0:
+        return 0
+    best = np.max(np.where(np.isfinite(sims), sims, -np.inf), axis=1)
+    ambiguous = np.nonzero((best >= cos_threshold - margin) & (best < cos_threshold + margin))[0]
+    if len(ambiguous) == 0:
+        return 0
+
+    k = min(top, n)
+    sub = sims[ambiguous]
+    cand = np.argpartition(-sub, k - 1, axis=1)[:, :k]  # (A, k) 候选列
+    cols = np.unique(cand)
+    matrix, owner = templates.stacked([gallery.ids[c] for c in cols])
+    if matrix is None:
+        return 0
+
+    # 每张模糊人脸与每个候选学生的最佳模板相似度
+    tsims = queries[ambiguous] @ matrix.T  # (A, K)
+    best_t = np.full((len(cols), len(ambiguous)), -np.inf, dtype=np.float32)
+    np.maximum.at(best_t, owner, tsims.T)
+    best_t = best_t.T  # (A, C)
+
+    # 只融合每张人脸自己的候选，且不改变已被屏蔽（-inf）的列
+    pos = np.searchsorted(cols, cand)
+    mask = np.zeros_like(best_t, dtype=bool)
+    mask[np.arange(len(ambiguous))[:, None], pos] = True
+    current = sub[:, cols]
+    fused = np.where(mask & np.isfinite(current), np.maximum(current, best_t), current)
+    sims[np.ix_(ambiguous, cols)] = fused
+    return len(ambiguous)
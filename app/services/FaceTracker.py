@@ -0,0 +1,163 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger()
+
+# 检测框与预测框 IoU 低于该值不关联
+IOU_THRESHOLD = 0.3
+# 连续多少帧未关联到检测框后删除轨迹
+MAX_AGE = 10
+# 未匹配轨迹两次提取特征之间至少间隔的帧数
+RETRY_INTERVAL = 5
+# 未匹配轨迹最多提取特征的次数，超过后不再尝试
+MAX_ATTEMPTS = 5
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """两组 [x1,y1,x2,y2] 框的 IoU 矩阵 (len(a), len(b))"""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    a = a[:, None, :]
+    b = b[None, :, :]
+    iw = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    ih = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = iw * ih
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+
+class BoxKalman:
+    """
+    匀速模型的卡尔曼滤波，状态为 [cx, cy, w, h, vx, vy, vw, vh]
+
+    每帧先 predict 得到框的预测位置用于关联，关联成功后用检测框 update
+    """
+
+    def __init__(self, box):
+        self.x = np.zeros(8, dtype=np.float64)
+        self.x[:4] = self._to_state(box)
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 100.0, 100.0, 100.0, 100.0])
+        self.F = np.eye(8)
+        self.F[:4, 4:] = np.eye(4)
+        self.H = np.eye(4, 8)
+        self.Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.5, 0.5, 0.5, 0.5])
+        self.R = np.diag([4.0, 4.0, 8.0, 8.0])
+
+    @staticmethod
+    def _to_state(box):
+        x1, y1, x2, y2 = [float(v) for v in box]
+        return np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+
+    def box(self) -> np.ndarray:
+        cx, cy, w, h = self.x[:4]
+        w, h = max(w, 1.0), max(h, 1.0)
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+    def predict(self) -> np.ndarray:
+        self.x = self.F @ self.x
+        self.P = self.F @ self.P @ self.F.T + self.Q
+        return self.box()
+
+    def update(self, box):
+        z = self._to_state(box)
+        y = z - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(8) - K @ self.H) @ self.P
+
+
+class Track:
+    def __init__(self, track_id: int, box, frame_no: int):
+        self.track_id = track_id
+        self.kalman = BoxKalman(box)
+        self.box = np.asarray(box, dtype=np.float64)
+        self.age = 0  # 连续未关联的帧数
+        self.hits = 1
+        self.student_id = None
+        self.attempts = 0
+        self.last_embedded = None
+        self.embedding_sum = None  # 历次特征之和（已归一化），用于多次尝试的平均
+        self.first_frame = frame_no
+
+    @property
+    def matched(self) -> bool:
+        return self.student_id is not None
+
+    def needs_embedding(self, frame_no: int) -> bool:
+        """新轨迹立即提取；未匹配的轨迹按间隔重试，已匹配的轨迹不再提取"""
+        if self.matched or self.age > 0:
+            return False
+        if self.last_embedded is None:
+            return True
+        return self.attempts < MAX_ATTEMPTS and frame_no - self.last_embedded >= RETRY_INTERVAL
+
+    def add_embedding(self, vec: np.ndarray, frame_no: int) -> np.ndarray:
+        """记录一次特征，返回当前所有特征的平均方向"""
+        self.attempts += 1
+        self.last_embedded = frame_no
+        self.embedding_sum = vec.copy() if self.embedding_sum is None else self.embedding_sum + vec
+        norm = float(np.linalg.norm(self.embedding_sum))
+        return self.embedding_sum / norm if norm > 0 else self.embedding_sum
+
+
+class FaceTracker:
+    """
+    基于 IoU 的多目标人脸跟踪（SORT 风格）：卡尔曼预测 + 贪心 IoU 关联
+
+    调用方每帧传入检测框，得到每个检测框对应的轨迹；
+    只有 needs_embedding() 为真的轨迹需要提取特征。
+    """
+
+    def __init__(self):
+        self.tracks = []
+        self._next_id = 1
+
+    def update(self, boxes, frame_no: int):
+        """
+        参数:
+            boxes: (N, 4) 本帧检测框
+            frame_no: 帧序号
+
+        返回:
+            长度为 N 的 Track 列表，与 boxes 一一对应
+        """
+        boxes = np.zeros((0, 4)) if boxes is None else np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        predicted = np.array([t.kalman.predict() for t in self.tracks]).reshape(-1, 4)
+        ious = iou_matrix(predicted, boxes)
+
+        assigned = [None] * len(boxes)
+        used_tracks = set()
+        # 按 IoU 从大到小贪心关联
+        for flat in np.argsort(-ious, axis=None):
+            ti, di = np.unravel_index(flat, ious.shape)
+            if ious[ti, di] < IOU_THRESHOLD:
+                break
+            if ti in used_tracks or assigned[di] is not None:
+                continue
+            track = self.tracks[ti]
+            track.kalman.update(boxes[di])
+            track.box = boxes[di]
+            track.age = 0
+            track.hits += 1
+            assigned[di] = track
+            used_tracks.add(ti)
+
+        for ti, track in enumerate(self.tracks):
+            if ti not in used_tracks:
+                track.age += 1
+
+        for di in range(len(boxes)):
+            if assigned[di] is None:
+                track = Track(self._next_id, boxes[di], frame_no)
+                self._next_id += 1
+                self.tracks.append(track)
+                assigned[di] = track
+
+        self.tracks = [t for t in self.tracks if t.age <= MAX_AGE]
+        return assigned
+
+    def matched_students(self):
+        return {t.student_id for t in self.tracks if t.matched}
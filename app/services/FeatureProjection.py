@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger()
+
+# 投影文件目录: pca_v<版本>.npz，current 文件记录当前启用的版本号
+PROJECTION_DIR = Path("app/models/projection")
+
+# 启用的投影: 空/off 不启用，current 使用 current 文件指向的版本，数字表示指定版本
+FEATURE_PROJECTION = os.environ.get("FEATURE_PROJECTION", "off").strip().lower()
+
+
+class FeatureProjection:
+    """
+    离线拟合的 PCA（可选白化）线性投影，把 512 维人脸特征降到低维
+
+    project(x) = normalize((x - mean) @ components.T * scale)
+    其中 components 为 (out_dim, in_dim) 主成分，白化时 scale = 1 / sqrt(特征值)
+    """
+
+    def __init__(self, version: int, mean: np.ndarray, components: np.ndarray,
+                 scale: np.ndarray = None, explained: float = None):
+        self.version = int(version)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float32)
+        self.explained = explained
+        # 把白化系数合并进投影矩阵，投影时只需一次矩阵乘法
+        proj = self.components if self.scale is None else self.components * self.scale[:, None]
+        self._matrix = np.ascontiguousarray(proj.T)
+        self._offset = self.mean @ self._matrix
+
+    @property
+    def in_dim(self) -> int:
+        return self.components.shape[1]
+
+    @property
+    def out_dim(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def whiten(self) -> bool:
+        return self.scale is not None
+
+    def project(self, x: np.ndarray) -> np.ndarray:
+        """
+        投影并 L2 归一化
+
+        参数:
+            x: (N, in_dim) 或 (in_dim,)
+
+        返回:
+            (N, out_dim) 或 (out_dim,) float32
+        """
+        x = np.asarray(x, dtype=np.float32)
+        y = x @ self._matrix - self._offset
+        norm = np.linalg.norm(y, axis=-1, keepdims=True)
+        norm[norm == 0] = 1.0
+        return (y / norm).astype(np.float32)
+
+    @classmethod
+    def fit(cls, data: np.ndarray, out_dim: int, version: int, whiten: bool = False, eps: float = 1e-6):
+        """
+        用已注册的人脸特征拟合 PCA
+
+        参数:
+            data: (N, in_dim) 原始特征（建议已 L2 归一化）
+            out_dim: 目标维度
+            version: 投影版本号
+            whiten: 是否白化
+        """
+        data = np.asarray(data, dtype=np.float64)
+        n, in_dim = data.shape
+        if out_dim > min(n, in_dim):
+            raise ValueError(f"样本数或维度不足: N={n}, in_dim={in_dim}, out_dim={out_dim}")
+        mean = data.mean(axis=0)
+        _, sv, vt = np.linalg.svd(data - mean, full_matrices=False)
+        eigvals = (sv ** 2) / max(n - 1, 1)
+        explained = float(eigvals[:out_dim].sum() / eigvals.sum()) if eigvals.sum() > 0 else 0.0
+        scale = 1.0 / np.sqrt(eigvals[:out_dim] + eps) if whiten else None
+        return cls(version, mean, vt[:out_dim], scale, explained)
+
+    def save(self, path=None) -> Path:
+        path = Path(path) if path else projection_path(self.version)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                version=np.int64(self.version),
+                mean=self.mean,
+                components=self.components,
+                scale=self.scale if self.scale is not None else np.empty(0, dtype=np.float32),
+                explained=np.float64(self.explained if self.explained is not None else -1.0),
+            )
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            scale = data["scale"]
+            explained = float(data["explained"])
+            return cls(
+                int(data["version"]),
+                data["mean"],
+                data["components"],
+                scale if scale.size else None,
+                explained if explained >= 0 else None,
+            )
+
+
+def projection_path(version: int) -> Path:
+    return PROJECTION_DIR / f"pca_v{int(version)}.npz"
+
+
+def list_versions():
+    if not PROJECTION_DIR.exists():
+        return []
+    versions = []
+    for p in PROJECTION_DIR.glob("pca_v*.npz"):
+        try:
+            versions.append(int(p.stem[len("pca_v"):]))
+        except ValueError:
+            continue
+    return sorted(versions)
+
+
+def next_version() -> int:
+    versions = list_versions()
+    # 版本号写入特征头部的 proj_id（uint16），0 保留给原始特征空间
+    return (versions[-1] + 1) if versions else 1
+
+
+def current_version():
+    pointer = PROJECTION_DIR / "current"
+    if not pointer.exists():
+        return None
+    try:
+        return int(pointer.read_text().strip())
+    except ValueError:
+        return None
+
+
+def set_current_version(version: int):
+    PROJECTION_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = PROJECTION_DIR / "current.tmp"
+    tmp.write_text(str(int(version)))
+    os.replace(tmp, PROJECTION_DIR / "current")
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_projection(version: int):
+    """按版本加载投影（进程内缓存）"""
+    with _cache_lock:
+        proj = _cache.get(version)
+        if proj is None:
+            proj = FeatureProjection.load(projection_path(version))
+            _cache[version] = proj
+        return proj
+
+
+def get_active_projection():
+    """
+    返回 FEATURE_PROJECTION 指定的投影，未启用或文件不存在时返回 None
+    """
+    if FEATURE_PROJECTION in ("", "off", "none", "0"):
+        return None
+    version = current_version() if FEATURE_PROJECTION == "current" else int(FEATURE_PROJECTION)
+    if version is None:
+        logger.warning("FEATURE_PROJECTION=current 但没有 current 投影版本，按原始特征处理")
+        return None
+    try:
+        return load_projection(version)
+    except FileNotFoundError:
+        logger.error(f"投影文件不存在: {projection_path(version)}，按原始特征处理")
+        return None
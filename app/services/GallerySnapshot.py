@@ -0,0 +1,443 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from app.services.FaceMatcher import Gallery, l2_normalize
+from app.utils.FeatureBinaryConver import LEGACY_SHAPE
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，仅依赖进程内锁
+    fcntl = None
+
+logger = logging.getLogger()
+
+# 快照目录: gallery-<gen>.npy 特征矩阵 + gallery-<gen>.ids 行号日志 + gallery.json 元数据
+GALLERY_DIR = Path("app/data/gallery")
+
+# 两次增量同步之间的最小间隔（秒），避免每个请求都查询数据库
+SYNC_INTERVAL = float(os.environ.get("GALLERY_SYNC_INTERVAL", "5"))
+
+# 每批增量同步读取的行数
+SYNC_BATCH = 5000
+
+# 全量重建 / 压缩时的最小容量（行）
+MIN_CAPACITY = 1024
+
+
+@contextmanager
+def _file_lock(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _feature_digest(blob):
+    """face_feature 的摘要，用于识别水位线上已同步过的行"""
+    if blob is None:
+        return None
+    return hashlib.blake2b(bytes(blob), digest_size=8).hexdigest()
+
+
+class GallerySnapshot:
+    """
+    内存映射的全量人脸特征快照
+
+    文件布局（每一代一组，代数变化时整体替换）:
+        gallery-<gen>.npy  (capacity, dim) float32 矩阵
+        gallery-<gen>.ids  只追加的行号日志，每行 "行号\\tuser_id"（该用户的特征位于该行）
+                           或 "-1\\tuser_id"（该用户已移除）
+        gallery.json       元数据: gen / dim / proj_id / rows（已使用行数）/ log_bytes（日志已提交长度）
+                           / watermark + boundary（增量同步位置）
+
+    读取: 各 worker 以只读方式 mmap 矩阵，不复制数据，多个进程共享同一份物理页；
+          元数据变化时只读取日志中新增的部分，代价为 O(变化数)。
+    写入: 持有文件锁。新增和更新的特征一律写入末尾未使用的行，再追加日志、替换元数据，
+          同一代内不复用任何行，持有旧元数据的读者看到的行内容不会变化；
+          末尾没有空行时把存活的行压缩写入新一代文件。
+    """
+
+    def __init__(self, base_dir=GALLERY_DIR):
+        self.base_dir = Path(base_dir)
+        self.meta_path = self.base_dir / "gallery.json"
+        self.lock_path = self.base_dir / "gallery.lock"
+        self._lock = threading.RLock()
+        self._stamp = None
+        self._log_offset = 0
+        self.meta = None
+        self.matrix = None
+        self.pos = {}
+        self._last_sync = 0.0
+
+    def _matrix_path(self, gen: int) -> Path:
+        return self.base_dir / f"gallery-{gen}.npy"
+
+    def _log_path(self, gen: int) -> Path:
+        return self.base_dir / f"gallery-{gen}.ids"
+
+    def exists(self) -> bool:
+        return self.meta_path.exists()
+
+    def __len__(self):
+        return len(self.pos)
+
+    # -----------------------------
+    # 读取
+    # -----------------------------
+    def refresh(self):
+        """元数据变化时读取日志新增部分，代数变化时重新 mmap 并完整读取日志"""
+        with self._lock:
+            for attempt in range(3):
+                try:
+                    st = os.stat(self.meta_path)
+                except FileNotFoundError:
+                    return
+                stamp = (st.st_mtime_ns, st.st_ino, st.st_size)
+                if stamp == self._stamp:
+                    return
+                with open(self.meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                try:
+                    self._load(meta)
+                except FileNotFoundError:
+                    # 读取元数据后其他进程又切换了一代并删除了旧文件，重新读取元数据
+                    if attempt == 2:
+                        raise
+                    continue
+                self._stamp = stamp
+                return
+
+    def _load(self, meta: dict):
+        if self.meta is None or meta["gen"] != self.meta["gen"] or self.matrix is None:
+            matrix = np.load(self._matrix_path(meta["gen"]), mmap_mode="r")
+            pos, offset = self._read_log(meta["gen"], {}, 0, meta["log_bytes"])
+            self.matrix = matrix
+        else:
+            pos, offset = self._read_log(meta["gen"], self.pos, self._log_offset, meta["log_bytes"])
+        self.pos = pos
+        self._log_offset = offset
+        self.meta = meta
+
+    def _read_log(self, gen: int, pos: dict, offset: int, end: int):
+        """读取日志 [offset, end) 区间并应用到 pos 的副本（已有的 pos 可能正被 lookup 使用）"""
+        if end <= offset:
+            return pos, offset
+        with open(self._log_path(gen), "rb") as f:
+            f.seek(offset)
+            data = f.read(end - offset)
+        pos = dict(pos)
+        for line in data.decode("utf-8").splitlines():
+            row, uid = line.split("\t", 1)
+            row = int(row)
+            if row < 0:
+                pos.pop(uid, None)
+            else:
+                pos[uid] = row
+        return pos, end
+
+    def lookup(self, ids):
+        """
+        按 user_id 取特征
+
+        返回:
+            found_ids: 快照中存在的 id 列表
+            matrix: (len(found_ids), dim) 特征（只复制被选中的行）
+        """
+        self.refresh()
+        with self._lock:
+            if self.matrix is None:
+                return [], np.empty((0, LEGACY_SHAPE[0]), dtype=np.float32)
+            found = [uid for uid in ids if uid in self.pos]
+            rows = [self.pos[uid] for uid in found]
+            return found, np.array(self.matrix[rows], dtype=np.float32)
+
+    def changes_since(self, gen, offset: int):
+        """
+        供其他索引（分片底库）跟随快照: 返回日志 offset 之后变化的用户
+
+        返回:
+            (gen, 新 offset, full, ids, matrix, removed)；
+            gen 与当前代不同（全量重建、压缩或投影变化）时 full 为 True，ids / matrix 为全部存活用户，
+            调用方应清空后重新加载；否则 ids / matrix 为特征变化的用户，removed 为已移除的用户。
+            快照不存在时返回 None
+        """
+        self.refresh()
+        with self._lock:
+            if self.meta is None:
+                return None
+            cur_gen, end = self.meta["gen"], self._log_offset
+            if gen != cur_gen:
+                ids, matrix = self.lookup(list(self.pos))
+                return cur_gen, end, True, ids, matrix, []
+            if end <= offset:
+                return cur_gen, offset, False, [], np.empty((0, self.meta["dim"]), dtype=np.float32), []
+            with open(self._log_path(cur_gen), "rb") as f:
+                f.seek(offset)
+                data = f.read(end - offset)
+            touched = dict.fromkeys(line.split("\t", 1)[1] for line in data.decode("utf-8").splitlines())
+            removed = [uid for uid in touched if uid not in self.pos]
+            ids, matrix = self.lookup([uid for uid in touched if uid in self.pos])
+            return cur_gen, end, False, ids, matrix, removed
+
+    # -----------------------------
+    # 写入（调用方需持有文件锁）
+    # -----------------------------
+    def _write_meta(self, meta: dict):
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.meta_path.with_name(self.meta_path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.meta_path)
+
+    def _write_generation(self, gen: int, ids, matrix: np.ndarray, meta: dict):
+        """写入一整代文件（全量重建或压缩），元数据替换后删除旧一代"""
+        n, dim = matrix.shape
+        capacity = max(MIN_CAPACITY, n * 2)
+        path = self._matrix_path(gen)
+        tmp = path.with_name(path.name + ".tmp")
+        mm = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(capacity, dim))
+        mm[:n] = matrix
+        mm.flush()
+        del mm
+        os.replace(tmp, path)
+
+        log = "".join(f"{row}\t{uid}\n" for row, uid in enumerate(ids)).encode("utf-8")
+        log_path = self._log_path(gen)
+        with open(log_path, "wb") as f:
+            f.write(log)
+            f.flush()
+            os.fsync(f.fileno())
+
+        old_gen = self.meta["gen"] if self.meta else None
+        self._write_meta(dict(meta, gen=gen, dim=dim, rows=n, log_bytes=len(log)))
+        self.refresh()
+        if old_gen is not None and old_gen != gen:
+            for old in (self._matrix_path(old_gen), self._log_path(old_gen)):
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def rebuild(self, projection=None):
+        """从数据库全量重建快照（首次启动或投影版本变化时）"""
+        from app.db.connection import get_connection
+
+        conn = get_connection()
+        if not conn:
+            raise RuntimeError("数据库连接失败")
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id, face_feature, updated_at FROM user_info WHERE face_feature IS NOT NULL")
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+
+        gallery = Gallery.from_rows([(r[0], r[1]) for r in rows], projection=projection)
+        watermark = max((r[2] for r in rows if r[2] is not None), default=None)
+        boundary = {r[0]: _feature_digest(r[1]) for r in rows if watermark is not None and r[2] == watermark}
+        gen = (self.meta["gen"] + 1) if self.meta else 1
+        self._write_generation(gen, list(gallery.ids), gallery.matrix, {
+            "proj_id": projection.version if projection is not None else 0,
+            "watermark": watermark.isoformat() if watermark else None,
+            "boundary": boundary,
+        })
+        logger.info(f"底库快照全量重建完成: {len(gallery)} 人, dim={gallery.matrix.shape[1]}, gen={gen}")
+
+    def _apply(self, upserts: dict, removals: set, **meta_updates):
+        """
+        把变化写入快照: upserts 为 {user_id: 向量}，removals 为待删除 id；
+        meta_updates 与本次变化一起写入元数据（增量同步位置）
+        """
+        meta = self.meta
+        removals = {uid for uid in removals if uid in self.pos and uid not in upserts}
+        start = meta["rows"]
+        capacity = len(self.matrix)
+        if start + len(upserts) > capacity:
+            # 末尾空行不足: 存活的行与本次变化一起压缩写入新一代
+            live = [uid for uid in self.pos if uid not in removals and uid not in upserts]
+            _, kept = self.lookup(live)
+            ids = live + list(upserts)
+            matrix = np.concatenate([kept, np.stack(list(upserts.values()))]) if upserts else kept
+            self._write_generation(meta["gen"] + 1, ids, matrix, dict(meta, **meta_updates))
+            return
+
+        lines = [f"-1\t{uid}\n" for uid in removals]
+        if upserts:
+            writer = np.load(self._matrix_path(meta["gen"]), mmap_mode="r+")
+            for row, (uid, vec) in enumerate(upserts.items(), start):
+                writer[row] = vec
+                lines.append(f"{row}\t{uid}\n")
+            writer.flush()
+            del writer
+
+        with open(self._log_path(meta["gen"]), "r+b") as f:
+            # 丢弃上次写入中途失败遗留的未提交日志
+            f.truncate(meta["log_bytes"])
+            f.seek(meta["log_bytes"])
+            f.write("".join(lines).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            log_bytes = f.tell()
+
+        self._write_meta(dict(meta, rows=start + len(upserts), log_bytes=log_bytes, **meta_updates))
+        self.refresh()
+
+    def upsert(self, user_id: str, vec: np.ndarray):
+        """单个用户特征变化（上传人脸后调用，向量需已位于快照空间）"""
+        with _file_lock(self.lock_path):
+            self.refresh()
+            if self.meta is None:
+                return
+            vec = l2_normalize(np.asarray(vec, dtype=np.float32).reshape(-1))
+            if vec.size != self.meta["dim"]:
+                return
+            self._apply({user_id: vec}, set())
+
+    def remove(self, user_id: str):
+        with _file_lock(self.lock_path):
+            self.refresh()
+            if self.meta is None or user_id not in self.pos:
+                return
+            self._apply({}, {user_id})
+
+    def _fetch_changes(self, since: datetime, boundary: dict):
+        """
+        按 (updated_at, id) 键集分批读取 updated_at >= since 的行
+
+        updated_at 精度为秒，水位线所在的那一秒中可能还有之后才更新的行，因此从 since（含）开始读，
+        再跳过 boundary 中记录过、且特征摘要未变化的行；没有变化时不写任何文件。
+
+        返回:
+            (变化的行, 新水位线, 新水位线上全部行的 {id: 摘要})
+        """
+        from app.db.connection import get_connection
+
+        conn = get_connection()
+        if not conn:
+            raise RuntimeError("数据库连接失败")
+        cursor = conn.cursor()
+        fetched = []
+        try:
+            cursor.execute(
+                "SELECT id, face_feature, updated_at FROM user_info "
+                "WHERE updated_at >= %s ORDER BY updated_at, id LIMIT %s",
+                (since, SYNC_BATCH)
+            )
+            while True:
+                rows = cursor.fetchall()
+                fetched.extend(rows)
+                if len(rows) < SYNC_BATCH:
+                    break
+                last_time, last_id = rows[-1][2], rows[-1][0]
+                cursor.execute(
+                    "SELECT id, face_feature, updated_at FROM user_info "
+                    "WHERE updated_at > %s OR (updated_at = %s AND id > %s) ORDER BY updated_at, id LIMIT %s",
+                    (last_time, last_time, last_id, SYNC_BATCH)
+                )
+        finally:
+            cursor.close()
+            conn.close()
+
+        changed = [r for r in fetched
+                   if not (r[2] == since and r[0] in boundary and boundary[r[0]] == _feature_digest(r[1]))]
+        watermark = max((r[2] for r in fetched if r[2] is not None), default=since)
+        new_boundary = {r[0]: _feature_digest(r[1]) for r in fetched if r[2] == watermark}
+        return changed, watermark, new_boundary
+
+    def sync(self, projection=None, force: bool = False):
+        """
+        增量同步: 只处理水位线之后变化的行，代价为 O(变化数)
+
+        快照不存在或投影版本变化时全量重建。
+        """
+        now = time.monotonic()
+        if not force and now - self._last_sync < SYNC_INTERVAL and self.exists():
+            return
+        self._last_sync = now
+
+        proj_id = projection.version if projection is not None else 0
+        with _file_lock(self.lock_path):
+            self.refresh()
+            if self.meta is None or self.meta.get("proj_id", 0) != proj_id:
+                self.rebuild(projection)
+                return
+
+            watermark = self.meta.get("watermark")
+            since = datetime.fromisoformat(watermark) if watermark else datetime(1970, 1, 1)
+            try:
+                changed, new_watermark, boundary = self._fetch_changes(since, self.meta.get("boundary") or {})
+            except Exception as e:
+                logger.error(f"底库快照同步失败: {e}")
+                return
+            if not changed:
+                return
+
+            with_feature = [(r[0], r[1]) for r in changed if r[1] is not None]
+            gallery = Gallery.from_rows(with_feature, dim=LEGACY_SHAPE[0], projection=projection)
+            upserts = {uid: gallery.matrix[i] for i, uid in enumerate(gallery.ids)}
+            # 清空特征或特征无法解析的用户都从快照中移除
+            removals = {r[0] for r in changed if r[0] not in upserts}
+            removed = len([uid for uid in removals if uid in self.pos])
+            self._apply(upserts, removals, watermark=new_watermark.isoformat(), boundary=boundary)
+            logger.info(f"底库快照增量同步: 更新 {len(upserts)} 人, 移除 {removed} 人")
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_gallery_snapshot() -> GallerySnapshot:
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = GallerySnapshot()
+        return _snapshot
+
+
+def load_student_gallery(cursor, student_ids, projection=None) -> Gallery:
+    """
+    构建指定学生的底库: 优先从 mmap 快照取，快照中没有的再从数据库读取 BLOB
+
+    参数:
+        cursor: 数据库游标（回源时使用）
+        student_ids: 学生 id 列表
+        projection: 当前启用的降维投影
+    """
+    snapshot = get_gallery_snapshot()
+    found, matrix = [], None
+    try:
+        snapshot.sync(projection)
+        if snapshot.meta and snapshot.meta.get("proj_id", 0) == (projection.version if projection else 0):
+            found, matrix = snapshot.lookup(student_ids)
+    except Exception as e:
+        logger.error(f"读取底库快照失败，回源数据库: {e}", exc_info=True)
+        found, matrix = [], None
+
+    found_set = set(found)
+    missing = [sid for sid in student_ids if sid not in found_set]
+    if not missing:
+        return Gallery(found, matrix, projection)
+
+    cursor.execute(
+        "SELECT id, face_feature FROM user_info WHERE id IN ({})".format(",".join(["%s"] * len(missing))),
+        tuple(missing)
+    )
+    extra = Gallery.from_rows(cursor.fetchall(), projection=projection)
+    if not found:
+        return extra
+    return Gallery(found + extra.ids, np.concatenate([matrix, extra.matrix]), projection)
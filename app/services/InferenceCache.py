@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from app.utils.FeatureBinaryConver import DEFAULT_MODEL_ID
+
+logger = logging.getLogger()
+
+# 内存缓存上限（字节），0 表示关闭缓存
+CACHE_MAX_BYTES = int(os.environ.get("INFERENCE_CACHE_BYTES", str(64 * 1024 * 1024)))
+# 淘汰条目溢出到磁盘的目录，为空表示不溢出
+CACHE_SPILL_DIR = os.environ.get("INFERENCE_CACHE_SPILL_DIR", "")
+# 磁盘溢出上限（字节）
+CACHE_DISK_MAX_BYTES = int(os.environ.get("INFERENCE_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+
+# 模型版本: 更换模型或权重时修改，旧缓存自动失效
+MODEL_VERSION = f"m{DEFAULT_MODEL_ID}-vggface2-20180402"
+
+
+class InferenceResult:
+    """
+    一张图片的推理结果: 通过质量检查的人脸特征与位置框、被过滤的人脸，
+    以及各签到任务中已保存的裁剪图 id（重试时不再重复保存）
+    """
+
+    def __init__(self, features, boxes, rejected, crops=None):
+        self.features = np.asarray(features, dtype=np.float32).reshape(len(features), -1) if len(features) else \
+            np.empty((0, 0), dtype=np.float32)
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.rejected = rejected
+        self.crops = crops or {}  # sign_task_id -> [crop_id, ...]
+
+    @property
+    def nbytes(self) -> int:
+        meta = len(json.dumps(self.rejected)) + sum(len(v) * 16 for v in self.crops.values())
+        return self.features.nbytes + self.boxes.nbytes + meta + 256
+
+    def save(self, path: Path):
+        tmp = path.with_name(path.name + ".tmp.npz")
+        meta = json.dumps({"rejected": self.rejected, "crops": self.crops})
+        np.savez(tmp, features=self.features, boxes=self.boxes, meta=np.array(meta))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            return cls(list(data["features"]), data["boxes"], meta["rejected"], meta["crops"])
+
+
+class InferenceCache:
+    """
+    以图片内容哈希 + 模型版本 + 质量配置为键的推理结果缓存
+
+    - 内存中为按字节数限制的 LRU
+    - 配置了溢出目录时，被淘汰的条目写入磁盘，命中后重新载入内存；磁盘超过上限时删除最旧的文件
+    """
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, spill_dir: str = CACHE_SPILL_DIR,
+                 disk_max_bytes: int = CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(content: bytes, profile: str = "") -> str:
+        return f"{hashlib.sha256(content).hexdigest()}-{MODEL_VERSION}-{profile}"
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _spill_path(self, key: str) -> Path:
+        return self.spill_dir / f"{key}.npz"
+
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+        with self._lock:
+            result = self._items.get(key)
+            if result is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return result
+        if self.spill_dir is not None:
+            path = self._spill_path(key)
+            if path.exists():
+                try:
+                    result = InferenceResult.load(path)
+                    os.remove(path)
+                    self.put(key, result)
+                    with self._lock:
+                        self.hits += 1
+                    return result
+                except Exception as e:
+                    logger.error(f"读取推理缓存溢出文件失败: {path}, {e}")
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, result: InferenceResult):
+        if not self.enabled:
+            return
+        evicted = []
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._items[key] = result
+            self._bytes += result.nbytes
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                k, v = self._items.popitem(last=False)
+                self._bytes -= v.nbytes
+                evicted.append((k, v))
+        if evicted and self.spill_dir is not None:
+            self._spill(evicted)
+
+    def add_crops(self, key: str, sign_task_id: str, crop_ids):
+        """记录该图片在某签到任务中已保存的裁剪图"""
+        with self._lock:
+            result = self._items.get(key)
+            if result is not None:
+                self._bytes -= result.nbytes
+                result.crops[sign_task_id] = list(crop_ids)
+                self._bytes += result.nbytes
+
+    def _spill(self, evicted):
+        try:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            for k, v in evicted:
+                v.save(self._spill_path(k))
+            files = sorted(self.spill_dir.glob("*.npz"), key=lambda p: p.stat().st_mtime)
+            total = sum(p.stat().st_size for p in files)
+            while files and total > self.disk_max_bytes:
+                oldest = files.pop(0)
+                total -= oldest.stat().st_size
+                oldest.unlink()
+        except Exception as e:
+            logger.error(f"推理缓存溢出到磁盘失败: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "spill_dir": str(self.spill_dir) if self.spill_dir else None,
+            }
+
+
+inference_cache = InferenceCache()
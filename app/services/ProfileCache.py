@@ -0,0 +1,197 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.db.connection import get_connection
+
+logger = logging.getLogger()
+
+# 缓存条目存活秒数，0 表示关闭缓存；多 worker 部署时其他 worker 的修改最多延迟这么久可见
+PROFILE_CACHE_TTL = float(os.environ.get("PROFILE_CACHE_TTL", "60"))
+# 用户资料最多缓存的条目数（每个 id / phone / student_id 键各占一条）
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", "20000"))
+
+USER_FIELDS = ("id", "phone", "student_id")
+
+USER_PROFILE_SQL = "SELECT id, phone, role, name, student_id, password FROM user_info WHERE {} = %s LIMIT 1"
+CLASS_LIST_SQL = "SELECT id, `name` FROM class ORDER BY id"
+
+
+class TTLCache:
+    """
+    带过期时间的 LRU 缓存（线程安全）
+
+    只缓存查到的值，不缓存“不存在”，新增数据不需要失效。
+    每次失效递增 generation；读库前记下 generation，写回时若已变化则丢弃，
+    避免读库期间发生的修改被旧值覆盖。
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._items = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] > now:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, generation: int):
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def discard_where(self, predicate) -> int:
+        """删除值满足 predicate 的全部条目，返回删除数"""
+        with self._lock:
+            self.generation += 1
+            keys = [k for k, (_, v) in self._items.items() if predicate(v)]
+            for k in keys:
+                del self._items[k]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._items.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def _password_digest(password) -> str:
+    return hashlib.sha256(str(password).encode("utf-8")).hexdigest()
+
+
+class ProfileCache:
+    """
+    用户资料（按 id / phone / student_id）与班级列表的读穿透缓存
+
+    - 用户资料: 同一用户按不同字段查询各占一条，失效时按用户 id 一并删除；
+      缓存中只保存密码的 SHA-256 摘要，登录时比对摘要
+    - 班级列表: 整表一条，附带按内容计算的 ETag，各 worker 对相同数据得到相同 ETag
+    修改 user_info / class 的接口在提交后调用 invalidate_user / invalidate_classes
+    """
+
+    def __init__(self, ttl: float = PROFILE_CACHE_TTL, max_entries: int = PROFILE_CACHE_SIZE):
+        self.users = TTLCache(ttl, max_entries)
+        self.classes = TTLCache(ttl, 1)
+
+    @staticmethod
+    def _query(cursor, sql, params, fetch_all=False):
+        """cursor 为 None 时临时打开一个连接"""
+        if cursor is not None:
+            cursor.execute(sql, params)
+            return cursor.fetchall() if fetch_all else cursor.fetchone()
+        conn = get_connection()
+        if not conn:
+            raise RuntimeError("数据库连接失败")
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute(sql, params)
+                return cur.fetchall() if fetch_all else cur.fetchone()
+            finally:
+                cur.close()
+        finally:
+            conn.close()
+
+    def get_user(self, field: str, value, cursor=None):
+        """
+        按 id / phone / student_id 查询用户资料
+
+        返回:
+            {"id", "phone", "role", "name", "student_id", "password_digest"}；用户不存在时返回 None
+        """
+        if field not in USER_FIELDS:
+            raise ValueError(f"不支持的查询字段: {field}")
+        key = (field, value)
+        user = self.users.get(key)
+        if user is not None:
+            return user
+        generation = self.users.generation
+        row = self._query(cursor, USER_PROFILE_SQL.format(field), (value,))
+        if not row:
+            return None
+        uid, phone, role, name, student_id, password = row
+        user = {
+            "id": uid,
+            "phone": phone,
+            "role": role,
+            "name": name,
+            "student_id": student_id,
+            "password_digest": _password_digest(password),
+        }
+        self.users.put(key, user, generation)
+        return user
+
+    def user_exists(self, user_id: str, cursor=None) -> bool:
+        return self.get_user("id", user_id, cursor) is not None
+
+    @staticmethod
+    def check_password(user: dict, password) -> bool:
+        return hmac.compare_digest(user["password_digest"], _password_digest(password))
+
+    def invalidate_user(self, user_id: str):
+        self.users.discard_where(lambda user: user["id"] == user_id)
+
+    def get_classes(self, cursor=None):
+        """
+        返回:
+            (班级列表 [{"id", "name"}], ETag)
+        """
+        cached = self.classes.get("all")
+        if cached is not None:
+            return cached
+        generation = self.classes.generation
+        rows = self._query(cursor, CLASS_LIST_SQL, (), fetch_all=True)
+        classes = [{"id": r[0], "name": r[1]} for r in rows] if rows else []
+        raw = json.dumps(classes, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        etag = f'"{hashlib.sha1(raw).hexdigest()}"'
+        self.classes.put("all", (classes, etag), generation)
+        return classes, etag
+
+    def invalidate_classes(self):
+        self.classes.clear()
+
+    def stats(self) -> dict:
+        return {"users": self.users.stats(), "classes": self.classes.stats()}
+
+
+profile_cache = ProfileCache()
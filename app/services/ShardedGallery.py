@@ -0,0 +1,339 @@
+import atexit
+import logging
+import multiprocessing as mp
+import os
+import threading
+
+import numpy as np
+
+logger = logging.getLogger()
+
+# 分片数量，0 表示不启用分片（全校检索使用 ANN 索引）
+GALLERY_SHARDS = int(os.environ.get("GALLERY_SHARDS", "0"))
+
+# 最大分片与最小分片人数之比超过该值时触发再平衡
+REBALANCE_RATIO = 1.2
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    norm = np.linalg.norm(x, axis=-1, keepdims=True)
+    norm[norm == 0] = 1.0
+    return x / norm
+
+
+def _shard_main(conn, dim):
+    """
+    分片工作进程: 持有一部分底库，响应父进程的命令
+
+    命令: (cmd, payload)
+        reset  dim            清空分片并改用新的特征维度（快照换代时）
+        load   (ids, matrix)  追加一批用户
+        upsert (id, vec)
+        remove id
+        take   n              取出 n 个用户（用于再平衡），返回 (ids, matrix)
+        search (queries, k)   返回 (top_ids, top_scores)，均为 (M, k') 数组
+        size   None
+        stop   None
+    """
+    ids = []
+    pos = {}
+    matrix = np.empty((0, dim), dtype=np.float32)
+    count = 0
+
+    def ensure(n):
+        nonlocal matrix
+        if n > len(matrix):
+            grown = np.empty((max(n, int(len(matrix) * 1.5) + 256), dim), dtype=np.float32)
+            grown[:count] = matrix[:count]
+            matrix = grown
+
+    def add(uid, vec):
+        nonlocal count
+        row = pos.get(uid)
+        if row is None:
+            ensure(count + 1)
+            row = count
+            count += 1
+            ids.append(uid)
+            pos[uid] = row
+        matrix[row] = vec
+
+    def drop(uid):
+        nonlocal count
+        row = pos.pop(uid, None)
+        if row is None:
+            return False
+        last = count - 1
+        if row != last:
+            # 用最后一行填补空洞，保持矩阵紧凑
+            moved = ids[last]
+            matrix[row] = matrix[last]
+            ids[row] = moved
+            pos[moved] = row
+        ids.pop()
+        count -= 1
+        return True
+
+    while True:
+        try:
+            cmd, payload = conn.recv()
+        except EOFError:
+            break
+        try:
+            if cmd == "reset":
+                dim = payload
+                ids = []
+                pos = {}
+                matrix = np.empty((0, dim), dtype=np.float32)
+                count = 0
+                conn.send(0)
+            elif cmd == "load":
+                batch_ids, batch = payload
+                ensure(count + len(batch_ids))
+                for uid, vec in zip(batch_ids, batch):
+                    add(uid, vec)
+                conn.send(count)
+            elif cmd == "upsert":
+                add(payload[0], payload[1])
+                conn.send(count)
+            elif cmd == "remove":
+                conn.send(drop(payload))
+            elif cmd == "take":
+                n = min(payload, count)
+                taken_ids = ids[count - n:count]
+                taken = matrix[count - n:count].copy()
+                for uid in reversed(taken_ids):
+                    drop(uid)
+                conn.send((taken_ids, taken))
+            elif cmd == "search":
+                queries, k = payload
+                if count == 0:
+                    conn.send((np.empty((len(queries), 0), dtype=object), np.empty((len(queries), 0), dtype=np.float32)))
+                    continue
+                scores = queries @ matrix[:count].T
+                k = min(k, count)
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                top_scores = np.take_along_axis(scores, top, axis=1)
+                id_arr = np.array(ids[:count], dtype=object)
+                conn.send((id_arr[top], top_scores))
+            elif cmd == "size":
+                conn.send(count)
+            elif cmd == "stop":
+                conn.send(True)
+                break
+            else:
+                conn.send(ValueError(f"未知命令: {cmd}"))
+        except Exception as e:
+            conn.send(e)
+    conn.close()
+
+
+class ShardedGallery:
+    """
+    分片底库: 每个分片是一个独立的本地进程，各自持有一部分 L2 归一化特征
+
+    - 查询: 同时发送给所有分片（scatter），各分片返回本地 top-k，父进程合并（gather）
+    - 新增: 放到人数最少的分片
+    - 删除: 从所在分片移除，分片人数失衡时从大分片搬迁用户到小分片
+    - 服务中通过 follow_snapshot 跟随底库快照的行号日志，各 worker 看到相同的增删
+
+    参数:
+        dim: 特征维度；为 None 时在首次 reset 时确定
+    """
+
+    def __init__(self, num_shards: int, dim: int = None):
+        if num_shards < 1:
+            raise ValueError("分片数量必须 >= 1")
+        self.dim = dim
+        self.placement = {}  # user_id -> 分片号
+        self.sizes = [0] * num_shards
+        self._lock = threading.Lock()
+        self._follow_lock = threading.Lock()
+        self._source = (None, 0)  # 已跟随到的快照 (gen, 日志 offset)
+        # 使用 fork: spawn / forkserver 会在子进程中重新执行 app.main（启动服务、加载模型）。
+        # fork 只复制调用线程，必须在父进程启动其他线程（模型推理、后台归档、续租等）之前创建，
+        # 见 start_sharded_gallery；分片进程只使用 NumPy
+        ctx = mp.get_context("fork")
+        self._conns = []
+        self._procs = []
+        for i in range(num_shards):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_shard_main, args=(child, dim or 0), name=f"gallery-shard-{i}", daemon=True)
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+        logger.info(f"分片底库已启动: {num_shards} 个分片, dim={dim}")
+
+    @property
+    def num_shards(self) -> int:
+        return len(self._conns)
+
+    def __len__(self):
+        return len(self.placement)
+
+    def _call(self, shard: int, cmd: str, payload=None):
+        self._conns[shard].send((cmd, payload))
+        result = self._conns[shard].recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def reset(self, dim: int):
+        """清空全部分片并改用新的特征维度"""
+        with self._lock:
+            for shard in range(self.num_shards):
+                self._call(shard, "reset", dim)
+            self.dim = dim
+            self.placement = {}
+            self.sizes = [0] * self.num_shards
+
+    def load(self, ids, matrix: np.ndarray):
+        """批量加载（按轮转顺序平均分配到各分片）"""
+        matrix = _normalize(matrix)
+        with self._lock:
+            for shard in range(self.num_shards):
+                sel = list(range(shard, len(ids), self.num_shards))
+                if not sel:
+                    continue
+                self.sizes[shard] = self._call(shard, "load", ([ids[i] for i in sel], matrix[sel]))
+                for i in sel:
+                    self.placement[ids[i]] = shard
+
+    def upsert(self, user_id: str, vec: np.ndarray):
+        vec = _normalize(np.asarray(vec, dtype=np.float32).reshape(-1))
+        with self._lock:
+            shard = self.placement.get(user_id)
+            if shard is None:
+                shard = int(np.argmin(self.sizes))
+            self.sizes[shard] = self._call(shard, "upsert", (user_id, vec))
+            self.placement[user_id] = shard
+
+    def remove(self, user_id: str):
+        with self._lock:
+            shard = self.placement.pop(user_id, None)
+            if shard is None:
+                return
+            if self._call(shard, "remove", user_id):
+                self.sizes[shard] -= 1
+            self._rebalance_locked()
+
+    def rebalance(self):
+        with self._lock:
+            self._rebalance_locked()
+
+    def _rebalance_locked(self):
+        """从最大分片向最小分片搬迁用户，直到人数比例不超过 REBALANCE_RATIO"""
+        while True:
+            big = int(np.argmax(self.sizes))
+            small = int(np.argmin(self.sizes))
+            if self.sizes[big] - self.sizes[small] <= 1 or self.sizes[big] <= self.sizes[small] * REBALANCE_RATIO:
+                return
+            n = (self.sizes[big] - self.sizes[small]) // 2
+            moved_ids, moved = self._call(big, "take", n)
+            self.sizes[big] -= len(moved_ids)
+            self.sizes[small] = self._call(small, "load", (moved_ids, moved))
+            for uid in moved_ids:
+                self.placement[uid] = small
+            logger.info(f"分片再平衡: {len(moved_ids)} 人 从分片 {big} 迁移到 {small}")
+
+    def search(self, queries: np.ndarray, k: int = 5):
+        """
+        scatter-gather 精确检索
+
+        返回:
+            长度为 M 的列表，每项为 [(user_id, 余弦相似度), ...]，按相似度降序
+        """
+        q = _normalize(np.atleast_2d(queries))
+        with self._lock:
+            # 先全部发送再逐个接收，各分片并行计算
+            for conn in self._conns:
+                conn.send(("search", (q, k)))
+            parts = []
+            for conn in self._conns:
+                result = conn.recv()
+                if isinstance(result, Exception):
+                    raise result
+                parts.append(result)
+
+        all_ids = np.concatenate([p[0] for p in parts], axis=1)
+        all_scores = np.concatenate([p[1] for p in parts], axis=1)
+        results = []
+        for i in range(len(q)):
+            order = np.argsort(-all_scores[i])[:k]
+            results.append([(all_ids[i, j], float(all_scores[i, j])) for j in order])
+        return results
+
+    def follow_snapshot(self, snapshot):
+        """
+        按底库快照的行号日志增量更新分片（其他 worker 的上传、删除也经快照同步到这里）；
+        快照换代（全量重建、压缩、投影版本变化）时整体重新加载
+        """
+        with self._follow_lock:
+            gen, offset = self._source
+            changes = snapshot.changes_since(gen, offset)
+            if changes is None:
+                return
+            new_gen, new_offset, full, ids, matrix, removed = changes
+            if full:
+                self.reset(matrix.shape[1])
+                if ids:
+                    self.load(ids, matrix)
+                logger.info(f"分片底库已从快照重新加载: {len(ids)} 人, gen={new_gen}")
+            else:
+                for uid, vec in zip(ids, matrix):
+                    self.upsert(uid, vec)
+                for uid in removed:
+                    self.remove(uid)
+            self._source = (new_gen, new_offset)
+
+    def close(self):
+        with self._lock:
+            for shard in range(self.num_shards):
+                try:
+                    self._call(shard, "stop")
+                except Exception:
+                    pass
+            for proc in self._procs:
+                proc.join(timeout=5)
+
+
+_sharded = None
+_sharded_lock = threading.Lock()
+
+
+def start_sharded_gallery():
+    """
+    启动分片进程（GALLERY_SHARDS > 0 时），需在服务启动时、加载模型和启动任何后台线程之前调用（app/main.py）
+
+    此时分片为空，首次检索时从底库快照加载。
+    """
+    global _sharded
+    if GALLERY_SHARDS <= 0:
+        return None
+    if os.name == "nt":
+        logger.warning("Windows 不支持 fork，分片底库未启用")
+        return None
+    with _sharded_lock:
+        if _sharded is None:
+            _sharded = ShardedGallery(GALLERY_SHARDS)
+            atexit.register(_sharded.close)
+        return _sharded
+
+
+def get_sharded_gallery(projection=None):
+    """
+    获取进程内的分片底库，并跟随底库快照同步到最新
+
+    未通过 start_sharded_gallery 启动时返回 None（使用 ANN 索引）。
+    """
+    if _sharded is None:
+        return None
+
+    from app.services.GallerySnapshot import get_gallery_snapshot
+
+    snapshot = get_gallery_snapshot()
+    snapshot.sync(projection)
+    _sharded.follow_snapshot(snapshot)
+    return _sharded
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger()
+
+# 每个订阅者最多积压的事件数，超过后丢弃积压事件，改为让订阅者重新加载快照
+MAX_PENDING_EVENTS = 256
+
+# 队列溢出标记: 订阅者收到后应重新读取完整快照
+RESYNC = {"type": "resync"}
+
+
+class Subscription:
+    """一个 SSE 连接的订阅，事件队列绑定在订阅时所在的事件循环上"""
+
+    def __init__(self, sign_task_id: str, loop: asyncio.AbstractEventLoop, max_pending: int):
+        self.sign_task_id = sign_task_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.dropped = 0
+
+    def _offer(self, event: dict):
+        """在事件循环线程中执行；队列满时清空积压，只留下 RESYNC"""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put_nowait(RESYNC)
+            logger.warning(f"签到事件订阅者处理过慢，丢弃积压事件并要求重新加载: sign_task_id={self.sign_task_id}")
+
+    async def get(self, timeout: float):
+        """等待下一个事件，超时返回 None"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class StudentSignVersions:
+    """
+    每个学生“进行中签到”的版本号（进程内），供学生端长轮询
+
+    发布、关闭签到以及签到状态变化时递增相关学生的版本号并唤醒等待中的请求；
+    版本号未变化的请求只在内存中等待，不查询数据库。
+    令牌带有进程启动标识，服务重启或请求落到其他 worker 时令牌必然不一致，客户端会立即拿到最新数据。
+    """
+
+    def __init__(self):
+        self.boot_id = format(int(time.time() * 1000), "x")
+        self._versions = {}  # student_id -> int
+        self._waiters = {}  # student_id -> set((loop, asyncio.Event))
+        self._lock = threading.Lock()
+
+    def _token(self, student_id: str) -> str:
+        return f"{self.boot_id}-{self._versions.get(student_id, 0)}"
+
+    def token(self, student_id: str) -> str:
+        with self._lock:
+            return self._token(student_id)
+
+    def bump(self, student_ids):
+        """线程安全，可在任意线程调用"""
+        wake = []
+        with self._lock:
+            for student_id in student_ids:
+                self._versions[student_id] = self._versions.get(student_id, 0) + 1
+                wake.extend(self._waiters.pop(student_id, ()))
+        for loop, event in wake:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass
+
+    async def wait(self, student_id: str, token: str, timeout: float) -> str:
+        """
+        令牌与当前版本一致时等待，直到版本变化或超时
+
+        返回:
+            等待结束时的令牌（与传入的相同表示超时未变化）
+        """
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            current = self._token(student_id)
+            if current != token:
+                return current
+            self._waiters.setdefault(student_id, set()).add(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(student_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[student_id]
+        return self.token(student_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "students": len(self._versions),
+                "waiting": sum(len(w) for w in self._waiters.values()),
+            }
+
+
+student_sign_versions = StudentSignVersions()
+
+
+class SignEventBus:
+    """
+    进程内的签到事件发布/订阅，按 sign_task_id 分组
+
+    发布方是同步接口（运行在线程池中），订阅方是 SSE 的异步生成器，
+    事件通过 call_soon_threadsafe 投递到订阅者所在的事件循环。
+    只在单进程内有效；多 worker 部署时每个 worker 只能收到本进程内的签到事件。
+    """
+
+    def __init__(self, max_pending: int = MAX_PENDING_EVENTS):
+        self.max_pending = max_pending
+        self._subs = {}  # sign_task_id -> set(Subscription)
+        self._lock = threading.Lock()
+
+    def subscribe(self, sign_task_id: str) -> Subscription:
+        """需在事件循环中调用"""
+        sub = Subscription(sign_task_id, asyncio.get_running_loop(), self.max_pending)
+        with self._lock:
+            self._subs.setdefault(sign_task_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subs.get(sub.sign_task_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.sign_task_id]
+
+    def publish(self, sign_task_id: str, event: dict):
+        """线程安全，可在任意线程调用；没有订阅者时不做任何事"""
+        with self._lock:
+            subs = list(self._subs.get(sign_task_id, ()))
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._offer, event)
+            except RuntimeError:
+                # 事件循环已关闭
+                self.unsubscribe(sub)
+
+    def publish_sign_status(self, sign_task_id: str, student_id: str, sign_status: int, face_score=None):
+        student_sign_versions.bump([student_id])
+        self.publish(sign_task_id, {
+            "type": "sign_status",
+            "sign_task_id": sign_task_id,
+            "user_id": student_id,
+            "sign_status": sign_status,
+            "face_score": face_score,
+        })
+
+    def publish_task_status(self, sign_task_id: str, task_status: int, student_ids=()):
+        """task_status 为 1 表示新发布，2 表示关闭；student_ids 为该任务的学生，用于唤醒学生端长轮询"""
+        student_sign_versions.bump(student_ids)
+        self.publish(sign_task_id, {"type": "task_status", "sign_task_id": sign_task_id, "task_status": task_status})
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tasks": len(self._subs),
+                "subscribers": sum(len(s) for s in self._subs.values()),
+            }
+
+
+sign_event_bus = SignEventBus()
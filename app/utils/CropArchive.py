@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，仅依赖进程内锁
+    fcntl = None
+
+logger = logging.getLogger()
+
+# 签到裁剪图归档目录，每个签到任务一个 .pack + 一个 .idx
+SIGN_IN_FACES_DIR = Path("app/static/signInFaces")
+
+# 注册时保存的对齐人脸图（160x160），所有用户共用一个打包文件
+FACE_CROPS_DIR = Path("app/static/faceCrops")
+FACE_CROPS_PACK = "enroll"
+
+# 进程内最多缓存的打包文件对象数量
+MAX_OPEN_PACKS = 256
+
+_NAME_RE = re.compile(r"^[0-9A-Za-z_\-]+$")
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class CropPack:
+    """
+    追加写入的裁剪图打包文件
+
+    文件布局:
+        <name>.pack  所有裁剪图字节顺序拼接，只追加不修改
+        <name>.idx   每行一条 JSON 索引，记录 crop_id、offset、length 及元数据
+
+    多个 worker 进程同时写入时通过 flock 保证 pack 与 idx 的追加顺序一致；
+    读取时只按 offset/length 读取单张图片，不需要加载整个 pack。
+    """
+
+    def __init__(self, base_dir, name: str):
+        if not name or not _NAME_RE.match(name):
+            raise ValueError(f"非法的打包文件名: {name}")
+        self.base_dir = Path(base_dir)
+        self.name = name
+        self.pack_path = self.base_dir / f"{name}.pack"
+        self.index_path = self.base_dir / f"{name}.idx"
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # crop_id -> entry
+        self._index_pos = 0  # 已解析的 idx 字节数
+        self._latest = {}  # 元数据键 -> {值: 最后一条条目}，首次按该键查询时建立
+
+    def append(self, data: bytes, **meta) -> dict:
+        """
+        追加一张裁剪图
+
+        参数:
+            data: 图片字节（通常为 JPEG）
+            meta: 附加元数据，如 idx, student_id, matched, distance
+
+        返回:
+            dict: 索引条目（含 crop_id, offset, length）
+        """
+        crop_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self.base_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.pack_path, "ab") as pf:
+                _lock_file(pf)
+                try:
+                    pf.seek(0, os.SEEK_END)
+                    offset = pf.tell()
+                    pf.write(data)
+                    pf.flush()
+                    entry = {
+                        "crop_id": crop_id,
+                        "offset": offset,
+                        "length": len(data),
+                        "created_at": int(time.time()),
+                    }
+                    entry.update(meta)
+                    with open(self.index_path, "a", encoding="utf-8") as xf:
+                        xf.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                finally:
+                    _unlock_file(pf)
+        return entry
+
+    def _refresh_index(self):
+        """增量读取 idx 中新追加的行（只解析完整的行）"""
+        if not self.index_path.exists():
+            return
+        with open(self.index_path, "rb") as xf:
+            xf.seek(self._index_pos)
+            chunk = xf.read()
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line.decode("utf-8"))
+                self._index[entry["crop_id"]] = entry
+                for key, latest in self._latest.items():
+                    if key in entry:
+                        latest[entry[key]] = entry
+            except Exception as e:
+                logger.error(f"解析裁剪图索引失败: {self.index_path}: {e}")
+        self._index_pos += end + 1
+
+    def entries(self) -> list:
+        """返回全部索引条目（按写入顺序）"""
+        with self._lock:
+            self._refresh_index()
+            return list(self._index.values())
+
+    def get_entry(self, crop_id: str):
+        with self._lock:
+            entry = self._index.get(crop_id)
+            if entry is None:
+                self._refresh_index()
+                entry = self._index.get(crop_id)
+            return entry
+
+    def latest(self, key: str, value):
+        """返回元数据 key == value 的最后一条索引条目（同一用户多次上传时取最新）"""
+        with self._lock:
+            # 新追加的条目（包括本进程 append 写入的）由 _refresh_index 并入 _latest
+            self._refresh_index()
+            latest = self._latest.get(key)
+            if latest is None:
+                latest = {entry[key]: entry for entry in self._index.values() if key in entry}
+                self._latest[key] = latest
+            return latest.get(value)
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        with open(self.pack_path, "rb") as pf:
+            pf.seek(offset)
+            return pf.read(length)
+
+    def read(self, crop_id: str):
+        """
+        按 crop_id 读取单张裁剪图
+
+        返回:
+            (bytes, entry)，不存在时返回 (None, None)
+        """
+        entry = self.get_entry(crop_id)
+        if entry is None:
+            return None, None
+        data = self.read_range(entry["offset"], entry["length"])
+        if len(data) != entry["length"]:
+            logger.error(f"裁剪图数据不完整: {self.pack_path} crop_id={crop_id}")
+            return None, None
+        return data, entry
+
+
+_packs = OrderedDict()
+_packs_lock = threading.Lock()
+
+
+def get_pack(base_dir, name: str) -> CropPack:
+    """获取（并缓存）指定目录下的打包文件对象"""
+    key = (str(base_dir), name)
+    with _packs_lock:
+        pack = _packs.get(key)
+        if pack is None:
+            pack = CropPack(base_dir, name)
+            _packs[key] = pack
+            if len(_packs) > MAX_OPEN_PACKS:
+                _packs.popitem(last=False)
+        else:
+            _packs.move_to_end(key)
+        return pack
+
+
+def get_sign_in_pack(sign_task_id: str) -> CropPack:
+    """签到任务对应的裁剪图打包文件"""
+    return get_pack(SIGN_IN_FACES_DIR, sign_task_id)
+
+
+def get_face_crop_pack() -> CropPack:
+    """注册对齐人脸图的打包文件"""
+    return get_pack(FACE_CROPS_DIR, FACE_CROPS_PACK)
+
+
+def read_face_crop(user_id: str):
+    """
+    读取用户最新的注册对齐人脸图
+
+    返回:
+        (bytes, entry)，不存在时返回 (None, None)
+    """
+    pack = get_face_crop_pack()
+    entry = pack.latest("user_id", user_id)
+    if entry is None:
+        return None, None
+    return pack.read(entry["crop_id"])
+
+
+def crop_url(sign_task_id: str, crop_id: str) -> str:
+    return f"/api/sign_task/crop/{sign_task_id}/{crop_id}"
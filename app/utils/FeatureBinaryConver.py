@@ -1,29 +1,202 @@
+import os
+import struct
+from collections import namedtuple
+
 import numpy as np
 
 
-def feature_to_bytes(feature: np.ndarray) -> bytes:
+# -----------------------------
+# 版本化特征编码
+# -----------------------------
+# 头部布局（小端）:
+#   v1 (14 字节): magic(2s) version(B) dtype(B) flags(B) 保留(x) model_id(H) dim(H) scale(f)
+#   v2 (16 字节): v1 + proj_id(H)，proj_id 为降维投影版本，0 表示原始特征空间
+# 旧数据为无头部的 float32 原始字节（512 维 = 2048 字节），仍可读取
+
+MAGIC = b"FV"
+HEADER_VERSION = 2
+_HEADERS = {
+    1: struct.Struct("<2sBBBxHHf"),
+    2: struct.Struct("<2sBBBxHHfH"),
+}
+_HEADER = _HEADERS[HEADER_VERSION]
+HEADER_SIZE = _HEADER.size
+
+DTYPE_FLOAT32 = 0
+DTYPE_FLOAT16 = 1
+DTYPE_INT8 = 2
+
+# 编码名称 -> (dtype 代码, numpy dtype)
+ENCODINGS = {
+    "float32": (DTYPE_FLOAT32, np.dtype("<f4")),
+    "float16": (DTYPE_FLOAT16, np.dtype("<f2")),
+    "int8": (DTYPE_INT8, np.dtype("i1")),
+}
+_DTYPE_BY_CODE = {code: dt for code, dt in ENCODINGS.values()}
+
+FLAG_NORMALIZED = 0x01
+
+# 模型编号，更换模型/权重时新增
+MODEL_VGGFACE2 = 1  # InceptionResnetV1 + VGGFace2 权重
+DEFAULT_MODEL_ID = MODEL_VGGFACE2
+
+# 新写入特征使用的编码，可通过环境变量切换
+DEFAULT_ENCODING = os.environ.get("FEATURE_ENCODING", "float32")
+
+LEGACY_SHAPE = (512,)
+
+FeatureHeader = namedtuple("FeatureHeader", "version dtype flags model_id dim scale proj_id size")
+
+
+def feature_to_bytes(feature: np.ndarray, encoding: str = None, model_id: int = DEFAULT_MODEL_ID,
+                     normalize: bool = None, proj_id: int = 0) -> bytes:
     """
-    将特征向量转换为二进制数据用于存储到数据库
-    
+    将特征向量转换为二进制数据用于存储到数据库（带版本头）
+
     参数:
         feature: numpy 数组，形状通常为 (512,)
-        
+        encoding: "float32" / "float16" / "int8"，默认取 FEATURE_ENCODING
+        model_id: 生成该特征的模型编号
+        normalize: 是否先做 L2 归一化并在头部标记；float16 / int8 总是归一化
+        proj_id: 特征所在的降维投影版本，0 表示未投影
+
     返回:
         bytes: 二进制数据
+
+    说明:
+        int8 使用对称量化，scale = max(|x|) / 127
+    """
+    encoding = encoding or DEFAULT_ENCODING
+    if encoding not in ENCODINGS:
+        raise ValueError(f"不支持的特征编码: {encoding}")
+    code, dt = ENCODINGS[encoding]
+
+    vec = np.asarray(feature, dtype=np.float32).reshape(-1)
+    flags = 0
+    scale = 1.0
+    if normalize or code != DTYPE_FLOAT32:
+        norm = float(np.linalg.norm(vec))
+        if norm > 0:
+            vec = vec / norm
+        flags |= FLAG_NORMALIZED
+
+    if code == DTYPE_INT8:
+        max_abs = float(np.max(np.abs(vec))) if vec.size else 0.0
+        scale = max_abs / 127.0 if max_abs > 0 else 1.0
+        payload = np.clip(np.round(vec / scale), -127, 127).astype(dt)
+    else:
+        payload = vec.astype(dt)
+
+    header = _HEADER.pack(MAGIC, HEADER_VERSION, code, flags, model_id, vec.size, scale, proj_id)
+    return header + payload.tobytes()
+
+
+def parse_header(feature_bytes: bytes):
+    """
+    解析特征头部
+
+    返回:
+        FeatureHeader，旧版无头部数据返回 None
     """
-    return feature.tobytes()
+    if len(feature_bytes) < 3 or feature_bytes[:2] != MAGIC:
+        return None
+    fmt = _HEADERS.get(feature_bytes[2])
+    if fmt is None or len(feature_bytes) < fmt.size:
+        return None
+    fields = fmt.unpack_from(feature_bytes)
+    version, code, flags, model_id, dim, scale = fields[1:7]
+    proj_id = fields[7] if len(fields) > 7 else 0
+    if code not in _DTYPE_BY_CODE:
+        return None
+    # 长度必须与头部声明一致，否则按旧版原始 float32 处理
+    if len(feature_bytes) != fmt.size + dim * _DTYPE_BY_CODE[code].itemsize:
+        return None
+    return FeatureHeader(version, code, flags, model_id, dim, scale, proj_id, fmt.size)
 
 
-def bytes_to_feature(feature_bytes: bytes, shape: tuple = (512,), dtype=np.float32) -> np.ndarray:
+def is_normalized(feature_bytes: bytes) -> bool:
+    """是否为带头部且已 L2 归一化的特征"""
+    header = parse_header(feature_bytes)
+    return header is not None and bool(header.flags & FLAG_NORMALIZED)
+
+
+def feature_dim(feature_bytes: bytes) -> int:
+    """返回特征维度"""
+    header = parse_header(feature_bytes)
+    if header is None:
+        return len(feature_bytes) // 4
+    return header.dim
+
+
+def decode_into(feature_bytes: bytes, out: np.ndarray):
+    """
+    将二进制特征直接解码到预分配的 float32 行（避免中间数组）
+
+    参数:
+        feature_bytes: 二进制数据（新旧格式均可）
+        out: float32 一维数组（通常为矩阵的一行）
+
+    返回:
+        FeatureHeader，旧版数据返回 None
+    """
+    header = parse_header(feature_bytes)
+    if header is None:
+        src = np.frombuffer(feature_bytes, dtype=np.float32)
+        if src.size != out.size:
+            raise ValueError(f"特征维度不匹配: {src.size} != {out.size}")
+        out[:] = src
+        return None
+
+    if header.dim != out.size:
+        raise ValueError(f"特征维度不匹配: {header.dim} != {out.size}")
+    src = np.frombuffer(feature_bytes, dtype=_DTYPE_BY_CODE[header.dtype], offset=header.size)
+    if header.dtype == DTYPE_INT8:
+        np.multiply(src, np.float32(header.scale), out=out, casting="unsafe")
+    else:
+        out[:] = src
+    return header
+
+
+def bytes_to_feature(feature_bytes: bytes, shape: tuple = LEGACY_SHAPE, dtype=np.float32) -> np.ndarray:
     """
     将二进制数据转换回特征向量
-    
+
     参数:
         feature_bytes: 二进制数据
-        shape: 特征向量的形状，默认 (512,)
-        dtype: 数据类型，默认 np.float32
-        
+        shape: 旧版无头部数据的形状，默认 (512,)
+        dtype: 旧版无头部数据的类型，默认 np.float32
+
+    返回:
+        numpy 数组（带头部的数据统一返回 float32）
+    """
+    header = parse_header(feature_bytes)
+    if header is None:
+        return np.frombuffer(feature_bytes, dtype=dtype).reshape(shape)
+    out = np.empty(header.dim, dtype=np.float32)
+    decode_into(feature_bytes, out)
+    return out
+
+
+def decode_matrix(blobs, dim: int = LEGACY_SHAPE[0]):
+    """
+    批量解码到一个预分配的 (N, dim) float32 矩阵
+
+    参数:
+        blobs: 二进制特征列表（None 或解析失败的项会被跳过）
+        dim: 特征维度
+
     返回:
-        numpy 数组
+        matrix: (M, dim) 矩阵，只包含成功解码的行
+        index: 长度为 M 的列表，对应 blobs 中的下标
     """
-    return np.frombuffer(feature_bytes, dtype=dtype).reshape(shape)
+    matrix = np.empty((len(blobs), dim), dtype=np.float32)
+    index = []
+    for i, blob in enumerate(blobs):
+        if blob is None:
+            continue
+        try:
+            decode_into(blob, matrix[len(index)])
+        except ValueError:
+            continue
+        index.append(i)
+    return matrix[:len(index)], index
@@ -0,0 +1,111 @@
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger()
+
+# dHash 汉明距离不超过该值的两帧视为近似重复
+DUPLICATE_HAMMING = 6
+
+
+def dhash(image: Image.Image, size: int = 8) -> int:
+    """
+    差值哈希: 缩小为 (size+1) x size 灰度图，比较相邻像素得到 size*size 位整数
+
+    对轻微抖动、压缩噪声不敏感，连拍中几乎不动的帧哈希相同或只差几位
+    """
+    small = np.asarray(image.convert("L").resize((size + 1, size), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).tobytes().hex(), 16)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class FrameDeduplicator:
+    """记录已处理帧的 dHash，判断新帧是否与其中任意一帧近似重复"""
+
+    def __init__(self, max_distance: int = DUPLICATE_HAMMING):
+        self.max_distance = max_distance
+        self.hashes = []
+
+    def is_duplicate(self, image: Image.Image) -> bool:
+        h = dhash(image)
+        if any(hamming(h, seen) <= self.max_distance for seen in self.hashes):
+            return True
+        self.hashes.append(h)
+        return False
+
+
+def iter_image_uploads(files):
+    """
+    逐张解码上传的图片（一次只在内存中保留一帧）
+
+    产出:
+        (帧序号, PIL Image 或 None)；无法解析的图片产出 None
+    """
+    for i, upload in enumerate(files):
+        try:
+            upload.file.seek(0)
+            image = Image.open(upload.file)
+            image.load()
+            yield i, image.convert("RGB")
+        except Exception as e:
+            logger.error(f"第 {i} 帧图片解析失败: {e}")
+            yield i, None
+
+
+def iter_video_frames(upload, sample_fps: float = 2.0, max_frames: int = 0):
+    """
+    流式解码上传的视频: 先按块写入临时文件，再用 OpenCV 逐帧读取，
+    只对采样帧做解码（其余帧只 grab 不 retrieve）
+
+    参数:
+        upload: FastAPI UploadFile
+        sample_fps: 每秒采样帧数
+        max_frames: 最多产出的帧数，0 表示不限制
+
+    产出:
+        (原视频中的帧序号, PIL Image)
+    """
+    import cv2
+
+    suffix = os.path.splitext(upload.filename or "")[1] or ".mp4"
+    tmp = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    try:
+        upload.file.seek(0)
+        shutil.copyfileobj(upload.file, tmp, length=1024 * 1024)
+        tmp.close()
+
+        cap = cv2.VideoCapture(tmp.name)
+        if not cap.isOpened():
+            raise ValueError("视频格式错误，无法解析")
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+            stride = max(1, int(round(fps / sample_fps))) if sample_fps > 0 else 1
+            index = 0
+            produced = 0
+            while True:
+                if not cap.grab():
+                    break
+                if index % stride == 0:
+                    ok, frame = cap.retrieve()
+                    if ok:
+                        yield index, Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                        produced += 1
+                        if max_frames and produced >= max_frames:
+                            break
+                index += 1
+        finally:
+            cap.release()
+    finally:
+        try:
+            tmp.close()
+            os.remove(tmp.name)
+        except OSError:
+            pass
@@ -0,0 +1,40 @@
+import base64
+import json
+from datetime import datetime
+
+# 分页游标与增量同步令牌: 把若干个值编码成对客户端不透明的字符串，客户端原样带回
+# 时间统一编码为 "YYYY-MM-DD HH:MM:SS"，可直接作为 SQL 参数与 datetime 列比较
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def encode_token(*values) -> str:
+    plain = [v.strftime(TIME_FORMAT) if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(plain, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_token(token: str, size: int):
+    """
+    解码 encode_token 生成的字符串
+
+    返回:
+        长度为 size 的值列表；格式不正确时抛出 ValueError
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw.decode("utf-8"))
+    except Exception:
+        raise ValueError("令牌格式错误")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("令牌格式错误")
+    return values
+
+
+def decode_time(value: str) -> str:
+    """校验令牌中的时间字段，返回原字符串"""
+    try:
+        datetime.strptime(value, TIME_FORMAT)
+    except (TypeError, ValueError):
+        raise ValueError("令牌格式错误")
+    return value
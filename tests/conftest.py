@@ -0,0 +1,32 @@
+"""
+需要 MySQL 的测试共用的测试库连接
+
+通过环境变量指定本地测试库（未设置 SIGNIN_TEST_DATABASE 或无法连接时相关测试跳过），不要指向线上库:
+    SIGNIN_TEST_DATABASE=signin_test SIGNIN_TEST_PASSWORD=... python -m pytest
+"""
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def mysql_conn():
+    mysql_connector = pytest.importorskip("mysql.connector")
+    database = os.environ.get("SIGNIN_TEST_DATABASE")
+    if not database:
+        pytest.skip("未设置 SIGNIN_TEST_DATABASE，跳过需要 MySQL 的测试")
+    try:
+        conn = mysql_connector.connect(
+            host=os.environ.get("SIGNIN_TEST_HOST", "localhost"),
+            port=int(os.environ.get("SIGNIN_TEST_PORT", "3306")),
+            user=os.environ.get("SIGNIN_TEST_USER", "root"),
+            password=os.environ.get("SIGNIN_TEST_PASSWORD", ""),
+            database=database,
+        )
+    except mysql_connector.Error as e:
+        pytest.skip(f"无法连接测试库: {e}")
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
@@ -0,0 +1,24 @@
+"""
+查询执行计划检查（app/scripts/check_query_plans.py 的 pytest 版本）
+
+测试库配置见 tests/conftest.py；测试库为空时按默认规模造数据（首次运行较慢）。
+"""
+import pytest
+
+pytest.importorskip("mysql.connector")
+plans = pytest.importorskip("app.scripts.check_query_plans")
+
+
+@pytest.fixture(scope="module")
+def plan_db(mysql_conn):
+    sample = plans.prepare(mysql_conn, seed_args=dict(
+        students=20000, classes=400, teachers=200, tasks=5000, class_size=50
+    ))
+    return mysql_conn, sample
+
+
+@pytest.mark.parametrize("name, query", plans.QUERIES, ids=[name for name, _ in plans.QUERIES])
+def test_query_uses_index(plan_db, name, query):
+    conn, sample = plan_db
+    plan, problems = plans.explain(conn, sample, query)
+    assert not problems, f"{name} 未走索引: {problems}; plan={plan}"
@@ -0,0 +1,81 @@
+"""签到归档: 仍有未结束班级的旧签到不能挡住后面任务的归档"""
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+sign_archive = pytest.importorskip("app.db.sign_archive")
+
+from app.db.id_generator import MAX_WORKERS, IdGenerator  # noqa: E402
+from app.db.migrate import migrate  # noqa: E402
+
+# 测试专用的固定 worker 编号（与 check_query_plans 的造数据编号不同）
+_ids = IdGenerator(worker_id=MAX_WORKERS - 2)
+
+
+def test_archive_continues_after_blocked_batch(monkeypatch):
+    results = iter([(0, 0, 2), (0, 0, 2), (3, 30, 0), (0, 0, 0)])
+    monkeypatch.setattr(sign_archive, "archive_batch", lambda conn, cutoff, batch_size: next(results))
+    assert sign_archive.archive(None, batch_size=2) == (3, 30)
+
+
+def test_archive_stops_after_repeatedly_blocked_batches(monkeypatch):
+    calls = []
+
+    def blocked(conn, cutoff, batch_size):
+        calls.append(cutoff)
+        return 0, 0, batch_size
+
+    monkeypatch.setattr(sign_archive, "archive_batch", blocked)
+    assert sign_archive.archive(None, batch_size=2) == (0, 0)
+    assert len(calls) == sign_archive.MAX_BLOCKED_BATCHES
+
+
+def _insert_task(cursor, created, statuses):
+    """发布一次签到（每个状态一个班级），每个班级一条签到记录，返回 sign_task_id"""
+    sign_task_id = _ids.next_id()
+    for status in statuses:
+        cursor.execute(
+            "INSERT INTO sign_task (id, sign_task_id, class_id, initiator, status, created_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            (_ids.next_id(), sign_task_id, _ids.next_id(), "test_archive", status, created)
+        )
+        cursor.execute(
+            "INSERT INTO sign_record (id, sign_task_id, student_id, sign_status, created_at) "
+            "VALUES (%s, %s, %s, 1, %s)",
+            (_ids.next_id(), sign_task_id, _ids.next_id(), created)
+        )
+    return sign_task_id
+
+
+def test_blocked_candidates_do_not_stall_archive(mysql_conn):
+    migrate(mysql_conn)
+    cursor = mysql_conn.cursor()
+    batch_size = 2
+    # 比可归档任务更早的 batch_size 次发布，各有一个班级仍在进行中
+    blocked = [_insert_task(cursor, datetime(1990, 1, 1, 8, i), (2, 1)) for i in range(batch_size)]
+    closed = _insert_task(cursor, datetime(1990, 6, 1), (2, 2))
+    mysql_conn.commit()
+    ids = blocked + [closed]
+    marks = ",".join(["%s"] * len(ids))
+    try:
+        cutoff = "1991-01-01 00:00:00"
+        cursor.execute(sign_archive.ARCHIVE_CANDIDATES_SQL, (cutoff, batch_size))
+        candidates = [r[0] for r in cursor.fetchall() if r[0] in ids]
+        mysql_conn.commit()
+        assert candidates == [closed]
+
+        # 测试库中可能还有其他可归档数据，只检查本测试写入的任务
+        sign_archive.archive(mysql_conn, days=(datetime.now() - datetime(1991, 1, 1)).days, batch_size=batch_size)
+        cursor.execute(f"SELECT DISTINCT sign_task_id FROM sign_task_archive WHERE sign_task_id IN ({marks})",
+                       tuple(ids))
+        assert [r[0] for r in cursor.fetchall()] == [closed]
+        cursor.execute(f"SELECT COUNT(DISTINCT sign_task_id) FROM sign_task WHERE sign_task_id IN ({marks})",
+                       tuple(ids))
+        assert cursor.fetchone()[0] == len(blocked)
+        mysql_conn.commit()
+    finally:
+        for table in ("sign_record", "sign_task", "sign_record_archive", "sign_task_archive"):
+            cursor.execute(f"DELETE FROM {table} WHERE sign_task_id IN ({marks})", tuple(ids))
+        mysql_conn.commit()
+        cursor.close()